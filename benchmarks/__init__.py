@@ -0,0 +1,2 @@
+# Banco de pruebas de rendimiento con datos sintéticos (sin red ni credenciales).
+# Uso: python -m benchmarks.ejecutar --help
@@ -0,0 +1,231 @@
+import io
+import json
+import time
+
+import numpy as np
+import pandas as pd
+
+
+# --- VOCABULARIO ---
+TIPOS = ["Muro", "Tabique", "Forjado", "Solera", "Zapata", "Pilar", "Viga", "Enfoscado", "Alicatado", "Pavimento",
+         "Falso techo", "Impermeabilización", "Aislamiento", "Carpintería", "Barandilla", "Canalización", "Arqueta"]
+MATERIALES = ["de ladrillo perforado", "de hormigón HA-25", "de bloque cerámico", "de placa de yeso laminado",
+              "de gres porcelánico", "de mortero M-7,5", "de acero B500S", "de PVC", "de lana mineral", "de madera de pino",
+              "de aluminio lacado", "de poliestireno extruido", "de cemento cola", "de piedra natural"]
+ACABADOS = ["a una cara", "a dos caras", "con armadura", "visto", "para revestir", "en exteriores", "en interiores",
+            "con juntas", "hidrófugo", "ignífugo", "reforzado", "acústico"]
+UNIDADES = ["m2", "m3", "ml", "ud", "kg", "pa"]
+NOMBRES = ["Juan", "Pedro", "Ana", "Luis", "María", "José", "Carmen", "Antonio", "Lucía", "Manuel", "Rosa", "Javier",
+           "Elena", "Miguel", "Sara", "Pablo", "Marta", "Diego", "Laura", "Andrés"]
+APELLIDOS = ["García", "Pérez", "López", "Martín", "Sánchez", "Gómez", "Ruiz", "Díaz", "Moreno", "Muñoz", "Romero",
+             "Navarro", "Torres", "Domínguez", "Vázquez", "Ramos", "Gil", "Serrano", "Molina", "Ortiz"]
+MAQUINAS = ["Grúa torre", "Retroexcavadora", "Camión bañera", "Hormigonera", "Plataforma elevadora", "Dumper",
+            "Martillo neumático", "Compactador"]
+PROVEEDORES = ["Cementos del Norte SA", "Ferretería López", "Materiales Ibéricos SL", "Aceros Díaz", "Cerámicas Levante",
+               "Maderas Gómez", "Pinturas Sur", "Electricidad Ramos", "Fontanería Vázquez", "Aislamientos Torres"]
+OBRAS = ["Residencial Norte", "Edificio Sur", "Naves Polígono Este", "Colegio Centro", "Viviendas Río"]
+HOJAS_PRESUPUESTO = ["Viviendas", "Elementos comunes", "Trasteros"]
+
+# Columnas del Excel de presupuesto generado (mismas letras que se eligen en la app)
+MAPEO_PRESUPUESTO = {"map_codigo": "A", "map_unidad": "C", "map_texto": "D", "map_cant": "E",
+                     "map_precio": "H", "map_coste": "M", "map_cod_control": "B"}
+# Columnas del documento de certificación generado: código, naturaleza, nombre, cantidad
+COLUMNAS_CERTIFICACION = {"cod": 0, "nat": 1, "nom": 3, "can": 4}
+
+
+def _nombre_partida(rng, i):
+    return f"{TIPOS[rng.integers(len(TIPOS))]} {MATERIALES[rng.integers(len(MATERIALES))]} {ACABADOS[rng.integers(len(ACABADOS))]} {i % 997 + 3} cm"
+
+
+def _formato_es(valor):
+    # 1234.5 -> "1.234,50" (como llegan los importes en texto desde Excel)
+    return f"{valor:,.2f}".replace(",", "X").replace(".", ",").replace("X", ".")
+
+
+# --- PRESUPUESTO ---
+def generar_presupuesto(n_partidas, semilla=0):
+    # Pestañas en bruto (header=None) con capítulos, partidas, líneas de
+    # continuación, cabeceras repetidas y Cod_Control numérico.
+    rng = np.random.default_rng(semilla)
+    hojas = {}
+    por_hoja = np.array_split(np.arange(n_partidas), len(HOJAS_PRESUPUESTO))
+    for h, (nombre_hoja, partidas) in enumerate(zip(HOJAS_PRESUPUESTO, por_hoja)):
+        filas = [["Código", "Cod. control", "Ud", "Resumen", "Cantidad", "", "", "Precio", "", "", "", "", "Coste"]]
+        capitulo = 0
+        for k, i in enumerate(partidas):
+            if k % 25 == 0:
+                capitulo += 1
+                filas.append([f"{h + 1}.{capitulo:02d}", None, None, f"CAPÍTULO {capitulo} {TIPOS[capitulo % len(TIPOS)].upper()}",
+                              None, None, None, None, None, None, None, None, None])
+                if capitulo % 10 == 0:
+                    filas.append(filas[0][:])
+            precio = round(float(rng.uniform(2, 400)), 2)
+            # Algunos precios llegan como texto con formato español
+            precio_celda = _formato_es(precio) if rng.random() < 0.1 else precio
+            filas.append([f"{h + 1}.{capitulo:02d}.{k % 25 + 1:03d}", float(1 + capitulo % 12), UNIDADES[i % len(UNIDADES)],
+                          _nombre_partida(rng, i), round(float(rng.uniform(1, 500)), 2), None, None, precio_celda,
+                          None, None, None, None, round(precio * rng.uniform(0.6, 0.9), 2)])
+            for _ in range(int(rng.choice([0, 0, 1, 2]))):
+                filas.append([None, None, None, f"Incluye {MATERIALES[rng.integers(len(MATERIALES))]} y medios auxiliares.",
+                              None, None, None, None, None, None, None, None, None])
+        hojas[nombre_hoja] = pd.DataFrame(filas)
+    return hojas
+
+
+def presupuesto_excel(hojas):
+    # Libro .xlsx en memoria, listo para pd.ExcelFile
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as writer:
+        for nombre, df in hojas.items():
+            df.to_excel(writer, sheet_name=nombre, header=False, index=False)
+    buffer.seek(0)
+    return buffer
+
+
+# --- CERTIFICACIÓN CON DERIVA DE CÓDIGOS Y NOMBRES ---
+def _errata(rng, texto):
+    if len(texto) < 6:
+        return texto
+    i = int(rng.integers(1, len(texto) - 2))
+    return texto[:i] + texto[i + 1] + texto[i] + texto[i + 2:]
+
+
+def generar_certificacion(df_pto, n_lineas, semilla=0):
+    # Documento de certificación (header=None) contra un presupuesto ya analizado:
+    # la mayoría casa por código, el resto por nombre exacto, parcial o difuso.
+    rng = np.random.default_rng(semilla)
+    n_lineas = min(n_lineas, len(df_pto))
+    elegidas = np.sort(rng.choice(len(df_pto), n_lineas, replace=False))
+    filas = [["Código", "Nat", "Ud", "Resumen", "CanCert"]]
+    for n, i in enumerate(elegidas):
+        codigo = str(df_pto['Partida_Codigo'].iloc[i])
+        nombre = str(df_pto['Partida_Nombre'].iloc[i])
+        cantidad = round(float(pd.to_numeric(df_pto['Cantidad_Proyecto'].iloc[i], errors='coerce') or 1) * rng.uniform(0.1, 1.0), 2)
+        tirada = rng.random()
+        if tirada < 0.70:
+            pass
+        elif tirada < 0.80:
+            codigo = ""
+        elif tirada < 0.86:
+            codigo, nombre = f"X{codigo}", nombre.upper()
+        elif tirada < 0.92:
+            codigo, nombre = f"X{codigo}", nombre[: max(6, int(len(nombre) * 0.7))]
+        else:
+            codigo, nombre = f"X{codigo}", _errata(rng, nombre)
+        if n % 40 == 0:
+            filas.append([f"C{n}", "Capítulo", None, f"CAPÍTULO {n}", None])
+        filas.append([codigo, "Partida", None, nombre, _formato_es(cantidad) if rng.random() < 0.2 else cantidad])
+    return pd.DataFrame(filas)
+
+
+def generar_certificacion_larga(df_pto, meses=6, semilla=0):
+    # Histórico ya guardado (una fila por partida y mes) para el informe
+    rng = np.random.default_rng(semilla)
+    bloques = []
+    for mes in range(1, meses + 1):
+        muestra = df_pto.sample(frac=0.5, random_state=int(rng.integers(1 << 31)))
+        cantidad = rng.uniform(0, 5, len(muestra)).round(2)
+        bloques.append(pd.DataFrame({
+            "Cod_Control": muestra['Cod_Control'].to_numpy(), "Partida_Codigo": muestra['Partida_Codigo'].to_numpy(),
+            "Partida_Nombre": muestra['Partida_Nombre'].to_numpy(), "Mes": mes, "Cantidad": cantidad,
+            "Importe": cantidad * pd.to_numeric(muestra['Precio_Adjudicado'], errors='coerce').to_numpy(),
+        }))
+    return pd.concat(bloques, ignore_index=True)
+
+
+def generar_codigos_control(df_pto):
+    codigos = sorted(set(df_pto['Cod_Control'].astype(str)))
+    return pd.DataFrame({"Cod_Control": codigos, "Descripcion": [f"Grupo {c}" for c in codigos]})
+
+
+# --- TARIFAS Y DIARIO ---
+def generar_tarifas(n_recursos=200, semilla=0):
+    rng = np.random.default_rng(semilla)
+    personas = [f"{NOMBRES[i % len(NOMBRES)]} {APELLIDOS[(i // len(NOMBRES)) % len(APELLIDOS)]}" + (f" {i}" if i >= 400 else "")
+                for i in range(max(n_recursos - len(MAQUINAS), 1))]
+    recursos = personas + MAQUINAS[: max(n_recursos - len(personas), 0)]
+    return pd.DataFrame({
+        "Recurso": recursos,
+        "Tipo": ["Personal"] * len(personas) + ["Maquinaria"] * (len(recursos) - len(personas)),
+        "Coste_Hora": rng.uniform(15, 60, len(recursos)).round(2),
+    })
+
+
+def generar_diario(n_filas, df_tarifas, semilla=0):
+    rng = np.random.default_rng(semilla)
+    personal = df_tarifas.loc[df_tarifas['Tipo'] == "Personal", 'Recurso'].tolist()
+    textos = []
+    for _ in range(n_filas):
+        grupo = list(rng.choice(personal, int(rng.integers(1, 5)), replace=False))
+        if len(grupo) > 1:
+            textos.append(", ".join(grupo[:-1]) + " y " + grupo[-1])
+        else:
+            textos.append(grupo[0])
+    fechas = pd.Timestamp("2024-01-01") + pd.to_timedelta(rng.integers(0, 365, n_filas), unit="D")
+    return pd.DataFrame({
+        "Fecha": fechas.strftime("%Y-%m-%d"), "Proyecto": rng.choice(OBRAS, n_filas), "Tipo_Entrada": "Manual",
+        "Contenido": "Texto manual", "Tarea": rng.choice(TIPOS, n_filas), "Descripción_Tarea": "",
+        "Personal": textos, "Horas_Personal": rng.choice([2, 4, 6, 8, 9], n_filas),
+        "Maquinaria": rng.choice(MAQUINAS + [""], n_filas), "Horas_Maq": rng.choice([0, 1, 2, 4], n_filas),
+        "Produccion": rng.uniform(1, 50, n_filas).round(1), "Unidad": rng.choice(UNIDADES, n_filas),
+    })
+
+
+# --- PRECIOS ---
+def generar_historico_precios(n_filas, semilla=0):
+    rng = np.random.default_rng(semilla)
+    n_productos = max(n_filas // 8, 1)
+    producto = rng.integers(0, n_productos, n_filas)
+    descripciones = np.array([f"{MATERIALES[p % len(MATERIALES)][3:].capitalize()} ref {p}" for p in range(n_productos)])
+    fechas = pd.Timestamp("2022-01-01") + pd.to_timedelta(np.sort(rng.integers(0, 900, n_filas)), unit="D")
+    return pd.DataFrame({
+        "Proveedor": np.array(PROVEEDORES)[producto % len(PROVEEDORES)],
+        "Codigo_Producto": [f"P-{p:06d}" for p in producto],
+        "Descripcion": descripciones[producto],
+        "Precio_Unitario": (5 + (producto % 200) + rng.normal(0, 0.5, n_filas)).round(2),
+        "Descuento": rng.choice([0.0, 5.0, 10.0], n_filas),
+        "Num_Factura": [f"F{2022 + i * 3 // n_filas}-{i // 12:05d}" for i in range(n_filas)],
+        "Fecha": fechas.strftime("%Y-%m-%d"),
+        "Obra": rng.choice(OBRAS, n_filas),
+    })
+
+
+def generar_factura(df_hist, n_lineas=60, semilla=0):
+    # Mezcla de productos conocidos (con y sin cambio de precio) y nuevos
+    rng = np.random.default_rng(semilla)
+    conocidas = df_hist.sample(min(n_lineas, len(df_hist)), random_state=semilla).copy()
+    cambia = rng.random(len(conocidas)) < 0.3
+    conocidas.loc[cambia, 'Precio_Unitario'] = (conocidas.loc[cambia, 'Precio_Unitario'] * 1.05).round(2)
+    nuevas = conocidas.head(max(n_lineas // 10, 1)).copy()
+    nuevas['Descripcion'] = nuevas['Descripcion'] + " nuevo formato"
+    return pd.concat([conocidas, nuevas], ignore_index=True).drop(columns=['Fecha']).assign(Fecha="2025-01-15")
+
+
+CONSULTAS_PRECIOS = ["hormigon", "ladrillo perf", "cementos norte", "P-0001", "acero", "pvc levante", "F2023", "residencial mortero"]
+
+
+# --- SUSTITUTO DEL CLIENTE DE GEMINI ---
+class _RespuestaFalsa:
+    def __init__(self, texto):
+        self.text = texto
+
+
+class ModeloFalso:
+    # Misma interfaz que genai.GenerativeModel: generate_content(contenido, request_options)
+    def __init__(self, latencia=0.2, filas_por_nota=3):
+        self.latencia = latencia
+        self.filas_por_nota = filas_por_nota
+        self.llamadas = 0
+
+    def generate_content(self, contenido, request_options=None):
+        self.llamadas += 1
+        time.sleep(self.latencia)
+        partes = [{"Fecha": "2024-03-01", "Tarea": "Albañilería", "Descripción_Tarea": f"parte {i}", "Personal": "Juan García y Ana Pérez",
+                   "Horas_Personal": 8, "Maquinaria": "", "Horas_Maq": 0, "Produccion": 12, "Unidad": "m2"}
+                  for i in range(self.filas_por_nota)]
+        return _RespuestaFalsa("```json\n" + json.dumps(partes, ensure_ascii=False) + "\n```")
+
+
+def generar_notas_voz(n_notas, semilla=0):
+    rng = np.random.default_rng(semilla)
+    return [[{"mime_type": "audio/ogg", "data": rng.bytes(2048)}, "Extrae los partes de trabajo"] for _ in range(n_notas)]
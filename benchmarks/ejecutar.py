@@ -0,0 +1,321 @@
+# Banco de pruebas de rendimiento con datos sintéticos.
+#
+#   python -m benchmarks.ejecutar                          # escalas 1k, 10k y 100k
+#   python -m benchmarks.ejecutar --escalas 1000 5000 --salida resultados.json
+#   python -m benchmarks.ejecutar --etapas presupuesto certificacion
+#
+# Sin red: Sheets se sustituye por el almacén SQLite local y Gemini por un
+# modelo falso con latencia fija. El resultado es JSON (una entrada por etapa
+# y escala) para comparar ejecuciones.
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+from benchmarks import datos_sinteticos as ds
+from gestion_obras.almacen import AlmacenLocal
+from gestion_obras.cache_hojas import CacheHojas
+from gestion_obras.certificacion import (
+    a_formato_largo, cantidad_anterior, casar_certificacion, certificacion_mes, lineas_certificacion, plan_certificacion,
+    sustituir_mes,
+)
+from gestion_obras.datos import AccesoDatos
+from gestion_obras.diario import filas_coste_diario
+from gestion_obras.esquemas import aplicar_esquema
+from gestion_obras.imputacion import TarifasVigentes, imputaciones_diario, reimputar_obras
+from gestion_obras.ia import CacheResultadosIA, extraer_con_cache, parsear_json_ia, procesar_en_paralelo
+from gestion_obras.informe import construir_resumen, evolucion_certificaciones, informe_desde_resumen
+from gestion_obras.precios import BuscadorPrecios, IndicePrecios
+from gestion_obras.presupuesto import (
+    clasificar_hoja, ensamblar_presupuesto, indices_columnas, parsear_presupuesto, parsear_presupuesto_paralelo,
+)
+
+
+ESCALAS = [1000, 10000, 100000]
+ETAPAS = ["presupuesto", "certificacion", "certificacion_guardado", "costes", "informe", "facturas", "busqueda", "almacen", "reimputacion", "asistente_voz"]
+
+
+def medir(funcion, repeticiones):
+    tiempos = []
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        tiempos.append(time.perf_counter() - inicio)
+    return tiempos, resultado
+
+
+def _registro(etapa, escala, tiempos, **extra):
+    return {
+        "etapa": etapa, "escala": escala, "repeticiones": len(tiempos),
+        "min_s": round(min(tiempos), 6), "mediana_s": round(statistics.median(tiempos), 6), "max_s": round(max(tiempos), 6),
+        **extra,
+    }
+
+
+# --- ETAPAS ---
+def bench_presupuesto(n, rep, semilla, max_lento):
+    hojas = ds.generar_presupuesto(n, semilla)
+    idx = indices_columnas(**ds.MAPEO_PRESUPUESTO)
+    tiempos, df_pto = medir(lambda: ensamblar_presupuesto([clasificar_hoja(h, idx) for h in hojas.values()], 15.0, 1.2), rep)
+    filas_brutas = sum(len(h) for h in hojas.values())
+    resultados = [_registro("presupuesto_analisis", n, tiempos, filas_entrada=filas_brutas, partidas=len(df_pto))]
+    if n <= max_lento:
+        buffer = ds.presupuesto_excel(hojas)
+        tiempos, _ = medir(lambda: parsear_presupuesto(pd.ExcelFile(buffer), list(hojas), idx, 15.0, 1.2), rep)
+        resultados.append(_registro("presupuesto_excel", n, tiempos, filas_entrada=filas_brutas, bytes=buffer.getbuffer().nbytes))
+        # Una pestaña por proceso (el primer uso incluye arrancar el pool)
+        tiempos, _ = medir(lambda: parsear_presupuesto_paralelo(buffer.getvalue(), list(hojas), idx, 15.0, 1.2), rep + 1)
+        resultados.append(_registro("presupuesto_excel_paralelo", n, tiempos[1:], filas_entrada=filas_brutas, pestanas=len(hojas),
+                                    procesos=os.cpu_count(), arranque_pool_s=round(tiempos[0], 6)))
+    return resultados, df_pto
+
+
+def bench_certificacion(n, rep, semilla, df_pto):
+    doc = ds.generar_certificacion(df_pto, n, semilla)
+    df_base = df_pto[['Cod_Control', 'Capítulo', 'Partida_Codigo', 'Partida_Nombre', 'Unidad', 'Precio_Adjudicado']].copy()
+    historico = a_formato_largo(ds.generar_certificacion_larga(df_pto, 3, semilla))
+    c = ds.COLUMNAS_CERTIFICACION
+
+    def casar():
+        lineas = lineas_certificacion(doc, c["cod"], c["nom"], c["can"], c["nat"])
+        casadas, huerfanas = casar_certificacion(lineas, df_base)
+        certificacion_mes(df_base, casadas, cantidad_anterior(historico, 4), 4)
+        return lineas, casadas, huerfanas
+
+    tiempos, (lineas, casadas, huerfanas) = medir(casar, rep)
+    return [_registro("certificacion_casado", n, tiempos, lineas=len(lineas), casadas=len(casadas), huerfanas=len(huerfanas),
+                      partidas_presupuesto=len(df_base))]
+
+
+def bench_certificacion_guardado(n, rep, semilla, df_pto, directorio):
+    # Certificación del mes 13 sobre 12 meses guardados: pestaña entera frente a solo las filas que cambian
+    almacen = AlmacenLocal(os.path.join(directorio, f"certificacion_{n}.sqlite"))
+    url = "https://docs.google.com/spreadsheets/d/BENCH/edit"
+    historico = a_formato_largo(ds.generar_certificacion_larga(df_pto, 12, semilla))
+    df_mes = a_formato_largo(ds.generar_certificacion_larga(df_pto, 1, semilla + 1).assign(Mes=13)).drop(
+        columns=['Cantidad_Origen', 'Importe_Origen'])
+    tamano = lambda df: int(df.memory_usage(index=False, deep=True).sum())
+
+    def completo():
+        almacen.escribir(url, "Certificaciones_Ingresos", historico)
+        df = sustituir_mes(a_formato_largo(almacen.leer(url, "Certificaciones_Ingresos")), df_mes, 13)
+        almacen.escribir(url, "Certificaciones_Ingresos", df)
+        return df
+
+    def diferencias():
+        almacen.escribir(url, "Certificaciones_Ingresos", historico)
+        datos = AccesoDatos(almacen, CacheHojas())
+        return datos.confirmar_diferencias("Certificaciones_Ingresos", url, lambda actual: plan_certificacion(actual, df_mes, 13))[0]
+
+    tiempos_completo, df_completo = medir(completo, rep)
+    tiempos_diferencias, plan = medir(diferencias, rep)
+    return [
+        _registro("certificacion_guardar_completo", n, tiempos_completo, filas=len(df_completo), bytes_enviados=tamano(df_completo)),
+        _registro("certificacion_guardar_diferencias", n, tiempos_diferencias, filas=plan["modificadas"] + plan["nuevas"],
+                  bytes_enviados=tamano(plan["actualizar"]) + tamano(plan["anexar"]), sin_cambios=plan["sin_cambios"]),
+    ]
+
+
+def bench_costes(n, rep, semilla, max_lento):
+    df_tarifas = ds.generar_tarifas(200, semilla)
+    df_diario = ds.generar_diario(n, df_tarifas, semilla)
+    # Vista de costes: todo el diario con las tarifas vigentes a la fecha de cada parte
+    tiempos_lote, costes = medir(lambda: TarifasVigentes(df_tarifas).costes_diario(df_diario), rep)
+    tiempos_imputaciones, imputaciones = medir(lambda: imputaciones_diario(df_diario, TarifasVigentes(df_tarifas)), rep)
+    resultados = [
+        _registro("costes_diario_lote", n, tiempos_lote, recursos=len(df_tarifas),
+                  coste_total=round(float(costes['Coste_Personal'].sum() + costes['Coste_Maquinaria'].sum()), 2)),
+        _registro("costes_imputaciones_diario", n, tiempos_imputaciones, imputaciones=len(imputaciones)),
+    ]
+    # Guardado de partes sueltos (formulario y asistente de voz): una valoración por parte
+    partes = df_diario.head(min(n, max_lento, 50)).to_dict("records")
+    tiempos_partes, _ = medir(lambda: [filas_coste_diario([parte], df_tarifas) for parte in partes], rep)
+    resultados.append(_registro("costes_partes_sueltos", n, tiempos_partes, partes=len(partes), recursos=len(df_tarifas)))
+    return resultados
+
+
+def bench_informe(n, rep, semilla, df_pto):
+    df_cert = ds.generar_certificacion_larga(df_pto, 12, semilla)
+    df_codigos = ds.generar_codigos_control(df_pto)
+    tiempos_resumen, resumen = medir(lambda: construir_resumen(df_pto, df_cert), rep)
+    tiempos_vista, _ = medir(lambda: (informe_desde_resumen(df_codigos, resumen), evolucion_certificaciones(resumen)), rep)
+    return [
+        _registro("informe_resumen", n, tiempos_resumen, partidas=len(df_pto), filas_certificacion=len(df_cert)),
+        _registro("informe_vista", n, tiempos_vista, codigos_control=len(resumen)),
+    ]
+
+
+def bench_facturas(n, rep, semilla):
+    df_hist = ds.generar_historico_precios(n, semilla)
+    df_factura = ds.generar_factura(df_hist, 60, semilla)
+    tiempos_indice, indice = medir(lambda: IndicePrecios().sincronizar(df_hist), rep)
+    tiempos_check, estados = medir(lambda: indice.clasificar(df_factura), rep)
+    nuevas = ds.generar_factura(df_hist, 60, semilla + 1)
+    ampliado = pd.concat([df_hist, nuevas], ignore_index=True)
+    tiempos_incr, _ = medir(lambda: IndicePrecios().sincronizar(df_hist).sincronizar(ampliado), 1)
+    return [
+        _registro("precios_indice", n, tiempos_indice, filas_historico=len(df_hist)),
+        _registro("factura_comprobacion", n, tiempos_check, lineas_factura=len(df_factura),
+                  nuevas=sum(e.startswith("🟢") for e in estados), cambios=sum(e.startswith("🟡") for e in estados)),
+        _registro("precios_indice_con_anexo", n, tiempos_incr, lineas_anexadas=len(nuevas)),
+    ]
+
+
+def bench_busqueda(n, rep, semilla):
+    df_hist = ds.generar_historico_precios(n, semilla)
+    tiempos_indice, buscador = medir(lambda: BuscadorPrecios().sincronizar(df_hist), rep)
+    resultados = [_registro("busqueda_indice", n, tiempos_indice, filas_historico=len(df_hist))]
+    tiempos = []
+    encontrados = 0
+    for consulta in ds.CONSULTAS_PRECIOS:
+        t, (_, total) = medir(lambda: buscador.buscar(consulta, limite=500), rep)
+        tiempos.append(min(t))
+        encontrados += total
+    resultados.append(_registro("busqueda_consulta", n, tiempos, consultas=len(ds.CONSULTAS_PRECIOS), coincidencias=encontrados))
+    return resultados
+
+
+def bench_almacen(n, rep, semilla, directorio):
+    # Sustituto local de Google Sheets (mismo interfaz leer/escribir/anexar)
+    almacen = AlmacenLocal(os.path.join(directorio, f"almacen_{n}.sqlite"))
+    url = "https://docs.google.com/spreadsheets/d/BENCH/edit"
+    df_hist = ds.generar_historico_precios(n, semilla)
+    nuevas = ds.generar_factura(df_hist, 50, semilla)
+    tiempos_escribir, _ = medir(lambda: almacen.escribir(url, "Historico_Precios", df_hist), rep)
+    tiempos_leer, df = medir(lambda: almacen.leer(url, "Historico_Precios"), rep)
+    tiempos_anexar, _ = medir(lambda: almacen.anexar(url, "Historico_Precios", nuevas), rep)
+    # Esquema de la pestaña aplicado al cargar (memoria antes y después)
+    tiempos_tipar, df_tipado = medir(lambda: aplicar_esquema("Historico_Precios", df), rep)
+    return [
+        _registro("almacen_escribir", n, tiempos_escribir, filas=len(df_hist)),
+        _registro("almacen_leer", n, tiempos_leer, filas=len(df)),
+        _registro("almacen_anexar", n, tiempos_anexar, filas=len(nuevas)),
+        _registro("almacen_tipar", n, tiempos_tipar, filas=len(df), bytes_antes=int(df.memory_usage(deep=True).sum()),
+                  bytes_despues=int(df_tipado.memory_usage(deep=True).sum())),
+    ]
+
+
+def bench_reimputacion(n, rep, semilla, directorio):
+    # Cambio de tarifa con fecha de vigencia sobre los diarios de todas las obras (n partes en total)
+    almacen = AlmacenLocal(os.path.join(directorio, f"reimputacion_{n}.sqlite"))
+    df_tarifas = ds.generar_tarifas(200, semilla)
+    df_diario = ds.generar_diario(n, df_tarifas, semilla)
+    obras = [(obra, f"https://docs.google.com/spreadsheets/d/BENCH-{i}/edit") for i, obra in enumerate(ds.OBRAS)]
+    for obra, url in obras:
+        diario_obra = df_diario[df_diario['Proyecto'] == obra].reset_index(drop=True)
+        almacen.escribir(url, "Diario", diario_obra)
+        almacen.escribir(url, "Costes_Imputados", imputaciones_diario(diario_obra, TarifasVigentes(df_tarifas)))
+    # Subida del 10 % a una de cada diez personas desde julio
+    subida = df_tarifas.iloc[::10].assign(Coste_Hora=lambda df: (df['Coste_Hora'] * 1.1).round(2), Vigente_Desde="2024-07-01")
+    df_nuevas = pd.concat([df_tarifas, subida], ignore_index=True)
+
+    tiempos_plan, resumen = medir(lambda: reimputar_obras(obras, AccesoDatos(almacen, CacheHojas()), df_nuevas, escribir=False), rep)
+    tiempos_total, _ = medir(lambda: reimputar_obras(obras, AccesoDatos(almacen, CacheHojas()), df_nuevas), 1)
+    return [
+        _registro("reimputacion_plan", n, tiempos_plan, obras=len(obras), modificadas=int(resumen['Modificadas'].sum())),
+        _registro("reimputacion_total", n, tiempos_total, obras=len(obras)),
+    ]
+
+
+def bench_asistente_voz(n_notas, semilla, directorio, concurrencia=4, latencia=0.2):
+    # Sustituto de Gemini con latencia fija: mide el paralelismo y la caché de resultados
+    modelo = ds.ModeloFalso(latencia=latencia)
+    cache = CacheResultadosIA(os.path.join(directorio, "cache_ia"))
+    notas = ds.generar_notas_voz(n_notas, semilla)
+
+    def procesar():
+        def extraer(contenido):
+            return extraer_con_cache(cache, "modelo-falso", contenido,
+                                     lambda: parsear_json_ia(modelo.generate_content(contenido, request_options={"timeout": 10}).text))
+        return [r for r in procesar_en_paralelo(notas, extraer, concurrencia)]
+
+    resultados = []
+    for etapa in ("asistente_voz_sin_cache", "asistente_voz_con_cache"):
+        llamadas = modelo.llamadas
+        tiempos, salida = medir(procesar, 1)
+        resultados.append(_registro(etapa, n_notas, tiempos, concurrencia=concurrencia, latencia_modelo_s=latencia,
+                                    llamadas_modelo=modelo.llamadas - llamadas, errores=sum(e is not None for _, _, e in salida)))
+    return resultados
+
+
+# --- EJECUCIÓN ---
+def _version_codigo():
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, timeout=5).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def ejecutar(escalas=ESCALAS, etapas=ETAPAS, repeticiones=3, semilla=0, max_lento=20000, notas_voz=8, informar=None):
+    resultados = []
+    with tempfile.TemporaryDirectory() as directorio:
+        for n in escalas:
+            df_pto = None
+            if {"presupuesto", "certificacion", "certificacion_guardado", "informe"} & set(etapas):
+                registros, df_pto = bench_presupuesto(n, repeticiones if "presupuesto" in etapas else 1, semilla, max_lento)
+                if "presupuesto" in etapas:
+                    resultados += registros
+            if "certificacion" in etapas:
+                resultados += bench_certificacion(n, repeticiones, semilla, df_pto)
+            if "certificacion_guardado" in etapas:
+                resultados += bench_certificacion_guardado(n, repeticiones, semilla, df_pto, directorio)
+            if "costes" in etapas:
+                resultados += bench_costes(n, repeticiones, semilla, max_lento)
+            if "informe" in etapas:
+                resultados += bench_informe(n, repeticiones, semilla, df_pto)
+            if "facturas" in etapas:
+                resultados += bench_facturas(n, repeticiones, semilla)
+            if "busqueda" in etapas:
+                resultados += bench_busqueda(n, repeticiones, semilla)
+            if "almacen" in etapas:
+                resultados += bench_almacen(n, repeticiones, semilla, directorio)
+            if "reimputacion" in etapas:
+                resultados += bench_reimputacion(n, repeticiones, semilla, directorio)
+            if informar:
+                informar(n, resultados)
+        if "asistente_voz" in etapas:
+            resultados += bench_asistente_voz(notas_voz, semilla, directorio)
+    return {
+        "fecha": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": _version_codigo(),
+        "entorno": {"python": platform.python_version(), "pandas": pd.__version__, "numpy": np.__version__,
+                    "plataforma": platform.platform(), "cpus": os.cpu_count()},
+        "parametros": {"escalas": list(escalas), "etapas": list(etapas), "repeticiones": repeticiones, "semilla": semilla},
+        "resultados": resultados,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Banco de pruebas de rendimiento con datos sintéticos")
+    parser.add_argument("--escalas", type=int, nargs="+", default=ESCALAS)
+    parser.add_argument("--etapas", nargs="+", choices=ETAPAS, default=ETAPAS)
+    parser.add_argument("--repeticiones", type=int, default=3)
+    parser.add_argument("--semilla", type=int, default=0)
+    parser.add_argument("--max-lento", type=int, default=20000, help="escala máxima de las etapas lentas (.xlsx real y costes fila a fila)")
+    parser.add_argument("--salida", help="fichero JSON de resultados (por defecto, salida estándar)")
+    args = parser.parse_args(argv)
+
+    def informar(n, resultados):
+        print(f"escala {n}: {sum(r['escala'] == n for r in resultados)} mediciones", file=sys.stderr)
+
+    informe = ejecutar(args.escalas, args.etapas, args.repeticiones, args.semilla, args.max_lento, informar=informar)
+    texto = json.dumps(informe, ensure_ascii=False, indent=2)
+    if args.salida:
+        with open(args.salida, "w", encoding="utf-8") as f:
+            f.write(texto)
+    else:
+        print(texto)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,2 @@
+# Núcleo reutilizable del ERP de obra (fuera del script de Streamlit para que
+# el estado de proceso sobreviva a los reruns).
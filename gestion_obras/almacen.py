@@ -0,0 +1,307 @@
+import datetime
+import hashlib
+import os
+import re
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+from gestion_obras.escritura import (
+    COLUMNA_FILA, actualizar_en_hoja, alinear_con_cabecera, anexar_en_hoja, aplicar_actualizacion,
+)
+
+
+class HojaNoEncontrada(KeyError):
+    pass
+
+
+# --- INTERFAZ DE ALMACENAMIENTO ---
+# Todas las vistas leen y escriben pestañas (url del libro + nombre de pestaña)
+# a través de esta interfaz; el motor concreto se elige en obra.py.
+class Almacen:
+    @property
+    def clave(self):
+        # Identifica el destino de las escrituras (comparten bloqueos las instancias con la misma clave)
+        return type(self).__name__
+
+    def leer(self, url, hoja):
+        raise NotImplementedError
+
+    def escribir(self, url, hoja, df):
+        raise NotImplementedError
+
+    def anexar(self, url, hoja, df_nuevas, ampliar=False):
+        # Devuelve las filas tal como han quedado alineadas con la cabecera.
+        # Columnas que la hoja no tiene: ValueError, salvo con ampliar=True
+        # (se añaden a la cabecera; ver escritura.alinear_con_cabecera).
+        raise NotImplementedError
+
+    def actualizar_filas(self, url, hoja, df_cambios):
+        # Sobrescribe celdas de filas concretas (ver escritura.COLUMNA_FILA).
+        # Por defecto reescribe la hoja; los motores que pueden envían solo esas celdas.
+        self.escribir(url, hoja, aplicar_actualizacion(self.leer(url, hoja), df_cambios))
+
+
+# --- GOOGLE SHEETS ---
+# Las escrituras parciales (anexar, actualizar celdas) abren la pestaña con la API
+# pública de gspread usando la cuenta de servicio de los secretos. Un cliente por
+# cuenta para todo el proceso: autenticarse en cada rerun costaría una petición.
+_clientes_gspread = {}
+_lock_clientes_gspread = threading.Lock()
+
+
+def cliente_gspread(credenciales):
+    import gspread
+    clave = credenciales.get("client_email")
+    with _lock_clientes_gspread:
+        if clave not in _clientes_gspread:
+            _clientes_gspread[clave] = gspread.service_account_from_dict(credenciales)
+        return _clientes_gspread[clave]
+
+
+class AlmacenGSheets(Almacen):
+    def __init__(self, conn, credenciales=None):
+        self.conn = conn
+        # Sin cuenta de servicio (p. ej. hoja pública) no hay pestaña de gspread:
+        # anexar y actualizar_filas reescriben la pestaña entera con conn.update
+        self.credenciales = credenciales if (credenciales or {}).get("type") == "service_account" else None
+
+    @property
+    def clave(self):
+        return "gsheets"
+
+    def leer(self, url, hoja):
+        from gspread.exceptions import WorksheetNotFound
+        try:
+            return self.conn.read(spreadsheet=url, worksheet=hoja, ttl=0)
+        except WorksheetNotFound as e:
+            raise HojaNoEncontrada(f"{id_libro(url)}::{hoja}") from e
+
+    def escribir(self, url, hoja, df):
+        self.conn.update(spreadsheet=url, worksheet=hoja, data=df)
+
+    def pestana(self, url, hoja):
+        if self.credenciales is None:
+            return None
+        from gspread.exceptions import WorksheetNotFound
+        try:
+            return cliente_gspread(self.credenciales).open_by_url(url).worksheet(hoja)
+        except WorksheetNotFound as e:
+            raise HojaNoEncontrada(f"{id_libro(url)}::{hoja}") from e
+
+    def anexar(self, url, hoja, df_nuevas, ampliar=False):
+        ws = self.pestana(url, hoja)
+        if ws is not None:
+            return anexar_en_hoja(ws, df_nuevas, ampliar)
+        df_actual = self.leer(url, hoja)
+        cabecera_final, _, df_alineado = alinear_con_cabecera(df_nuevas, df_actual.columns, ampliar)
+        df_actual = df_actual.set_axis([str(c) for c in df_actual.columns], axis=1).reindex(columns=cabecera_final)
+        self.escribir(url, hoja, pd.concat([df_actual, df_alineado], ignore_index=True) if not df_actual.empty else df_alineado)
+        return df_alineado
+
+    def actualizar_filas(self, url, hoja, df_cambios):
+        ws = self.pestana(url, hoja)
+        if ws is None:
+            return super().actualizar_filas(url, hoja, df_cambios)
+        actualizar_en_hoja(ws, df_cambios)
+
+
+# --- MOTOR LOCAL (SQLITE) ---
+# Una tabla por (libro, pestaña) con los mismos nombres que en Sheets
+# (Diario, Costes_Imputados, Presupuesto_Base...). Columnas sin tipo declarado
+# para conservar números y textos tal cual llegan.
+def id_libro(url):
+    m = re.search(r"/d/([A-Za-z0-9_-]+)", str(url))
+    return m.group(1) if m else str(url)
+
+
+def valor_nativo(v):
+    if v is None or (not isinstance(v, str) and pd.api.types.is_scalar(v) and pd.isna(v)):
+        return None
+    if isinstance(v, (pd.Timestamp, datetime.date)):
+        return v.strftime("%Y-%m-%d")
+    if hasattr(v, "item"):
+        return v.item()
+    if isinstance(v, (int, float, str, bytes)):
+        return v
+    return str(v)
+
+
+def _q(nombre):
+    return '"' + str(nombre).replace('"', '""') + '"'
+
+
+class AlmacenLocal(Almacen):
+    def __init__(self, ruta):
+        self.ruta = ruta
+        self._lock = threading.Lock()
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        with self._conectar() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+
+    @property
+    def clave(self):
+        return f"local:{os.path.abspath(self.ruta)}"
+
+    @contextmanager
+    def _conectar(self):
+        con = sqlite3.connect(self.ruta, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def tabla(self, url, hoja):
+        return f"{id_libro(url)}::{hoja}"
+
+    def _columnas(self, con, tabla):
+        return [fila[1] for fila in con.execute(f"PRAGMA table_info({_q(tabla)})")]
+
+    def _insertar(self, con, tabla, df):
+        if df.empty:
+            return
+        marcadores = ", ".join("?" for _ in df.columns)
+        columnas = ", ".join(_q(c) for c in df.columns)
+        filas = [[valor_nativo(v) for v in fila] for fila in df.itertuples(index=False, name=None)]
+        con.executemany(f"INSERT INTO {_q(tabla)} ({columnas}) VALUES ({marcadores})", filas)
+
+    def existe(self, url, hoja):
+        with self._conectar() as con:
+            return bool(self._columnas(con, self.tabla(url, hoja)))
+
+    def leer(self, url, hoja):
+        return self.consultar(url, hoja)
+
+    def consultar(self, url, hoja, filtros=None):
+        # Lectura con filtros de igualdad; las columnas filtradas quedan indexadas
+        tabla = self.tabla(url, hoja)
+        with self._conectar() as con:
+            columnas = self._columnas(con, tabla)
+            if not columnas:
+                raise HojaNoEncontrada(tabla)
+            sql = f"SELECT * FROM {_q(tabla)}"
+            parametros = []
+            if filtros:
+                for col in filtros:
+                    if col not in columnas:
+                        raise KeyError(f"Columna '{col}' no existe en {tabla}")
+                    self.crear_indice(url, hoja, col, con=con)
+                sql += " WHERE " + " AND ".join(f"{_q(c)} = ?" for c in filtros)
+                parametros = [valor_nativo(v) for v in filtros.values()]
+            sql += " ORDER BY rowid"
+            return pd.read_sql_query(sql, con, params=parametros)
+
+    def crear_indice(self, url, hoja, columna, con=None):
+        tabla = self.tabla(url, hoja)
+        nombre = "idx_" + hashlib.md5(f"{tabla}|{columna}".encode("utf-8")).hexdigest()[:16]
+        sql = f"CREATE INDEX IF NOT EXISTS {_q(nombre)} ON {_q(tabla)} ({_q(columna)})"
+        if con is not None:
+            con.execute(sql)
+        else:
+            with self._conectar() as c:
+                c.execute(sql)
+
+    def escribir(self, url, hoja, df):
+        tabla = self.tabla(url, hoja)
+        with self._lock, self._conectar() as con:
+            con.execute(f"DROP TABLE IF EXISTS {_q(tabla)}")
+            columnas = [str(c) for c in df.columns] or ["_vacia"]
+            con.execute(f"CREATE TABLE {_q(tabla)} ({', '.join(_q(c) for c in columnas)})")
+            self._insertar(con, tabla, df.rename(columns=str))
+
+    def anexar(self, url, hoja, df_nuevas, ampliar=False):
+        tabla = self.tabla(url, hoja)
+        with self._lock, self._conectar() as con:
+            cabecera = self._columnas(con, tabla)
+            cabecera_final, columnas_nuevas, df_alineado = alinear_con_cabecera(df_nuevas, cabecera, ampliar)
+            if not cabecera:
+                con.execute(f"CREATE TABLE {_q(tabla)} ({', '.join(_q(c) for c in cabecera_final)})")
+            else:
+                for col in columnas_nuevas:
+                    con.execute(f"ALTER TABLE {_q(tabla)} ADD COLUMN {_q(col)}")
+            self._insertar(con, tabla, df_alineado)
+        return df_alineado
+
+    def actualizar_filas(self, url, hoja, df_cambios):
+        if df_cambios.empty:
+            return
+        tabla = self.tabla(url, hoja)
+        columnas = [str(c) for c in df_cambios.columns if c != COLUMNA_FILA]
+        with self._lock, self._conectar() as con:
+            cabecera = self._columnas(con, tabla)
+            if not cabecera:
+                raise HojaNoEncontrada(tabla)
+            for col in columnas:
+                if col not in cabecera:
+                    con.execute(f"ALTER TABLE {_q(tabla)} ADD COLUMN {_q(col)}")
+            # Posición de fila -> rowid (mismo orden que leer)
+            rowids = [fila[0] for fila in con.execute(f"SELECT rowid FROM {_q(tabla)} ORDER BY rowid")]
+            posiciones = df_cambios[COLUMNA_FILA].astype(int).tolist()
+            if posiciones and (min(posiciones) < 0 or max(posiciones) >= len(rowids)):
+                raise IndexError(f"Filas fuera de la hoja ({len(rowids)} filas) en {tabla}")
+            asignaciones = ", ".join(f"{_q(c)} = ?" for c in columnas)
+            filas = [[valor_nativo(v) for v in fila] + [rowids[pos]]
+                     for pos, fila in zip(posiciones, df_cambios[columnas].itertuples(index=False, name=None))]
+            con.executemany(f"UPDATE {_q(tabla)} SET {asignaciones} WHERE rowid = ?", filas)
+
+
+# --- LOCAL COMO PRINCIPAL, SINCRONIZADO CON SHEETS ---
+class AlmacenEspejo(Almacen):
+    def __init__(self, principal, remoto):
+        self.principal = principal
+        self.remoto = remoto
+
+    @property
+    def clave(self):
+        return f"{self.principal.clave}+{self.remoto.clave}"
+
+    def leer(self, url, hoja):
+        try:
+            return self.principal.leer(url, hoja)
+        except HojaNoEncontrada:
+            # Primera lectura de la pestaña: se trae de Sheets y se guarda en local
+            df = self.remoto.leer(url, hoja)
+            self.principal.escribir(url, hoja, df)
+            return df
+
+    def escribir(self, url, hoja, df):
+        self.principal.escribir(url, hoja, df)
+        self.remoto.escribir(url, hoja, df)
+
+    def anexar(self, url, hoja, df_nuevas, ampliar=False):
+        if not self.principal.existe(url, hoja):
+            self.leer(url, hoja)
+        df_alineado = self.principal.anexar(url, hoja, df_nuevas, ampliar)
+        self.remoto.anexar(url, hoja, df_nuevas, ampliar)
+        return df_alineado
+
+    def actualizar_filas(self, url, hoja, df_cambios):
+        if not self.principal.existe(url, hoja):
+            self.leer(url, hoja)
+        self.principal.actualizar_filas(url, hoja, df_cambios)
+        self.remoto.actualizar_filas(url, hoja, df_cambios)
+
+    def sincronizar(self, url, hoja):
+        # Vuelca la copia local completa sobre Sheets
+        self.remoto.escribir(url, hoja, self.principal.leer(url, hoja))
+
+
+MOTORES = ("gsheets", "local", "local+gsheets")
+
+
+def crear_almacen(motor, conn=None, ruta_local=None, ruta_cola=None, credenciales=None):
+    # Con ruta_cola, las escrituras a Sheets pasan por la cola diferida
+    if motor not in MOTORES:
+        raise ValueError(f"Motor de almacenamiento desconocido: {motor} (opciones: {', '.join(MOTORES)})")
+    if motor == "local":
+        return AlmacenLocal(ruta_local)
+    remoto = AlmacenGSheets(conn, credenciales)
+    if ruta_cola:
+        from gestion_obras.cola_escritura import AlmacenDiferido, cola_escritura
+        remoto = AlmacenDiferido(cola_escritura(ruta_cola, remoto))
+    if motor == "gsheets":
+        return remoto
+    return AlmacenEspejo(AlmacenLocal(ruta_local), remoto)
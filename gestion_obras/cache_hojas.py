@@ -0,0 +1,142 @@
+import hashlib
+import itertools
+import threading
+import time
+
+import pandas as pd
+
+from gestion_obras.escritura import aplicar_actualizacion
+
+
+# Huella del contenido de una tabla: sirve de "versión" para cachear lo que se
+# deriva de ella (tarifario compilado, índices, resúmenes...)
+def version_tabla(df, columnas=None):
+    if df.empty:
+        return "vacia"
+    df_v = df[columnas] if columnas else df
+    try:
+        hashes = pd.util.hash_pandas_object(df_v, index=False)
+    except TypeError:
+        hashes = pd.util.hash_pandas_object(df_v.astype(str), index=False)
+    h = hashlib.sha1(hashes.to_numpy().tobytes())
+    h.update(str(list(df_v.columns)).encode("utf-8"))
+    return h.hexdigest()
+
+
+# --- CACHÉ DE HOJAS COMPARTIDA ENTRE SESIONES ---
+# Clave: (url de la hoja de cálculo, pestaña). Vive a nivel de proceso, así que
+# todos los encargados conectados comparten las mismas descargas.
+# Cada entrada lleva una generación que cambia con cada descarga o escritura:
+# quien se guarda una copia (los módulos entre reruns parciales) la compara
+# con generacion() para saber si sigue al día.
+class CacheHojas:
+    def __init__(self, ttl=60):
+        self.ttl = ttl
+        self._entradas = {}
+        self._generaciones = itertools.count(1)
+        self._bloqueos = {}
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        self.invalidaciones = 0
+
+    def _clave(self, url, hoja):
+        return (str(url), str(hoja))
+
+    def _bloqueo_clave(self, clave):
+        with self._lock:
+            if clave not in self._bloqueos:
+                self._bloqueos[clave] = threading.Lock()
+            return self._bloqueos[clave]
+
+    def _vigente(self, entrada, ahora):
+        return entrada is not None and (self.ttl is None or ahora - entrada[1] < self.ttl)
+
+    def obtener(self, url, hoja, cargador):
+        return self.obtener_con_generacion(url, hoja, cargador)[0]
+
+    def obtener_con_generacion(self, url, hoja, cargador):
+        clave = self._clave(url, hoja)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if self._vigente(entrada, time.time()):
+                self.aciertos += 1
+                return entrada[0].copy(), entrada[2]
+
+        # Una sola descarga por clave aunque varias sesiones fallen a la vez
+        with self._bloqueo_clave(clave):
+            with self._lock:
+                entrada = self._entradas.get(clave)
+                if self._vigente(entrada, time.time()):
+                    self.aciertos += 1
+                    return entrada[0].copy(), entrada[2]
+                self.fallos += 1
+            df = cargador()
+            with self._lock:
+                entrada = self._entradas[clave] = (df.copy(), time.time(), next(self._generaciones))
+            return df.copy(), entrada[2]
+
+    def generacion(self, url, hoja):
+        # None si la pestaña no está en caché o ha caducado
+        with self._lock:
+            entrada = self._entradas.get(self._clave(url, hoja))
+            return entrada[2] if self._vigente(entrada, time.time()) else None
+
+    def actualizar(self, url, hoja, df):
+        with self._lock:
+            self._entradas[self._clave(url, hoja)] = (df.copy(), time.time(), next(self._generaciones))
+
+    def anexar(self, url, hoja, df_nuevas, tipar=None):
+        # Mantiene la copia en caché al día tras un append sin volver a descargar
+        # (tipar: para recuperar los tipos que pierde la concatenación)
+        clave = self._clave(url, hoja)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                df = pd.concat([entrada[0], df_nuevas], ignore_index=True)
+                self._entradas[clave] = (tipar(df) if tipar else df, entrada[1], next(self._generaciones))
+
+    def actualizar_filas(self, url, hoja, df_cambios, tipar=None):
+        # Igual que anexar: aplica el cambio a la copia en caché si la hay
+        clave = self._clave(url, hoja)
+        with self._lock:
+            entrada = self._entradas.get(clave)
+            if entrada is not None:
+                df = aplicar_actualizacion(entrada[0], df_cambios)
+                self._entradas[clave] = (tipar(df) if tipar else df, entrada[1], next(self._generaciones))
+
+    def invalidar(self, url, hoja=None):
+        with self._lock:
+            if hoja is None:
+                claves = [c for c in self._entradas if c[0] == str(url)]
+            else:
+                claves = [self._clave(url, hoja)]
+            for clave in claves:
+                if self._entradas.pop(clave, None) is not None:
+                    self.invalidaciones += 1
+
+    def vaciar(self):
+        with self._lock:
+            self.invalidaciones += len(self._entradas)
+            self._entradas.clear()
+
+    def estadisticas(self):
+        ahora = time.time()
+        with self._lock:
+            total = self.aciertos + self.fallos
+            return {
+                "aciertos": self.aciertos,
+                "fallos": self.fallos,
+                "invalidaciones": self.invalidaciones,
+                "ratio_aciertos": (self.aciertos / total) if total else 0.0,
+                "entradas": [
+                    {"url": url, "hoja": hoja, "filas": len(df), "edad_s": round(ahora - t, 1)}
+                    for (url, hoja), (df, t, _) in self._entradas.items()
+                ],
+            }
+
+    def estadisticas_df(self):
+        return pd.DataFrame(self.estadisticas()["entradas"], columns=["url", "hoja", "filas", "edad_s"])
+
+
+cache_hojas = CacheHojas()
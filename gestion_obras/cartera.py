@@ -0,0 +1,84 @@
+import time
+
+import pandas as pd
+
+from gestion_obras.ia import con_reintentos, procesar_en_paralelo
+from gestion_obras.informe import resumen_certificacion, resumen_presupuesto
+
+
+HOJAS_CARTERA = ("Presupuesto_Base", "Certificaciones_Ingresos", "Costes_Imputados")
+
+
+# --- CARGA EN PARALELO DE TODAS LAS OBRAS ---
+def _cargar_obra(obra, hojas, leer, intentos):
+    nombre, url = obra
+    inicio = time.perf_counter()
+    datos, errores = {}, {}
+    for hoja in hojas:
+        try:
+            datos[hoja] = con_reintentos(lambda: leer(hoja, url), intentos)
+        except Exception as e:
+            # Una pestaña que falla no tumba la obra: se sigue con lo demás
+            datos[hoja] = pd.DataFrame()
+            errores[hoja] = f"{type(e).__name__}: {e}"
+    return {"Proyecto": nombre, "url": url, "datos": datos, "errores": errores, "segundos": time.perf_counter() - inicio}
+
+
+def cargar_cartera(obras, leer, hojas=HOJAS_CARTERA, max_concurrencia=8, intentos=2):
+    # obras: [(nombre, url)]; leer(hoja, url) -> DataFrame (debe lanzar excepción si falla).
+    # Devuelve una carga por obra, en el mismo orden, con sus errores y tiempos.
+    obras = list(obras)
+    cargas = [None] * len(obras)
+    for i, carga, error in procesar_en_paralelo(obras, lambda o: _cargar_obra(o, hojas, leer, intentos), max_concurrencia, intentos=1):
+        if error is not None:
+            nombre, url = obras[i]
+            carga = {"Proyecto": nombre, "url": url, "datos": {h: pd.DataFrame() for h in hojas},
+                     "errores": {"*": f"{type(error).__name__}: {error}"}, "segundos": None}
+        cargas[i] = carga
+    return cargas
+
+
+# --- AGREGADOS DE CARTERA ---
+def _resumen_carga(carga):
+    df_pto = carga["datos"].get("Presupuesto_Base", pd.DataFrame())
+    df_cert = carga["datos"].get("Certificaciones_Ingresos", pd.DataFrame())
+    columnas_pto = {'Cod_Control', 'Coste', 'Cantidad_Proyecto', 'Importe_Total_Adjudicado'}
+    resumen = resumen_presupuesto(df_pto) if not df_pto.empty and columnas_pto.issubset(df_pto.columns) else \
+        pd.DataFrame(columns=['Cod_Control', 'Coste_Presupuestado', 'Presupuesto_Adjudicado'])
+    cert = resumen_certificacion(df_cert) if 'Cod_Control' in df_cert.columns else pd.DataFrame(columns=['Cod_Control', 'Total_Certificado'])
+    resumen = resumen.merge(cert, on='Cod_Control', how='outer')
+    for col in ('Coste_Presupuestado', 'Presupuesto_Adjudicado', 'Total_Certificado'):
+        resumen[col] = pd.to_numeric(resumen[col], errors='coerce').fillna(0)
+    resumen.insert(0, 'Proyecto', carga["Proyecto"])
+    return resumen
+
+
+def _avance(certificado, adjudicado):
+    return (certificado / adjudicado.where(adjudicado != 0) * 100).fillna(0)
+
+
+def resumen_cartera(cargas):
+    # (por_obra, por_cod_control): totales por proyecto y detalle por proyecto y Cod_Control
+    detalle = pd.concat([_resumen_carga(c) for c in cargas], ignore_index=True) if cargas else pd.DataFrame()
+    if detalle.empty:
+        detalle = pd.DataFrame(columns=['Proyecto', 'Cod_Control', 'Coste_Presupuestado', 'Presupuesto_Adjudicado', 'Total_Certificado'])
+    detalle['% Avance'] = _avance(detalle['Total_Certificado'], detalle['Presupuesto_Adjudicado'])
+
+    filas = []
+    for carga in cargas:
+        d = detalle[detalle['Proyecto'] == carga["Proyecto"]]
+        df_costes = carga["datos"].get("Costes_Imputados", pd.DataFrame())
+        coste_imputado = pd.to_numeric(df_costes['Coste_Total'], errors='coerce').sum() if 'Coste_Total' in df_costes.columns else 0.0
+        filas.append({
+            "Proyecto": carga["Proyecto"],
+            "Presupuesto_Adjudicado": d['Presupuesto_Adjudicado'].sum(),
+            "Coste_Presupuestado": d['Coste_Presupuestado'].sum(),
+            "Total_Certificado": d['Total_Certificado'].sum(),
+            "Coste_Imputado": coste_imputado,
+            "Segundos_Carga": carga["segundos"],
+            "Estado": "OK" if not carga["errores"] else "Error: " + "; ".join(f"{h}: {e}" for h, e in carga["errores"].items()),
+        })
+    por_obra = pd.DataFrame(filas, columns=["Proyecto", "Presupuesto_Adjudicado", "Coste_Presupuestado", "Total_Certificado",
+                                            "Coste_Imputado", "Segundos_Carga", "Estado"])
+    por_obra.insert(4, '% Avance', _avance(por_obra['Total_Certificado'], por_obra['Presupuesto_Adjudicado']))
+    return por_obra, detalle
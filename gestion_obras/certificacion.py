@@ -0,0 +1,413 @@
+import difflib
+from collections import deque
+
+import numpy as np
+import pandas as pd
+
+from gestion_obras.escritura import COLUMNA_FILA
+from gestion_obras.texto import AutomataPatrones, limpiar_texto, trigramas
+
+
+# --- MACHEADOR DE CERTIFICACIÓN CONTRA PRESUPUESTO ---
+# Se construye una vez por presupuesto y reproduce el orden de las cuatro
+# búsquedas (código exacto, nombre exacto, parcial, difuso) con memoria
+# secuencial: una línea usada no vuelve a casarse.
+class MacheadorPresupuesto:
+    def __init__(self, pto_codigos, pto_nombres, cutoff=0.85):
+        self.cutoff = cutoff
+        self.pto_nombres = list(pto_nombres)
+        self.usadas = np.zeros(len(self.pto_nombres), dtype=bool)
+
+        # Índices hash: valor -> cola de líneas (en orden) aún sin usar
+        self._por_codigo = {}
+        for i, c in enumerate(pto_codigos):
+            self._por_codigo.setdefault(c, deque()).append(i)
+
+        self._nombres = []
+        self._id_nombre = {}
+        self._colas_nombre = []
+        for i, n in enumerate(self.pto_nombres):
+            if not n:
+                continue
+            id_n = self._id_nombre.get(n)
+            if id_n is None:
+                id_n = self._id_nombre[n] = len(self._nombres)
+                self._nombres.append(n)
+                self._colas_nombre.append(deque())
+            self._colas_nombre[id_n].append(i)
+        self._libres_nombre = np.array([len(q) for q in self._colas_nombre], dtype=np.int64)
+
+        # Búsqueda parcial: autómata para "nombre del presupuesto dentro del texto"
+        # y trigramas para "texto dentro del nombre del presupuesto"
+        self._ids_largos = [id_n for id_n, n in enumerate(self._nombres) if len(n) > 4]
+        self._automata = AutomataPatrones([self._nombres[id_n] for id_n in self._ids_largos])
+        self._trigramas = {}
+        for id_n in self._ids_largos:
+            for tg in trigramas(self._nombres[id_n]):
+                self._trigramas.setdefault(tg, []).append(id_n)
+
+        # Búsqueda difusa: longitud y perfil de caracteres de cada nombre para
+        # descartar sin calcular SequenceMatcher (cotas exactas de difflib)
+        self._longitudes = np.array([len(n) for n in self._nombres], dtype=np.int64)
+        self._alfabeto = {}
+        for n in self._nombres:
+            for car in n:
+                self._alfabeto.setdefault(car, len(self._alfabeto))
+        self._perfiles = np.zeros((len(self._nombres), max(len(self._alfabeto), 1)), dtype=np.int32)
+        for id_n, n in enumerate(self._nombres):
+            for car in n:
+                self._perfiles[id_n, self._alfabeto[car]] += 1
+
+    def _primera_libre(self, cola):
+        while cola and self.usadas[cola[0]]:
+            cola.popleft()
+        return cola[0] if cola else -1
+
+    def marcar_usada(self, idx):
+        if not self.usadas[idx]:
+            self.usadas[idx] = True
+            id_n = self._id_nombre.get(self.pto_nombres[idx])
+            if id_n is not None:
+                self._libres_nombre[id_n] -= 1
+
+    def _por_codigo_exacto(self, cod_val):
+        cola = self._por_codigo.get(cod_val)
+        return self._primera_libre(cola) if cola else -1
+
+    def _por_nombre_exacto(self, nom_norm):
+        id_n = self._id_nombre.get(nom_norm)
+        return self._primera_libre(self._colas_nombre[id_n]) if id_n is not None else -1
+
+    def _por_nombre_parcial(self, nom_norm):
+        candidatos = {self._ids_largos[p] for p in self._automata.buscar(nom_norm)}
+
+        listas = sorted((self._trigramas.get(tg, []) for tg in trigramas(nom_norm)), key=len)
+        if listas and listas[0]:
+            comunes = set(listas[0])
+            for lista in listas[1:]:
+                comunes.intersection_update(lista)
+                if not comunes:
+                    break
+            candidatos.update(id_n for id_n in comunes if nom_norm in self._nombres[id_n])
+
+        mejor = -1
+        for id_n in candidatos:
+            idx = self._primera_libre(self._colas_nombre[id_n])
+            if idx != -1 and (mejor == -1 or idx < mejor):
+                mejor = idx
+        return mejor
+
+    def _por_nombre_difuso(self, nom_norm):
+        if not self._nombres:
+            return -1
+        lq = len(nom_norm)
+        longitudes = self._longitudes
+        holgura = self.cutoff - 1e-9
+
+        # real_quick_ratio y quick_ratio de difflib como filtros vectorizados
+        cota_long = 2.0 * np.minimum(longitudes, lq) / (longitudes + lq)
+        perfil_q = np.zeros(self._perfiles.shape[1], dtype=np.int32)
+        resto = 0
+        for car in nom_norm:
+            pos = self._alfabeto.get(car)
+            if pos is None:
+                resto += 1
+            else:
+                perfil_q[pos] += 1
+        cand = np.flatnonzero((self._libres_nombre > 0) & (cota_long >= holgura))
+        if not len(cand):
+            return -1
+        comunes = np.minimum(self._perfiles[cand], perfil_q).sum(axis=1)
+        cand = cand[2.0 * comunes / (longitudes[cand] + lq) >= holgura]
+
+        # Mismo criterio que get_close_matches(n=1): mayor (ratio, nombre)
+        s = difflib.SequenceMatcher()
+        s.set_seq2(nom_norm)
+        mejor = None
+        for id_n in cand:
+            x = self._nombres[id_n]
+            s.set_seq1(x)
+            if s.real_quick_ratio() >= self.cutoff and s.quick_ratio() >= self.cutoff:
+                r = s.ratio()
+                if r >= self.cutoff and (mejor is None or (r, x) > mejor):
+                    mejor = (r, x)
+        if mejor is None:
+            return -1
+        return self._primera_libre(self._colas_nombre[self._id_nombre[mejor[1]]])
+
+    def casar(self, cod_val, nom_norm):
+        match_idx = -1
+        if cod_val:
+            match_idx = self._por_codigo_exacto(cod_val)
+        if match_idx == -1 and nom_norm:
+            match_idx = self._por_nombre_exacto(nom_norm)
+        if match_idx == -1 and nom_norm and len(nom_norm) > 4:
+            match_idx = self._por_nombre_parcial(nom_norm)
+        if match_idx == -1 and nom_norm:
+            match_idx = self._por_nombre_difuso(nom_norm)
+        if match_idx != -1:
+            self.marcar_usada(match_idx)
+        return match_idx
+
+
+# --- LECTURA DEL DOCUMENTO DE CERTIFICACIÓN ---
+def lineas_certificacion(df_excel, idx_cod, idx_nom, idx_can, idx_nat=-1):
+    # Devuelve (código, nombre, cantidad a origen) de las líneas útiles:
+    # fuera capítulos, cabeceras, agrupados y cantidades vacías o a cero.
+    lineas = []
+    minimo = max(idx_cod, idx_nom, idx_can)
+    for _, row in df_excel.iterrows():
+        if len(row) <= minimo: continue
+
+        if idx_nat != -1 and len(row) > idx_nat and pd.notna(row[idx_nat]):
+            nat_val = str(row[idx_nat]).strip().lower()
+            if "capítulo" in nat_val or "capitulo" in nat_val:
+                continue
+
+        cod_val = str(row[idx_cod]).strip() if pd.notna(row[idx_cod]) else ""
+        if cod_val.endswith('.0'): cod_val = cod_val[:-2]
+        nom_val = str(row[idx_nom]).strip() if pd.notna(row[idx_nom]) else ""
+        can_raw = str(row[idx_can]).replace(".", "").replace(",", ".") if isinstance(row[idx_can], str) else row[idx_can]
+        can_val = pd.to_numeric(can_raw, errors='coerce')
+
+        if pd.isna(can_val) or can_val == 0: continue
+        if "código" in cod_val.lower() or "codigo" in cod_val.lower() or "cancert" in cod_val.lower(): continue
+        if "pptoagrupado" in cod_val.lower() or "pptoagrupado" in nom_val.lower(): continue
+        if cod_val == "" and (nom_val == "" or nom_val.replace(".", "").replace(",", "").isnumeric()): continue
+        lineas.append((cod_val, nom_val, can_val))
+    return lineas
+
+
+def casar_certificacion(lineas, df_base):
+    # Casa cada línea con el presupuesto (código exacto -> nombre exacto -> parcial -> difuso).
+    # Devuelve (casadas [(línea del presupuesto, cantidad)], huérfanas).
+    pto_codigos = df_base['Partida_Codigo'].astype(str).replace(r'\.0$', '', regex=True).str.strip().tolist()
+    pto_nombres = df_base['Partida_Nombre'].apply(limpiar_texto).tolist()
+
+    # --- EL BLOQUEO DE MEMORIA (índices + líneas usadas) ---
+    macheador = MacheadorPresupuesto(pto_codigos, pto_nombres)
+    casadas, huerfanas = [], []
+    for cod_val, nom_val, can_val in lineas:
+        match_idx = macheador.casar(cod_val, limpiar_texto(nom_val))
+        if match_idx != -1:
+            # La línea queda bloqueada en el macheador para no sobrescribirla con capítulos siguientes
+            casadas.append((match_idx, can_val))
+        else:
+            huerfanas.append({"Código": cod_val, "Nombre Original": nom_val, "Cantidad": can_val})
+    return casadas, huerfanas
+
+
+# --- CERTIFICACIONES EN FORMATO LARGO ---
+# Una fila por (Cod_Control, Partida_Codigo, Mes) con lo certificado en el mes y
+# el acumulado a origen. Sustituye a las columnas Cantidad_Mes_N / Importe_Mes_N
+# (formato ancho), que se siguen leyendo y se convierten al vuelo.
+CLAVE_CERTIFICACION = ['Cod_Control', 'Partida_Codigo']
+COLUMNAS_CERTIFICACION = CLAVE_CERTIFICACION + ['Partida_Nombre', 'Mes', 'Cantidad', 'Importe', 'Cantidad_Origen', 'Importe_Origen']
+
+
+def clave_codigo(serie):
+    serie = serie.astype(object)
+    return serie.where(serie.notna(), "").map(str).str.replace(r'\.0$', '', regex=True).str.strip()
+
+
+def es_formato_ancho(df_cert):
+    return any(str(c).startswith(("Cantidad_Mes_", "Importe_Mes_")) for c in df_cert.columns)
+
+
+def recalcular_origen(df_largo):
+    df = df_largo.sort_values(CLAVE_CERTIFICACION + ['Mes'], kind='stable').reset_index(drop=True)
+    df['Mes'] = df['Mes'].astype(int)
+    df['Cantidad'] = df['Cantidad'].astype(float)
+    df['Importe'] = df['Importe'].astype(float)
+    grupos = df.groupby(CLAVE_CERTIFICACION, sort=False)
+    df['Cantidad_Origen'] = grupos['Cantidad'].cumsum()
+    df['Importe_Origen'] = grupos['Importe'].cumsum()
+    return df[COLUMNAS_CERTIFICACION]
+
+
+def _agrupar(df):
+    # Una fila por clave y mes (las líneas de presupuesto repetidas se suman)
+    return df.groupby(CLAVE_CERTIFICACION + ['Mes'], sort=False, as_index=False).agg(
+        Partida_Nombre=('Partida_Nombre', 'first'), Cantidad=('Cantidad', 'sum'), Importe=('Importe', 'sum'))
+
+
+def a_formato_largo(df_cert):
+    if df_cert.empty:
+        return pd.DataFrame(columns=COLUMNAS_CERTIFICACION)
+    nombres = df_cert['Partida_Nombre'] if 'Partida_Nombre' in df_cert.columns else pd.Series("", index=df_cert.index)
+    if not es_formato_ancho(df_cert):
+        df = pd.DataFrame({
+            'Cod_Control': clave_codigo(df_cert['Cod_Control']),
+            'Partida_Codigo': clave_codigo(df_cert['Partida_Codigo']),
+            'Partida_Nombre': nombres,
+            'Mes': pd.to_numeric(df_cert['Mes'], errors='coerce').fillna(0).astype(int),
+            'Cantidad': pd.to_numeric(df_cert['Cantidad'], errors='coerce').fillna(0.0),
+            'Importe': pd.to_numeric(df_cert['Importe'], errors='coerce').fillna(0.0),
+        })
+        return recalcular_origen(_agrupar(df))
+
+    # Migración desde el formato ancho: un bloque por mes, sin las filas a cero
+    meses = sorted({int(str(c).rsplit('_', 1)[1]) for c in df_cert.columns
+                    if str(c).startswith(("Cantidad_Mes_", "Importe_Mes_")) and str(c).rsplit('_', 1)[1].isdigit()})
+    claves = {'Cod_Control': clave_codigo(df_cert['Cod_Control']), 'Partida_Codigo': clave_codigo(df_cert['Partida_Codigo'])}
+    bloques = []
+    for mes in meses:
+        bloque = pd.DataFrame({**claves, 'Partida_Nombre': nombres, 'Mes': mes}, index=df_cert.index)
+        for valor in ('Cantidad', 'Importe'):
+            col = f"{valor}_Mes_{mes}"
+            bloque[valor] = pd.to_numeric(df_cert[col], errors='coerce').fillna(0.0) if col in df_cert.columns else 0.0
+        bloques.append(bloque[(bloque['Cantidad'] != 0) | (bloque['Importe'] != 0)])
+    if not bloques:
+        return pd.DataFrame(columns=COLUMNAS_CERTIFICACION)
+    return recalcular_origen(_agrupar(pd.concat(bloques, ignore_index=True)))
+
+
+def cantidad_anterior(df_largo, mes):
+    # Cantidad certificada a origen antes del mes indicado, por clave
+    previas = df_largo[pd.to_numeric(df_largo['Mes']) < mes]
+    return previas.groupby(CLAVE_CERTIFICACION)['Cantidad'].sum()
+
+
+def origen_certificacion(df_base, casadas):
+    # casadas: [(línea del presupuesto, cantidad a origen del documento)].
+    # Una fila por clave con lo que el documento certifica a origen: varias
+    # líneas con la misma clave suman su origen (lo anterior se descuenta una
+    # sola vez por clave en mes_desde_origen).
+    if not casadas:
+        return pd.DataFrame(columns=CLAVE_CERTIFICACION + ['Partida_Nombre', 'Cantidad_Origen', 'Precio'])
+    idx, cantidad_origen = zip(*casadas)
+    lineas = df_base.iloc[list(idx)]
+    df = pd.DataFrame({
+        'Cod_Control': clave_codigo(lineas['Cod_Control']).to_numpy(),
+        'Partida_Codigo': clave_codigo(lineas['Partida_Codigo']).to_numpy(),
+        'Partida_Nombre': lineas['Partida_Nombre'].to_numpy(),
+        'Cantidad_Origen': np.asarray(cantidad_origen, dtype=float),
+        'Precio': pd.to_numeric(lineas['Precio_Adjudicado'], errors='coerce').to_numpy(),
+    })
+    return df.groupby(CLAVE_CERTIFICACION, sort=False, as_index=False).agg(
+        Partida_Nombre=('Partida_Nombre', 'first'), Cantidad_Origen=('Cantidad_Origen', 'sum'), Precio=('Precio', 'first'))
+
+
+def mes_desde_origen(df_origen, anterior, mes):
+    # Lo del mes es lo de origen menos lo ya certificado (una resta vectorizada)
+    if df_origen.empty:
+        return pd.DataFrame(columns=COLUMNAS_CERTIFICACION)
+    df = df_origen.copy()
+    df['Cod_Control'] = clave_codigo(df['Cod_Control'])
+    df['Partida_Codigo'] = clave_codigo(df['Partida_Codigo'])
+    previa = anterior.reindex(pd.MultiIndex.from_frame(df[CLAVE_CERTIFICACION])).fillna(0.0).to_numpy(dtype=float)
+    df['Mes'] = int(mes)
+    df['Cantidad'] = pd.to_numeric(df['Cantidad_Origen'], errors='coerce').to_numpy(dtype=float) - previa
+    df['Importe'] = df['Cantidad'].to_numpy() * pd.to_numeric(df['Precio'], errors='coerce').to_numpy(dtype=float)
+    return df[CLAVE_CERTIFICACION + ['Mes', 'Partida_Nombre', 'Cantidad', 'Importe']]
+
+
+def certificacion_mes(df_base, casadas, anterior, mes):
+    return mes_desde_origen(origen_certificacion(df_base, casadas), anterior, mes)
+
+
+def sustituir_mes(df_largo, df_mes, mes):
+    # El mes se reemplaza entero (volver a certificarlo no duplica) y se rehacen los acumulados
+    resto = df_largo[pd.to_numeric(df_largo['Mes']) != mes] if not df_largo.empty else df_largo
+    partes = [p for p in (resto, df_mes) if not p.empty]
+    if not partes:
+        return pd.DataFrame(columns=COLUMNAS_CERTIFICACION)
+    return recalcular_origen(pd.concat(partes, ignore_index=True))
+
+
+# --- CONFIRMACIÓN POR DIFERENCIAS ---
+# Al guardar un mes solo viajan las filas (clave + Mes) que cambian: las del
+# propio mes y, por el acumulado a origen, las de meses posteriores de esas
+# partidas. Las partidas que desaparecen del mes se dejan a 0 (no se borran
+# filas, así las posiciones del resto no se mueven).
+VALORES_CERTIFICACION = ['Cantidad', 'Importe', 'Cantidad_Origen', 'Importe_Origen']
+
+
+def _plan_completo(resultado):
+    return {"guardar": resultado, "resultado": resultado, "actualizar": pd.DataFrame(), "anexar": pd.DataFrame(),
+            "modificadas": 0, "nuevas": len(resultado), "sin_cambios": 0}
+
+
+def plan_certificacion(df_cert, df_mes, mes, tolerancia=1e-6):
+    # df_cert: la pestaña tal como está guardada; df_mes: lo del mes (certificacion_mes).
+    # Devuelve {"actualizar": celdas con COLUMNA_FILA, "anexar": filas nuevas,
+    # "resultado": la pestaña en formato largo tras el cambio, + contadores}.
+    # Si no se puede casar por posición (formato ancho, columnas que faltan,
+    # claves repetidas) "guardar" trae la pestaña entera para reescribirla.
+    mes = int(mes)
+    largo = a_formato_largo(df_cert)
+    if df_cert.empty:
+        # Primera certificación de la obra: todo son filas nuevas
+        resultado = sustituir_mes(largo, df_mes, mes)
+        return {**_plan_completo(resultado), "guardar": None, "anexar": resultado}
+    if es_formato_ancho(df_cert) or not set(COLUMNAS_CERTIFICACION) <= set(df_cert.columns):
+        return _plan_completo(sustituir_mes(largo, df_mes, mes))
+    claves = CLAVE_CERTIFICACION + ['Mes']
+    guardadas = pd.DataFrame({
+        'Cod_Control': clave_codigo(df_cert['Cod_Control']).to_numpy(),
+        'Partida_Codigo': clave_codigo(df_cert['Partida_Codigo']).to_numpy(),
+        'Mes': pd.to_numeric(df_cert['Mes'], errors='coerce').fillna(0).astype(int).to_numpy(),
+    })
+    if guardadas.duplicated().any():
+        return _plan_completo(sustituir_mes(largo, df_mes, mes))
+
+    # Partidas del mes que ya no vienen: se quedan con el mes a 0
+    del_mes = largo.loc[largo['Mes'] == mes, claves + ['Partida_Nombre']]
+    quitadas = del_mes.merge(df_mes[CLAVE_CERTIFICACION].drop_duplicates(), on=CLAVE_CERTIFICACION, how='left', indicator=True)
+    quitadas = quitadas[quitadas['_merge'] == 'left_only'].drop(columns='_merge').assign(Cantidad=0.0, Importe=0.0)
+    partes = [p for p in (df_mes, quitadas) if not p.empty]
+    resultado = sustituir_mes(largo, pd.concat(partes, ignore_index=True) if partes else df_mes, mes)
+
+    guardadas[COLUMNA_FILA] = np.arange(len(df_cert))
+    for col in VALORES_CERTIFICACION:
+        guardadas[col] = pd.to_numeric(df_cert[col], errors='coerce').to_numpy(dtype=float)
+    objetivo = resultado[claves + VALORES_CERTIFICACION].assign(_i=np.arange(len(resultado)))
+    cruce = guardadas.merge(objetivo, on=claves, how='outer', suffixes=('_guardado', ''), indicator=True)
+    if (cruce['_merge'] == 'left_only').any():
+        return _plan_completo(resultado)
+
+    ambos = cruce[cruce['_merge'] == 'both']
+    distintas = np.zeros(len(ambos), dtype=bool)
+    for col in VALORES_CERTIFICACION:
+        antes, despues = ambos[f"{col}_guardado"].to_numpy(), ambos[col].to_numpy(dtype=float)
+        distintas |= np.isnan(antes) | (np.abs(despues - np.nan_to_num(antes)) > tolerancia)
+    cambian = ambos[distintas]
+    nuevas = cruce.loc[cruce['_merge'] == 'right_only', '_i'].astype(int).sort_values()
+
+    actualizar = cambian[[COLUMNA_FILA] + VALORES_CERTIFICACION].astype({COLUMNA_FILA: int})
+    return {
+        "guardar": None,
+        "resultado": resultado,
+        "actualizar": actualizar.sort_values(COLUMNA_FILA).reset_index(drop=True),
+        "anexar": resultado.iloc[nuevas.to_numpy()].reset_index(drop=True),
+        "modificadas": len(cambian),
+        "nuevas": len(nuevas),
+        "sin_cambios": len(ambos) - len(cambian),
+    }
+
+
+def plan_desde_origen(df_cert, df_origen, mes, tolerancia=1e-6):
+    # Para confirmar_diferencias: lo ya certificado antes del mes se toma de la
+    # pestaña tal como está al guardar (no de la lectura al validar), así un mes
+    # anterior guardado entretanto por otro usuario también se descuenta.
+    anterior = cantidad_anterior(a_formato_largo(df_cert), int(mes))
+    return plan_certificacion(df_cert, mes_desde_origen(df_origen, anterior, mes), mes, tolerancia)
+
+
+def vista_ancha(df_largo):
+    # Pivotado a Cantidad_Mes_N / Importe_Mes_N para el informe y la gráfica
+    if df_largo.empty:
+        return pd.DataFrame(columns=CLAVE_CERTIFICACION + ['Partida_Nombre'])
+    tabla = df_largo.pivot_table(index=CLAVE_CERTIFICACION, columns='Mes', values=['Cantidad', 'Importe'], aggfunc='sum', fill_value=0.0)
+    columnas = []
+    for mes in sorted(df_largo['Mes'].unique()):
+        columnas += [('Cantidad', mes), ('Importe', mes)]
+    tabla = tabla[columnas]
+    tabla.columns = [f"{valor}_Mes_{mes}" for valor, mes in columnas]
+    nombres = df_largo.groupby(CLAVE_CERTIFICACION)['Partida_Nombre'].first()
+    return tabla.join(nombres).reset_index()[CLAVE_CERTIFICACION + ['Partida_Nombre'] + list(tabla.columns)]
+
+
+def certificacion_ancha(df_cert):
+    # Acepta la hoja en cualquiera de los dos formatos
+    return vista_ancha(a_formato_largo(df_cert))
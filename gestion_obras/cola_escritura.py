@@ -0,0 +1,357 @@
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+
+import pandas as pd
+
+from gestion_obras.almacen import Almacen, HojaNoEncontrada, valor_nativo
+from gestion_obras.escritura import COLUMNA_FILA, alinear_con_cabecera, aplicar_actualizacion
+
+
+# --- SERIALIZACIÓN PARA EL DIARIO ---
+def _a_json(df):
+    filas = [[valor_nativo(v) for v in fila] for fila in df.itertuples(index=False, name=None)]
+    return json.dumps({"columnas": [str(c) for c in df.columns], "filas": filas}, ensure_ascii=False)
+
+
+def _de_json(texto):
+    datos = json.loads(texto)
+    return pd.DataFrame(datos["filas"], columns=datos["columnas"])
+
+
+# Tipos de operación: "escribir" (pestaña entera), "anexar" (filas nuevas con
+# las columnas de la cabecera), "ampliar" (filas nuevas que pueden añadir
+# columnas a la cabecera) y "actualizar" (celdas por COLUMNA_FILA).
+ANEXOS = ("anexar", "ampliar")
+
+
+def combinar(operaciones, estricto=True):
+    # operaciones: [(tipo, df)] en orden de llegada para una misma pestaña.
+    # Una escritura completa anula todo lo anterior y absorbe lo que venga
+    # después; si no la hay, los anexos seguidos del mismo tipo se concatenan
+    # y las actualizaciones seguidas de las mismas columnas se juntan.
+    # Devuelve [(tipo, df, cuantas)]: operaciones equivalentes, en orden, y
+    # cuántas de las originales cubre cada una.
+    ultima_completa = max((i for i, (tipo, _) in enumerate(operaciones) if tipo == "escribir"), default=-1)
+    if ultima_completa >= 0:
+        return [("escribir", aplicar(operaciones[ultima_completa][1], operaciones[ultima_completa + 1:], estricto), len(operaciones))]
+    resultado = []
+    for tipo, df in operaciones:
+        if resultado and resultado[-1][0] == tipo and tipo in ANEXOS:
+            resultado[-1] = (tipo, pd.concat([resultado[-1][1], df], ignore_index=True), resultado[-1][2] + 1)
+        elif resultado and resultado[-1][0] == tipo == "actualizar" and list(resultado[-1][1].columns) == list(df.columns):
+            junto = pd.concat([resultado[-1][1], df], ignore_index=True).drop_duplicates(COLUMNA_FILA, keep="last")
+            resultado[-1] = (tipo, junto, resultado[-1][2] + 1)
+        else:
+            resultado.append((tipo, df, 1))
+    return resultado
+
+
+def aplicar(base, operaciones, estricto=True):
+    # Estado de la pestaña tras aplicar [(tipo, df)] sobre base.
+    # estricto=False: los anexos con columnas desconocidas también se aplican
+    # (para enseñar lo pendiente al leer; al enviar, el destino los rechaza).
+    for tipo, df in operaciones:
+        if tipo == "escribir":
+            base = df
+        elif tipo in ANEXOS:
+            base = aplicar_anexos(base, [df], ampliar=tipo == "ampliar" or not estricto)
+        else:
+            base = aplicar_actualizacion(base, df)
+    return base
+
+
+def aplicar_anexos(base, anexos, ampliar=False):
+    anexos = [df for df in anexos if not df.empty]
+    if not anexos:
+        return base
+    cabecera_final, _, df_alineado = alinear_con_cabecera(pd.concat(anexos, ignore_index=True), [str(c) for c in base.columns], ampliar)
+    return pd.concat([base.rename(columns=str).reindex(columns=cabecera_final), df_alineado], ignore_index=True)
+
+
+# --- COLA DE ESCRITURA DIFERIDA ---
+# Cada escritura se apunta en un diario SQLite local (sobrevive a reinicios) y
+# se devuelve el control al momento. Un hilo de fondo agrupa lo pendiente por
+# (libro, pestaña) y lo envía al destino en una sola llamada por pestaña.
+# Una operación que falla max_intentos veces, o con un error que no se arregla
+# reintentando (datos que no encajan en la hoja), pasa a la tabla descartadas
+# para que no bloquee lo que viene detrás en esa pestaña.
+ERRORES_PERMANENTES = (ValueError, KeyError, IndexError, TypeError)
+
+
+class ColaEscritura:
+    def __init__(self, ruta, destino, retardo=0.5, espera_maxima=60.0, max_intentos=5):
+        self.ruta = ruta
+        self.destino = destino
+        self.retardo = retardo
+        self.espera_maxima = espera_maxima
+        self.max_intentos = max_intentos
+        self._lock = threading.Lock()
+        self._locks_hoja = {}
+        self._evento = threading.Event()
+        self._latencias = deque(maxlen=50)
+        self.encoladas = 0
+        self.envios = 0
+        self.ultima_encolada_ms = None
+        self.ultima_sincronizacion = None
+        self.ultimo_error = None
+        self._fallos_seguidos = 0
+
+        os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+        with self._conectar() as con:
+            con.execute("PRAGMA journal_mode=WAL")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS pendientes ("
+                "id INTEGER PRIMARY KEY AUTOINCREMENT, url TEXT, hoja TEXT, tipo TEXT, datos TEXT, creado REAL)"
+            )
+            # Diarios de versiones anteriores no llevan la cuenta de fallos
+            columnas = {fila[1] for fila in con.execute("PRAGMA table_info(pendientes)")}
+            if "intentos" not in columnas:
+                con.execute("ALTER TABLE pendientes ADD COLUMN intentos INTEGER DEFAULT 0")
+            if "ultimo_error" not in columnas:
+                con.execute("ALTER TABLE pendientes ADD COLUMN ultimo_error TEXT")
+            con.execute(
+                "CREATE TABLE IF NOT EXISTS descartadas ("
+                "id INTEGER PRIMARY KEY, url TEXT, hoja TEXT, tipo TEXT, datos TEXT, creado REAL, "
+                "intentos INTEGER, ultimo_error TEXT, descartada REAL)"
+            )
+
+        self._hilo = threading.Thread(target=self._trabajar, name="cola-escritura", daemon=True)
+        self._hilo.start()
+        # Lo que quedó pendiente de una ejecución anterior se reenvía al arrancar
+        if self.profundidad():
+            self._evento.set()
+
+    @contextmanager
+    def _conectar(self):
+        con = sqlite3.connect(self.ruta, timeout=30)
+        try:
+            with con:
+                yield con
+        finally:
+            con.close()
+
+    def _lock_hoja(self, url, hoja):
+        with self._lock:
+            return self._locks_hoja.setdefault((url, hoja), threading.Lock())
+
+    # --- ENTRADA ---
+    def encolar(self, url, hoja, tipo, df):
+        inicio = time.perf_counter()
+        with self._conectar() as con:
+            con.execute(
+                "INSERT INTO pendientes (url, hoja, tipo, datos, creado) VALUES (?, ?, ?, ?, ?)",
+                (url, hoja, tipo, _a_json(df), time.time()),
+            )
+        with self._lock:
+            self.encoladas += 1
+            self.ultima_encolada_ms = (time.perf_counter() - inicio) * 1000
+        self._evento.set()
+
+    def pendientes(self, url=None, hoja=None):
+        # [(id, url, hoja, tipo, df)] en orden de llegada
+        return [op[:5] for op in self._pendientes(url, hoja)]
+
+    def _pendientes(self, url=None, hoja=None):
+        # Como pendientes, con los intentos fallidos de cada operación al final
+        sql = "SELECT id, url, hoja, tipo, datos, intentos FROM pendientes"
+        parametros = ()
+        if url is not None:
+            sql += " WHERE url = ? AND hoja = ?"
+            parametros = (url, hoja)
+        with self._conectar() as con:
+            filas = con.execute(sql + " ORDER BY id", parametros).fetchall()
+        return [(i, u, h, tipo, _de_json(datos), intentos or 0) for i, u, h, tipo, datos, intentos in filas]
+
+    def profundidad(self):
+        with self._conectar() as con:
+            return con.execute("SELECT COUNT(*) FROM pendientes").fetchone()[0]
+
+    def descartadas(self):
+        # Operaciones que no se enviarán solas: quedan aquí para revisarlas a mano
+        with self._conectar() as con:
+            filas = con.execute(
+                "SELECT id, url, hoja, tipo, datos, intentos, ultimo_error, descartada FROM descartadas ORDER BY id"
+            ).fetchall()
+        return pd.DataFrame(
+            [(i, u, h, tipo, len(_de_json(datos)), intentos, error, descartada) for i, u, h, tipo, datos, intentos, error, descartada in filas],
+            columns=["id", "url", "hoja", "tipo", "filas", "intentos", "error", "descartada"],
+        )
+
+    # --- LECTURA CON LO PENDIENTE APLICADO ---
+    def leer(self, url, hoja):
+        with self._lock_hoja(url, hoja):
+            ops = [(tipo, df) for _, _, _, tipo, df in self.pendientes(url, hoja)]
+            try:
+                base = self.destino.leer(url, hoja)
+            except HojaNoEncontrada:
+                if not ops:
+                    raise
+                base = pd.DataFrame()
+        if not ops:
+            return base
+        return aplicar(base, [(tipo, df) for tipo, df, _ in combinar(ops, estricto=False)], estricto=False)
+
+    # --- ENVÍO ---
+    def _enviar(self, url, hoja, tipo, df):
+        if tipo == "escribir":
+            self.destino.escribir(url, hoja, df)
+        elif tipo == "actualizar":
+            self.destino.actualizar_filas(url, hoja, df)
+        elif not df.empty:
+            self.destino.anexar(url, hoja, df, ampliar=tipo == "ampliar")
+
+    def _anotar_fallo(self, ids, error, permanente):
+        # Suma un intento a cada operación; si es una sola y ya no tiene arreglo
+        # (o ha agotado los intentos) pasa a descartadas. Devuelve si se descartó.
+        with self._conectar() as con:
+            con.executemany(
+                "UPDATE pendientes SET intentos = intentos + 1, ultimo_error = ? WHERE id = ?",
+                [(error, i) for i in ids],
+            )
+            if len(ids) != 1:
+                return False
+            intentos = con.execute("SELECT intentos FROM pendientes WHERE id = ?", (ids[0],)).fetchone()[0]
+            if not permanente and intentos < self.max_intentos:
+                return False
+            con.execute(
+                "INSERT INTO descartadas (id, url, hoja, tipo, datos, creado, intentos, ultimo_error, descartada) "
+                "SELECT id, url, hoja, tipo, datos, creado, intentos, ultimo_error, ? FROM pendientes WHERE id = ?",
+                (time.time(), ids[0]),
+            )
+            con.execute("DELETE FROM pendientes WHERE id = ?", (ids[0],))
+        return True
+
+    def sincronizar(self):
+        # Envía todo lo pendiente; devuelve el número de pestañas con error
+        por_hoja = {}
+        for id_op, url, hoja, tipo, df, intentos in self._pendientes():
+            por_hoja.setdefault((url, hoja), []).append((id_op, tipo, df, intentos))
+
+        errores = 0
+        for (url, hoja), ops in por_hoja.items():
+            inicio = time.perf_counter()
+            with self._lock_hoja(url, hoja):
+                # Si algo de esta pestaña ya ha fallado se envía de una en una,
+                # para saber qué operación es la que falla
+                if any(intentos for *_, intentos in ops):
+                    lotes = [([id_op], tipo, df) for id_op, tipo, df, _ in ops]
+                else:
+                    lotes, enviadas = [], 0
+                    for tipo, df, cuantas in combinar([(tipo, df) for _, tipo, df, _ in ops]):
+                        lotes.append(([id_op for id_op, *_ in ops[enviadas:enviadas + cuantas]], tipo, df))
+                        enviadas += cuantas
+                fallo = False
+                for ids, tipo, df in lotes:
+                    try:
+                        self._enviar(url, hoja, tipo, df)
+                    except Exception as e:
+                        mensaje = f"{hoja}: {type(e).__name__}: {e}"
+                        with self._lock:
+                            self.ultimo_error = mensaje
+                        if self._anotar_fallo(ids, mensaje, isinstance(e, ERRORES_PERMANENTES)):
+                            continue
+                        fallo = True
+                        break
+                    # Lo ya enviado sale del diario aunque falle lo siguiente
+                    with self._conectar() as con:
+                        con.executemany("DELETE FROM pendientes WHERE id = ?", [(i,) for i in ids])
+                if fallo:
+                    errores += 1
+                    continue
+            with self._lock:
+                self.envios += 1
+                self._latencias.append((time.perf_counter() - inicio) * 1000)
+                self.ultima_sincronizacion = time.time()
+        return errores
+
+    def _trabajar(self):
+        while True:
+            espera = None
+            if self._fallos_seguidos:
+                espera = min(self.retardo * 2 ** self._fallos_seguidos, self.espera_maxima)
+            self._evento.wait(timeout=espera)
+            # Pequeña pausa para juntar las escrituras que llegan en ráfaga
+            time.sleep(self.retardo)
+            self._evento.clear()
+            try:
+                errores = self.sincronizar()
+            except Exception as e:
+                errores = 1
+                with self._lock:
+                    self.ultimo_error = f"{type(e).__name__}: {e}"
+            with self._lock:
+                self._fallos_seguidos = min(self._fallos_seguidos + 1, 10) if errores else 0
+                if not errores:
+                    self.ultimo_error = None
+
+    def esperar(self, timeout=30.0):
+        # Bloquea hasta que el diario quede vacío (o venza el plazo)
+        limite = time.time() + timeout
+        self._evento.set()
+        while self.profundidad() and time.time() < limite:
+            time.sleep(0.1)
+        return self.profundidad() == 0
+
+    def estadisticas(self):
+        with self._lock:
+            latencias = list(self._latencias)
+            datos = {
+                "encoladas": self.encoladas,
+                "envios": self.envios,
+                "ultima_encolada_ms": self.ultima_encolada_ms,
+                "ultima_latencia_ms": latencias[-1] if latencias else None,
+                "latencia_media_ms": sum(latencias) / len(latencias) if latencias else None,
+                "ultima_sincronizacion": self.ultima_sincronizacion,
+                "ultimo_error": self.ultimo_error,
+            }
+        datos["pendientes"] = self.profundidad()
+        with self._conectar() as con:
+            datos["descartadas"] = con.execute("SELECT COUNT(*) FROM descartadas").fetchone()[0]
+        return datos
+
+
+# --- ALMACÉN CON ESCRITURA DIFERIDA ---
+class AlmacenDiferido(Almacen):
+    def __init__(self, cola):
+        self.cola = cola
+
+    @property
+    def clave(self):
+        return self.cola.destino.clave
+
+    def leer(self, url, hoja):
+        return self.cola.leer(url, hoja)
+
+    def escribir(self, url, hoja, df):
+        self.cola.encolar(url, hoja, "escribir", df)
+
+    def anexar(self, url, hoja, df_nuevas, ampliar=False):
+        # Las columnas se comprueban contra la cabecera al enviar
+        self.cola.encolar(url, hoja, "ampliar" if ampliar else "anexar", df_nuevas)
+        return df_nuevas
+
+    def actualizar_filas(self, url, hoja, df_cambios):
+        self.cola.encolar(url, hoja, "actualizar", df_cambios)
+
+
+_colas = {}
+_lock_colas = threading.Lock()
+
+
+def cola_escritura(ruta, destino=None):
+    # Una cola (y un hilo) por diario y proceso; sobrevive a los reruns.
+    # Sin destino solo devuelve la cola ya creada (o None).
+    with _lock_colas:
+        if destino is None:
+            return _colas.get(ruta)
+        if ruta not in _colas:
+            _colas[ruta] = ColaEscritura(ruta, destino)
+            atexit.register(_colas[ruta].esperar, 10.0)
+        _colas[ruta].destino = destino
+        return _colas[ruta]
@@ -0,0 +1,195 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+from gestion_obras.cache_hojas import version_tabla
+from gestion_obras.texto import normalizar_serie, tokens
+
+
+# Aproximación habitual: ~4 caracteres por token
+def estimar_tokens(texto):
+    return len(texto) // 4 + 1
+
+
+PALABRAS_VACIAS = {
+    "que", "de", "la", "el", "los", "las", "del", "al", "por", "para", "con", "sin", "una", "uno", "unos",
+    "unas", "cual", "cuales", "como", "mas", "menos", "hay", "han", "ha", "se", "su", "sus", "en", "es",
+    "son", "lo", "le", "les", "me", "mi", "y", "o", "a", "un", "cuanto", "cuantos", "cuanta", "cuantas",
+    "donde", "cuando", "quien", "este", "esta", "estos", "estas", "ese", "esa", "todo", "todos",
+}
+
+
+def _tokens_pregunta(pregunta):
+    return [t for t in dict.fromkeys(tokens(pregunta)) if len(t) > 1 and t not in PALABRAS_VACIAS]
+
+
+# --- RESUMEN DE ESQUEMA ---
+def resumen_esquema(nombre, df):
+    lineas = [f"Tabla {nombre}: {len(df)} filas, {len(df.columns)} columnas."]
+    for col in df.columns:
+        serie = df[col]
+        numerica = pd.to_numeric(serie, errors='coerce')
+        if len(serie) and numerica.notna().mean() > 0.8:
+            lineas.append(f"- {col} (número): min={numerica.min():.2f}, max={numerica.max():.2f}, suma={numerica.sum():.2f}, vacíos={int(numerica.isna().sum())}")
+        else:
+            texto = serie.dropna().astype(str)
+            frecuentes = ", ".join(f"{v} ({n})" for v, n in texto.value_counts().head(5).items())
+            lineas.append(f"- {col} (texto): {texto.nunique()} valores distintos. Más frecuentes: {frecuentes}")
+    return "\n".join(lineas)
+
+
+# --- AGREGADOS PRECALCULADOS DEL HISTÓRICO DE PRECIOS ---
+def tablas_derivadas(nombre, df):
+    if not {'Proveedor', 'Descripcion', 'Precio_Unitario'}.issubset(df.columns):
+        return {}
+    d = df.copy()
+    d['Precio_Unitario'] = pd.to_numeric(d['Precio_Unitario'], errors='coerce')
+    if 'Descuento' in d.columns:
+        d['Descuento'] = pd.to_numeric(d['Descuento'], errors='coerce')
+    if 'Fecha' in d.columns:
+        d['_fecha'] = pd.to_datetime(d['Fecha'], errors='coerce')
+        d = d.sort_values('_fecha', kind='stable', na_position='first')
+    d['Proveedor'] = d['Proveedor'].astype(str).str.strip()
+    d['Descripcion'] = d['Descripcion'].astype(str).str.strip()
+
+    agg_prov = {"Lineas": ('Precio_Unitario', 'size'), "Productos": ('Descripcion', 'nunique'), "Precio_Medio": ('Precio_Unitario', 'mean')}
+    if 'Fecha' in d.columns:
+        agg_prov["Ultima_Compra"] = ('Fecha', 'last')
+    por_proveedor = d.groupby('Proveedor', sort=True).agg(**agg_prov).reset_index()
+
+    claves = ['Proveedor', 'Descripcion']
+    d['Precio_Anterior'] = d.groupby(claves, sort=False)['Precio_Unitario'].shift(1)
+    columnas = {'Precio_Unitario': 'Ultimo_Precio', 'Precio_Anterior': 'Precio_Anterior'}
+    if 'Descuento' in d.columns:
+        columnas['Descuento'] = 'Ultimo_Descuento'
+    if 'Fecha' in d.columns:
+        columnas['Fecha'] = 'Ultima_Fecha'
+    ultimas = d.drop_duplicates(claves, keep='last').set_index(claves)[list(columnas)].rename(columns=columnas)
+    estadisticas = d.groupby(claves, sort=False)['Precio_Unitario'].agg(Precio_Min='min', Precio_Max='max', Compras='size')
+    por_producto = ultimas.join(estadisticas)
+    por_producto["Variacion_%"] = ((por_producto["Ultimo_Precio"] - por_producto["Precio_Anterior"]) / por_producto["Precio_Anterior"] * 100).round(2)
+    por_producto = por_producto.reset_index()
+
+    variaciones = por_producto[por_producto["Variacion_%"].fillna(0) != 0]
+    variaciones = variaciones.reindex(variaciones["Variacion_%"].abs().sort_values(ascending=False).index).head(25)
+
+    return {
+        f"{nombre}_Resumen_Proveedores": por_proveedor,
+        f"{nombre}_Mayores_Variaciones": variaciones,
+        f"{nombre}_Ultimo_Precio_Producto": por_producto,
+    }
+
+
+# --- ÍNDICE DE PALABRAS CLAVE POR TABLA ---
+class IndiceTabla:
+    def __init__(self, nombre, df):
+        self.nombre = nombre
+        self.df = df.reset_index(drop=True)
+        self.esquema = resumen_esquema(nombre, self.df)
+        self.tokens_completo = estimar_tokens(self.df.to_csv(index=False)) if not self.df.empty else 0
+        self.tokens_fila = self.tokens_completo / max(len(self.df), 1)
+
+        # token -> posiciones de fila que lo contienen
+        self._indice = {}
+        columnas_texto = [c for c in self.df.columns if self.df[c].dtype == object or pd.api.types.is_string_dtype(self.df[c])]
+        if columnas_texto and not self.df.empty:
+            texto = normalizar_serie(self.df[columnas_texto[0]].astype(object))
+            for c in columnas_texto[1:]:
+                texto = texto + " " + normalizar_serie(self.df[c].astype(object))
+            pares = texto.str.findall(r'[a-z0-9]+').explode().dropna()
+            pares = pd.DataFrame({"token": pares.to_numpy(), "fila": pares.index.to_numpy()}).drop_duplicates()
+            self._indice = {t: np.asarray(pos) for t, pos in pares.groupby("token")["fila"].agg(list).items()}
+
+    def filas_relevantes(self, pregunta):
+        # Posiciones ordenadas por relevancia (suma de IDF de los términos encontrados)
+        terminos = _tokens_pregunta(pregunta)
+        puntuacion = np.zeros(len(self.df))
+        for t in terminos:
+            # Coincidencia exacta o por prefijo ("ladrill" -> "ladrillo")
+            claves = [t] if t in self._indice else [k for k in self._indice if k.startswith(t)][:50]
+            for k in claves:
+                pos = self._indice[k]
+                puntuacion[pos] += np.log(1 + len(self.df) / len(pos))
+        relevantes = np.flatnonzero(puntuacion > 0)
+        return relevantes[np.argsort(-puntuacion[relevantes], kind='stable')]
+
+    def extracto(self, pregunta, presupuesto_tokens):
+        # Tabla completa si cabe; si no, filas relevantes (o las más recientes) hasta agotar el presupuesto
+        if self.df.empty:
+            return "(Sin datos)", 0
+        if self.tokens_completo <= presupuesto_tokens:
+            return self.df.to_csv(index=False), len(self.df)
+        max_filas = int(presupuesto_tokens / max(self.tokens_fila, 1))
+        if max_filas <= 0:
+            return "(Omitida por límite de contexto; ver resumen de esquema)", 0
+        posiciones = self.filas_relevantes(pregunta)[:max_filas]
+        etiqueta = "filas relevantes para la consulta"
+        if not len(posiciones):
+            posiciones = np.arange(max(len(self.df) - max_filas, 0), len(self.df))
+            etiqueta = "últimas filas"
+        csv = self.df.iloc[np.sort(posiciones)].to_csv(index=False)
+        while estimar_tokens(csv) > presupuesto_tokens and len(posiciones) > 1:
+            posiciones = posiciones[:len(posiciones) * 3 // 4]
+            csv = self.df.iloc[np.sort(posiciones)].to_csv(index=False)
+        return f"({len(posiciones)} de {len(self.df)} {etiqueta})\n{csv}", len(posiciones)
+
+
+# Índices cacheados por (tabla, versión de los datos)
+_indices = OrderedDict()
+_lock_indices = threading.Lock()
+MAX_INDICES = 16
+
+
+def indices_para(nombre, df):
+    clave = (nombre, version_tabla(df))
+    with _lock_indices:
+        if clave in _indices:
+            _indices.move_to_end(clave)
+            return _indices[clave]
+    indices = [IndiceTabla(nombre, df)]
+    indices += [IndiceTabla(n, d) for n, d in tablas_derivadas(nombre, df).items()]
+    with _lock_indices:
+        _indices[clave] = indices
+        while len(_indices) > MAX_INDICES:
+            _indices.popitem(last=False)
+    return indices
+
+
+# --- CONSTRUCTOR DE CONTEXTO ---
+def construir_contexto(nombre_modulo, dicc_dataframes, pregunta, presupuesto_tokens=30000):
+    cabecera = f"Eres un analista de datos para un ERP de construcción. Módulo: '{nombre_modulo}'.\nDATOS:\n"
+    instrucciones = """Instrucciones: Responde de forma profesional, clara y concisa. Basa tus cálculos estrictamente en los datos adjuntos. Si solo se adjunta un extracto de una tabla, apóyate en los resúmenes y agregados para los totales.\n\nUsuario: """ + pregunta
+
+    tablas = []
+    vacias = []
+    for nombre_tabla, df in dicc_dataframes.items():
+        if isinstance(df, pd.DataFrame) and not df.empty:
+            derivadas = indices_para(nombre_tabla, df)
+            # Primero los agregados (más densos), después los datos en bruto
+            tablas.extend(derivadas[1:] + derivadas[:1])
+        else:
+            vacias.append(nombre_tabla)
+
+    esquemas = "\n\n".join(t.esquema for t in tablas if t.nombre in dicc_dataframes)
+    restante = presupuesto_tokens - estimar_tokens(cabecera + instrucciones + esquemas)
+
+    # Reparto: las tablas pequeñas entran enteras y lo que sobra pasa a las grandes
+    extractos = {}
+    filas_incluidas = 0
+    pendientes = sorted(range(len(tablas)), key=lambda i: tablas[i].tokens_completo)
+    for n, i in enumerate(pendientes):
+        cuota = max(restante, 0) // (len(pendientes) - n)
+        texto, filas = tablas[i].extracto(pregunta, cuota)
+        extractos[i] = texto
+        filas_incluidas += filas
+        restante -= estimar_tokens(texto)
+
+    contexto = cabecera + "--- ESQUEMAS ---\n" + esquemas + "\n\n"
+    for i, t in enumerate(tablas):
+        contexto += f"--- {t.nombre} ---\n{extractos[i]}\n\n"
+    for nombre_tabla in vacias:
+        contexto += f"--- {nombre_tabla} ---\n(Sin datos)\n\n"
+    contexto += instrucciones
+    return contexto, {"tokens": estimar_tokens(contexto), "filas": filas_incluidas}
@@ -0,0 +1,250 @@
+import threading
+from contextlib import contextmanager
+
+import pandas as pd
+
+from gestion_obras.almacen import HojaNoEncontrada
+from gestion_obras.cache_hojas import version_tabla
+from gestion_obras.esquemas import aplicar_esquema
+from gestion_obras.ia import procesar_en_paralelo
+from gestion_obras.informe import (
+    HOJA_RESUMEN, construir_resumen, resumen_con_certificacion, resumen_con_presupuesto,
+)
+from gestion_obras.instrumentacion import medir, tamano_df
+
+
+def huella_hoja(df):
+    # Versión de una pestaña tal como se leyó (filas + contenido)
+    return f"{len(df)}:{version_tabla(df)}"
+
+
+# --- BLOQUEOS POR PESTAÑA (COMPARTIDOS EN EL PROCESO) ---
+# Streamlit crea un AccesoDatos nuevo en cada rerun de cada sesión: los
+# bloqueos y los contadores viven aquí, uno por destino (Almacen.clave), para
+# que dos usuarios que guardan en la misma pestaña se esperen de verdad.
+class EscriturasHojas:
+    def __init__(self):
+        self._bloqueos = {}
+        self._lock = threading.Lock()
+        self.confirmaciones = 0
+        self.rebases = 0
+
+    @contextmanager
+    def bloqueo(self, hoja, url):
+        clave = (str(url), str(hoja))
+        with self._lock:
+            if clave not in self._bloqueos:
+                self._bloqueos[clave] = threading.RLock()
+            bloqueo = self._bloqueos[clave]
+        with bloqueo:
+            yield
+
+    def anotar_confirmacion(self, rebase):
+        with self._lock:
+            self.confirmaciones += 1
+            self.rebases += bool(rebase)
+
+
+_escrituras_hojas = {}
+_lock_escrituras_hojas = threading.Lock()
+
+
+def escrituras_hojas(clave):
+    # Una instancia por destino y proceso; sobrevive a los reruns
+    with _lock_escrituras_hojas:
+        if clave not in _escrituras_hojas:
+            _escrituras_hojas[clave] = EscriturasHojas()
+        return _escrituras_hojas[clave]
+
+
+# --- ACCESO A PESTAÑAS (ALMACÉN + CACHÉ) ---
+# Lo que la app y los procesos por lotes usan para leer y guardar pestañas:
+# un Almacen (Sheets, SQLite, espejo o cola diferida) con la caché de hojas
+# por delante. Las mediciones solo se anotan si hay un rerun activo.
+# Las escrituras a una misma pestaña se hacen de una en una dentro del
+# proceso (un bloqueo por pestaña, compartido por todas las instancias con
+# el mismo almacén); las de pestañas distintas no se esperan.
+class AccesoDatos:
+    def __init__(self, almacen, cache):
+        self.almacen = almacen
+        self.cache = cache
+        self.estado = escrituras_hojas(almacen.clave)
+
+    def bloqueo(self, hoja, url):
+        return self.estado.bloqueo(hoja, url)
+
+    @property
+    def confirmaciones(self):
+        return self.estado.confirmaciones
+
+    @property
+    def rebases(self):
+        return self.estado.rebases
+
+    def generacion(self, hoja, url):
+        # Cambia con cada descarga o escritura de la pestaña en el proceso; None si caducó en la caché
+        return self.cache.generacion(url, hoja)
+
+    def descargar(self, hoja, url):
+        with medir("descarga", hoja=str(hoja)) as m:
+            df = self.almacen.leer(url, hoja)
+            m["filas"], m["bytes"] = tamano_df(df)
+        # Tipos de la pestaña una sola vez, antes de entrar en caché
+        with medir("tipar", hoja=str(hoja)) as m:
+            df = aplicar_esquema(hoja, df)
+            m["filas"], m["bytes"] = tamano_df(df)
+        return df
+
+    def leer(self, hoja, url):
+        # Como cargar, pero dejando pasar el error (la cartera lo muestra por obra)
+        return self.leer_con_generacion(hoja, url)[0]
+
+    def leer_con_generacion(self, hoja, url):
+        # (df, generación de la entrada de caché de la que sale; ver generacion)
+        with medir("cargar_datos", hoja=str(hoja)) as m:
+            df, generacion = self.cache.obtener_con_generacion(url, hoja, lambda: self.descargar(hoja, url))
+            m["filas"] = len(df)
+        return df, generacion
+
+    def cargar(self, hoja, url):
+        try:
+            return self.leer(hoja, url)
+        except Exception:
+            return pd.DataFrame()
+
+    def cargar_varias(self, claves, previas=None, max_concurrencia=4):
+        # claves: [(hoja, url)] -> ({(hoja, url): df}, copia para el siguiente rerun).
+        # previas: la copia devuelta la vez anterior; se reutiliza sin copiar nada
+        # mientras la entrada de caché de la que salió siga vigente y sin cambios
+        # (ni caducada ni sustituida por una descarga o escritura de otra sesión).
+        previas = previas or {}
+        copia, pendientes = {}, []
+        for clave in dict.fromkeys(claves):
+            previa = previas.get(clave)
+            if previa is not None and previa[0] is not None and previa[0] == self.generacion(*clave):
+                copia[clave] = previa
+            else:
+                pendientes.append(clave)
+
+        def cargar(clave):
+            # Sin generación (pestaña ilegible): vacía, y se vuelve a intentar en el siguiente rerun
+            try:
+                df, generacion = self.leer_con_generacion(*clave)
+            except Exception:
+                return None, pd.DataFrame()
+            return generacion, df
+
+        for i, resultado, error in procesar_en_paralelo(pendientes, cargar, max_concurrencia, intentos=1):
+            copia[pendientes[i]] = resultado if error is None else (None, pd.DataFrame())
+        return {clave: df for clave, (_, df) in copia.items()}, copia
+
+    def guardar(self, hoja, df, url):
+        try:
+            filas, tamano = tamano_df(df)
+            with self.bloqueo(hoja, url), medir("guardar_datos", hoja=str(hoja), filas=filas, bytes=tamano):
+                self.almacen.escribir(url, hoja, df)
+        except Exception:
+            self.cache.invalidar(url, hoja)
+            raise
+        self.cache.actualizar(url, hoja, aplicar_esquema(hoja, df))
+
+    def anexar(self, hoja, df_nuevas, url, ampliar=False):
+        # Solo envía las filas nuevas (coste proporcional a lo que se añade, no al tamaño de la hoja).
+        # Columnas que la pestaña no tiene: ValueError, salvo con ampliar=True.
+        if df_nuevas.empty: return
+        try:
+            filas, tamano = tamano_df(df_nuevas)
+            with self.bloqueo(hoja, url), medir("anexar_datos", hoja=str(hoja), filas=filas, bytes=tamano):
+                df_alineado = self.almacen.anexar(url, hoja, df_nuevas, ampliar)
+        except Exception:
+            self.cache.invalidar(url, hoja)
+            raise
+        self.cache.anexar(url, hoja, df_alineado, tipar=lambda df: aplicar_esquema(hoja, df))
+
+    def actualizar_filas(self, hoja, df_cambios, url):
+        # Solo las celdas de las filas indicadas (ver escritura.COLUMNA_FILA)
+        if df_cambios.empty: return
+        try:
+            filas, tamano = tamano_df(df_cambios)
+            with self.bloqueo(hoja, url), medir("actualizar_filas", hoja=str(hoja), filas=filas, bytes=tamano):
+                self.almacen.actualizar_filas(url, hoja, df_cambios)
+        except Exception:
+            self.cache.invalidar(url, hoja)
+            raise
+        self.cache.actualizar_filas(url, hoja, df_cambios, tipar=lambda df: aplicar_esquema(hoja, df))
+
+    def leer_fresca(self, hoja, url):
+        # Del almacén, sin pasar por la caché (vacía si la pestaña no existe)
+        try:
+            return self.descargar(hoja, url)
+        except HojaNoEncontrada:
+            return pd.DataFrame()
+
+    # --- CONFIRMACIÓN (LECTURA-MODIFICACIÓN-ESCRITURA) ---
+    # Contrato de cambio/planificar: reciben la pestaña tal como está en el
+    # almacén con el bloqueo tomado y TODO lo que devuelven tiene que salir de
+    # ella (más datos que no dependan de la pestaña, como las filas de un
+    # documento importado). Nada calculado sobre una lectura anterior: si otra
+    # sesión guardó entretanto, eso es lo que se perdería. `rebase` solo indica
+    # que la pestaña había cambiado desde `leida` y que el cambio se ha
+    # recalculado sobre la versión actual.
+    def confirmar(self, hoja, url, cambio, leida=None):
+        # Guardado sin pisar a otros usuarios: cambio(df_actual) -> df a guardar
+        # (None: no hay nada que guardar y la pestaña se queda como está).
+        # Devuelve (df guardado o el actual, True si la pestaña había cambiado desde `leida`).
+        with self.bloqueo(hoja, url):
+            actual = self.leer_fresca(hoja, url)
+            rebase = leida is not None and huella_hoja(actual) != leida
+            df = cambio(actual)
+            if df is None:
+                df = actual
+            else:
+                self.guardar(hoja, df, url)
+        self.estado.anotar_confirmacion(rebase)
+        return df, rebase
+
+    def confirmar_diferencias(self, hoja, url, planificar, leida=None):
+        # Como confirmar, pero enviando solo lo que cambia. planificar(df_actual) ->
+        # plan con "actualizar" (celdas por COLUMNA_FILA) y "anexar" (filas nuevas);
+        # si trae "guardar" (un DataFrame) la pestaña se reescribe entera.
+        # Devuelve (plan, True si la pestaña había cambiado desde `leida`).
+        with self.bloqueo(hoja, url):
+            actual = self.leer_fresca(hoja, url)
+            rebase = leida is not None and huella_hoja(actual) != leida
+            plan = planificar(actual)
+            if plan.get("guardar") is not None:
+                self.guardar(hoja, plan["guardar"], url)
+            else:
+                self.actualizar_filas(hoja, plan["actualizar"], url)
+                self.anexar(hoja, plan["anexar"], url)
+        self.estado.anotar_confirmacion(rebase)
+        return plan, rebase
+
+    def actualizar_resumen_cod_control(self, url, df_pto=None, df_cert=None):
+        # Mantiene la pestaña de totales por Cod_Control que lee el Informe Ejecutivo
+        def cambio(resumen):
+            if resumen.empty:
+                # Primera vez en esta obra: se calcula con lo que ya esté guardado
+                resumen = construir_resumen(df_pto if df_pto is not None else self.leer_fresca("Presupuesto_Base", url),
+                                            df_cert if df_cert is not None else self.leer_fresca("Certificaciones_Ingresos", url))
+                return None if resumen.empty else resumen
+            if df_pto is not None:
+                resumen = resumen_con_presupuesto(resumen, df_pto)
+            if df_cert is not None:
+                resumen = resumen_con_certificacion(resumen, df_cert)
+            return resumen
+
+        return self.confirmar(HOJA_RESUMEN, url, cambio)[0]
+
+    def recalcular_resumen(self, url):
+        # Resumen completo desde Presupuesto y Certificaciones, leídos con el
+        # bloqueo del resumen tomado: una certificación que se confirme a la vez
+        # o ya está en lo leído o actualiza el resumen después (no se pierde).
+        # Sin presupuesto ni certificaciones no se escribe una pestaña vacía encima de otra.
+        def cambio(actual):
+            df_pto, df_cert = self.leer_fresca("Presupuesto_Base", url), self.leer_fresca("Certificaciones_Ingresos", url)
+            with medir("construir_resumen", filas=len(df_pto) + len(df_cert)):
+                resumen = construir_resumen(df_pto, df_cert)
+            return None if resumen.empty and actual.empty else resumen
+
+        return self.confirmar(HOJA_RESUMEN, url, cambio)[0]
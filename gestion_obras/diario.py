@@ -0,0 +1,83 @@
+import re
+
+import pandas as pd
+
+from gestion_obras.imputacion import TarifasVigentes, imputaciones_diario
+
+
+JORNADA_HORAS = 8.0
+
+
+# --- PROMPT DEL ASISTENTE DE VOZ ---
+def prompt_partes(fecha_hoy):
+    return f"""
+    Eres el encargado de obra. Extrae los datos del parte de trabajo y devuélvelos ÚNICAMENTE como un ARRAY (lista) de objetos JSON, sin comillas invertidas de markdown.
+
+    REGLAS OBLIGATORIAS:
+    1. SEPARACIÓN DE TAJOS: Si hay distintos trabajos o personas en tareas diferentes (Ej: José en tarea A y Fernando en tarea B), DEBES crear un objeto JSON independiente para cada uno. No los agrupes en una sola línea.
+    2. CÁLCULO DE HORAS:
+       - Si no se especifican horas para una persona, asume por defecto 8.0 horas.
+       - Si dice "mediodía" o "media jornada", son 4.0 horas.
+       - Si da un número de horas exacto, usa ese número.
+
+    Claves requeridas por cada objeto JSON de la lista:
+    - "Fecha": (YYYY-MM-DD, si no se dice una fecha, usa por defecto {fecha_hoy})
+    - "Tarea": Agrupador general (ej: Albañilería, Cimentación).
+    - "Descripción_Tarea": Qué se ha hecho exactamente en esta línea.
+    - "Personal": Nombre(s) del trabajador(es) asignado(s) A ESTE TRABAJO.
+    - "Horas_Personal": número float (horas imputadas a ESTE trabajo).
+    - "Maquinaria": Máquinas usadas (vacío si no hay).
+    - "Horas_Maq": número float.
+    - "Produccion": número float (cantidad ejecutada).
+    - "Unidad": ud, m2, m3, ml, etc.
+    """
+
+
+# --- FILAS DE DIARIO Y COSTES ---
+def fila_diario(fecha, proyecto, tipo_entrada, contenido, tarea, descripcion, personal, horas_personal,
+                maquinaria, horas_maq, produccion, unidad):
+    return {
+        "Fecha": fecha, "Proyecto": proyecto, "Tipo_Entrada": tipo_entrada,
+        "Contenido": contenido, "Tarea": tarea, "Descripción_Tarea": descripcion,
+        "Personal": personal, "Horas_Personal": horas_personal,
+        "Maquinaria": maquinaria, "Horas_Maq": horas_maq, "Produccion": produccion, "Unidad": unidad
+    }
+
+
+def filas_coste_diario(filas_diario, df_tarifas):
+    # Imputaciones de mano de obra y maquinaria de los partes nuevos (tarifas vigentes a su fecha)
+    if not filas_diario:
+        return []
+    return imputaciones_diario(pd.DataFrame(filas_diario), TarifasVigentes(df_tarifas)).to_dict("records")
+
+
+def nombres_personal(personal):
+    # "José, Fernando y Luis" -> ["José", "Fernando", "Luis"]
+    return [n.strip() for n in re.split(r',| y | e ', personal) if n.strip()]
+
+
+def partes_desde_ia(lista_partes, proyecto, origen, fecha_hoy, df_tarifas):
+    # Respuesta del asistente (lista de partes) -> (filas_diario, filas_costes, horas por trabajador)
+    if isinstance(lista_partes, dict):
+        lista_partes = [lista_partes]
+    filas_diario = []
+    horas_trabajadores = {}
+    for parte in lista_partes:
+        fecha = parte.get("Fecha", fecha_hoy)
+        personal = parte.get("Personal", "")
+        horas = float(parte.get("Horas_Personal", 0.0))
+        filas_diario.append(fila_diario(
+            fecha, proyecto, "IA Asistente", f"Procesado de: {origen}",
+            parte.get("Tarea", ""), parte.get("Descripción_Tarea", ""), personal, horas,
+            parte.get("Maquinaria", ""), float(parte.get("Horas_Maq", 0.0)),
+            float(parte.get("Produccion", 0.0)), parte.get("Unidad", "")
+        ))
+        for nombre in nombres_personal(personal):
+            horas_trabajadores[nombre] = horas_trabajadores.get(nombre, 0.0) + horas
+    return filas_diario, filas_coste_diario(filas_diario, df_tarifas), horas_trabajadores
+
+
+def avisos_jornada(horas_trabajadores, jornada=JORNADA_HORAS):
+    # [(trabajador, horas imputadas, diferencia con la jornada)]: negativa = faltan horas, positiva = horas extra
+    return [(trabajador, horas, horas - jornada) for trabajador, horas in horas_trabajadores.items()
+            if (0.0 < horas < jornada) or horas > jornada]
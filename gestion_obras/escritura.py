@@ -0,0 +1,115 @@
+import datetime
+
+import pandas as pd
+
+
+# --- ESCRITURA INCREMENTAL (SOLO FILAS NUEVAS) ---
+def alinear_con_cabecera(df_nuevas, cabecera, ampliar=False):
+    # Devuelve la cabecera final y las filas nuevas ordenadas según ella.
+    # Una columna que no está en la cabecera es un error (suele ser una errata
+    # o un cambio de nombre); con ampliar=True se añade al final de la cabecera.
+    # Si la hoja no tiene cabecera, la ponen las filas nuevas.
+    columnas = [str(c) for c in df_nuevas.columns]
+    if len(set(columnas)) != len(columnas):
+        raise ValueError(f"Columnas duplicadas en las filas a anexar: {columnas}")
+
+    cabecera = [str(c) for c in cabecera]
+    while cabecera and cabecera[-1].strip() == "":
+        cabecera.pop()
+    columnas_nuevas = [c for c in columnas if c not in cabecera]
+    if cabecera and columnas_nuevas and not ampliar:
+        raise ValueError(f"Columnas que no están en la cabecera de la hoja: {columnas_nuevas}")
+    cabecera_final = cabecera + columnas_nuevas
+
+    df_alineado = df_nuevas.copy()
+    df_alineado.columns = columnas
+    df_alineado = df_alineado.reindex(columns=cabecera_final)
+    return cabecera_final, columnas_nuevas, df_alineado
+
+
+def _valor_celda(v):
+    if v is None or (not isinstance(v, str) and pd.api.types.is_scalar(v) and pd.isna(v)):
+        return ""
+    if isinstance(v, (pd.Timestamp, datetime.date)):
+        return v.strftime("%Y-%m-%d")
+    if hasattr(v, "item"):
+        return v.item()
+    return v
+
+
+def filas_para_hoja(df):
+    return [[_valor_celda(v) for v in fila] for fila in df.itertuples(index=False, name=None)]
+
+
+def letra_columna(n):
+    # 1 -> A, 27 -> AA
+    letras = ""
+    while n > 0:
+        n, resto = divmod(n - 1, 26)
+        letras = chr(65 + resto) + letras
+    return letras
+
+
+def anexar_en_hoja(ws, df_nuevas, ampliar=False):
+    # ws: pestaña de gspread. Solo se leen la cabecera y se envían las filas nuevas.
+    cabecera = ws.row_values(1)
+    cabecera_final, columnas_nuevas, df_alineado = alinear_con_cabecera(df_nuevas, cabecera, ampliar)
+
+    if not any(str(c).strip() for c in cabecera):
+        ws.update(values=[cabecera_final] + filas_para_hoja(df_alineado), range_name="A1", value_input_option="USER_ENTERED")
+        return df_alineado
+
+    if columnas_nuevas:
+        if ws.col_count < len(cabecera_final):
+            ws.add_cols(len(cabecera_final) - ws.col_count)
+        inicio = letra_columna(len(cabecera_final) - len(columnas_nuevas) + 1)
+        ws.update(values=[columnas_nuevas], range_name=f"{inicio}1", value_input_option="USER_ENTERED")
+
+    ws.append_rows(filas_para_hoja(df_alineado), value_input_option="USER_ENTERED", table_range="A1")
+    return df_alineado
+
+
+# --- ACTUALIZACIÓN DE FILAS SUELTAS ---
+# df_cambios: columna COLUMNA_FILA con la posición (0 = primera fila de datos)
+# y las columnas a sobrescribir en esas filas. El resto de la hoja no se toca.
+COLUMNA_FILA = "__fila"
+
+
+def aplicar_actualizacion(base, df_cambios):
+    columnas = [str(c) for c in df_cambios.columns if c != COLUMNA_FILA]
+    df = base.rename(columns=str).copy()
+    if df_cambios.empty:
+        return df
+    posiciones = df_cambios[COLUMNA_FILA].astype(int).to_numpy()
+    if len(posiciones) and (posiciones.min() < 0 or posiciones.max() >= len(df)):
+        raise IndexError(f"Filas fuera de la hoja ({len(df)} filas): {posiciones.min()}..{posiciones.max()}")
+    for col in columnas:
+        if col not in df.columns:
+            df[col] = None
+        valores = df_cambios[col].to_numpy()
+        if df[col].dtype != object and df[col].dtype != df_cambios[col].dtype:
+            df[col] = df[col].astype(object)
+        df.iloc[posiciones, df.columns.get_loc(col)] = valores
+    return df
+
+
+def actualizar_en_hoja(ws, df_cambios):
+    # Una celda por (fila, columna) cambiada, todas en una sola petición batch_update
+    if df_cambios.empty:
+        return
+    columnas = [str(c) for c in df_cambios.columns if c != COLUMNA_FILA]
+    cabecera = ws.row_values(1)
+    # Actualizar celdas de una columna que aún no existe la crea (como el motor local)
+    cabecera_final, columnas_nuevas, _ = alinear_con_cabecera(pd.DataFrame(columns=columnas), cabecera, ampliar=True)
+    if columnas_nuevas:
+        if ws.col_count < len(cabecera_final):
+            ws.add_cols(len(cabecera_final) - ws.col_count)
+        inicio = letra_columna(len(cabecera_final) - len(columnas_nuevas) + 1)
+        ws.update(values=[columnas_nuevas], range_name=f"{inicio}1", value_input_option="USER_ENTERED")
+    letras = {c: letra_columna(cabecera_final.index(c) + 1) for c in columnas}
+    rangos = [
+        {"range": f"{letras[col]}{int(pos) + 2}", "values": [[_valor_celda(valor)]]}
+        for pos, fila in zip(df_cambios[COLUMNA_FILA], df_cambios[columnas].itertuples(index=False, name=None))
+        for col, valor in zip(columnas, fila)
+    ]
+    ws.batch_update(rangos, value_input_option="USER_ENTERED")
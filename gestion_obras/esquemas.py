@@ -0,0 +1,105 @@
+import re
+
+import pandas as pd
+
+
+# --- ESQUEMAS POR PESTAÑA ---
+# Tipos de cada columna conocida, aplicados una sola vez al descargar la
+# pestaña (lo que queda en caché ya está tipado y las vistas no tienen que
+# volver a convertir en cada rerun):
+#   "importe"   -> float64 (lo ilegible queda NaN)
+#   "entero"    -> Int64 (admite vacíos)
+#   "codigo"    -> category con los códigos como texto, sin el ".0" que deja
+#                  Sheets en los numéricos ("2.0" y 2 son el mismo código)
+#   "categoria" -> category (textos muy repetidos: Tarea, Unidad, Capítulo...)
+# Las columnas que no aparecen se dejan como llegan.
+ESQUEMAS = {
+    "Diario": {
+        "Proyecto": "categoria", "Tipo_Entrada": "categoria", "Tarea": "categoria", "Unidad": "categoria",
+        "Horas_Personal": "importe", "Horas_Maq": "importe", "Produccion": "importe",
+    },
+    "Costes_Imputados": {
+        "Proyecto": "categoria", "Tarea": "categoria", "Coste_Total": "importe",
+    },
+    "Presupuesto_Base": {
+        "Cod_Control": "codigo", "Capítulo": "categoria", "Partida_Codigo": "codigo", "Unidad": "categoria",
+        "Cantidad_Proyecto": "importe", "PrPres": "importe", "Precio_Licitacion": "importe",
+        "Precio_Adjudicado": "importe", "Coste": "importe", "Importe_Total_Adjudicado": "importe",
+    },
+    "Certificaciones_Ingresos": {
+        "Cod_Control": "codigo", "Capítulo": "categoria", "Partida_Codigo": "codigo", "Partida_Nombre": "categoria",
+        "Unidad": "categoria", "Precio_Adjudicado": "importe", "Mes": "entero", "Cantidad": "importe", "Importe": "importe",
+        "Cantidad_Origen": "importe", "Importe_Origen": "importe",
+    },
+    "Codigos_Control": {
+        "Cod_Control": "codigo",
+    },
+    "Historico_Precios": {
+        "Proveedor": "categoria", "Unidad": "categoria", "Obra": "categoria",
+        "Precio_Unitario": "importe", "Descuento": "importe",
+    },
+    "Tarifas_Personal_Maquinaria": {
+        "Tipo": "categoria", "Coste_Hora": "importe",
+    },
+}
+
+# Columnas por prefijo (certificaciones antiguas en formato ancho)
+PREFIJOS = {
+    "Certificaciones_Ingresos": {"Cantidad_Mes_": "importe", "Importe_Mes_": "importe"},
+}
+
+
+def _categoria(serie):
+    serie = serie.astype(object)
+    return serie.where(serie.notna(), None).astype("category")
+
+
+def _codigo(serie):
+    # Se normalizan las categorías (valores distintos), no fila a fila
+    serie = serie if isinstance(serie.dtype, pd.CategoricalDtype) else _categoria(serie)
+    mapa = {c: re.sub(r'\.0$', '', str(c)).strip() for c in serie.cat.categories}
+    if all(k == v for k, v in mapa.items()):
+        return serie
+    codigos = serie.map(mapa)
+    return codigos if isinstance(codigos.dtype, pd.CategoricalDtype) else _categoria(codigos)
+
+
+def _convertir(serie, tipo):
+    if tipo == "importe":
+        return serie if serie.dtype == "float64" else pd.to_numeric(serie, errors="coerce").astype("float64")
+    if tipo == "entero":
+        if serie.dtype == "Int64":
+            return serie
+        numeros = pd.to_numeric(serie, errors="coerce")
+        # Valores con decimales: se dejan como float antes que truncarlos
+        return numeros.astype("Int64") if (numeros.dropna() % 1 == 0).all() else numeros.astype("float64")
+    if tipo == "codigo":
+        return _codigo(serie)
+    if tipo == "categoria":
+        return serie if isinstance(serie.dtype, pd.CategoricalDtype) else _categoria(serie)
+    raise ValueError(f"Tipo de columna desconocido: {tipo}")
+
+
+def tipo_columna(hoja, columna):
+    esquema = ESQUEMAS.get(str(hoja), {})
+    if columna in esquema:
+        return esquema[columna]
+    for prefijo, tipo in PREFIJOS.get(str(hoja), {}).items():
+        if str(columna).startswith(prefijo):
+            return tipo
+    return None
+
+
+def aplicar_esquema(hoja, df):
+    # Devuelve una copia con las columnas conocidas de la pestaña ya tipadas
+    if str(hoja) not in ESQUEMAS or df.empty:
+        return df
+    tipos = {c: tipo_columna(hoja, c) for c in df.columns}
+    tipos = {c: t for c, t in tipos.items() if t is not None}
+    if not tipos:
+        return df
+    df = df.copy()
+    for columna, tipo in tipos.items():
+        df[columna] = _convertir(df[columna], tipo)
+    return df
+
@@ -0,0 +1,201 @@
+import contextvars
+import hashlib
+import json
+import os
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from gestion_obras.instrumentacion import bytes_contenido, medir
+
+
+# --- UTILIDADES PARA LAS LLAMADAS A GEMINI ---
+def parsear_json_ia(texto):
+    # Limpiar posible formato markdown del JSON
+    texto_json = texto.strip().replace("```json", "").replace("```", "")
+    return json.loads(texto_json)
+
+
+# --- CLIENTE GEMINI (IMPORTACIÓN DIFERIDA) ---
+# google.generativeai tarda en importarse; solo se carga cuando una vista
+# llama de verdad al modelo.
+_lock_gemini = threading.Lock()
+_clave_gemini = None
+
+
+def modelo_gemini(nombre, api_key=None):
+    global _clave_gemini
+    import google.generativeai as genai
+    with _lock_gemini:
+        if api_key and api_key != _clave_gemini:
+            genai.configure(api_key=api_key)
+            _clave_gemini = api_key
+    return genai.GenerativeModel(nombre)
+
+
+def generar_contenido(modelo, contenido, **opciones):
+    # generate_content con tiempo y bytes enviados/recibidos anotados en el rerun
+    with medir("gemini", modelo=getattr(modelo, "model_name", None), bytes=bytes_contenido(contenido)) as m:
+        respuesta = modelo.generate_content(contenido, **opciones)
+        m["bytes_respuesta"] = len(respuesta.text.encode("utf-8"))
+    return respuesta
+
+
+# Errores de red/cuota que merece la pena reintentar (google.api_core y genéricos)
+ERRORES_TRANSITORIOS = (
+    "ResourceExhausted", "TooManyRequests", "ServiceUnavailable", "DeadlineExceeded",
+    "InternalServerError", "GatewayTimeout", "Aborted", "RetryError",
+)
+
+
+def es_error_transitorio(error):
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    return any(c.__name__ in ERRORES_TRANSITORIOS for c in type(error).__mro__)
+
+
+def con_reintentos(funcion, intentos=3, espera_inicial=1.0, factor=2.0, espera_maxima=20.0):
+    espera = espera_inicial
+    for intento in range(1, intentos + 1):
+        try:
+            return funcion()
+        except Exception as e:
+            if intento == intentos or not es_error_transitorio(e):
+                raise
+            time.sleep(min(espera, espera_maxima) * (0.5 + random.random()))
+            espera *= factor
+
+
+def procesar_en_paralelo(entradas, funcion, max_concurrencia=4, intentos=3):
+    # Lanza funcion(entrada) para cada entrada con concurrencia limitada y
+    # devuelve (posición, resultado, error) según van terminando. Cada tarea
+    # corre con una copia del contexto de quien llama (mediciones del rerun).
+    if not entradas:
+        return
+    contexto = contextvars.copy_context()
+    with ThreadPoolExecutor(max_workers=max(1, min(max_concurrencia, len(entradas)))) as pool:
+        futuros = {
+            pool.submit(contexto.copy().run, con_reintentos, lambda e=entrada: funcion(e), intentos): i
+            for i, entrada in enumerate(entradas)
+        }
+        for futuro in as_completed(futuros):
+            i = futuros[futuro]
+            try:
+                yield i, futuro.result(), None
+            except Exception as e:
+                yield i, None, e
+
+
+# --- CACHÉ PERSISTENTE DE RESULTADOS DE EXTRACCIÓN ---
+# Clave = hash(modelo + prompt + bytes subidos). Se guarda el JSON ya parseado
+# en un fichero por clave; al superar max_bytes se borran los menos usados.
+class CacheResultadosIA:
+    def __init__(self, ruta, max_bytes=200 * 1024 * 1024):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self.aciertos = 0
+        self.fallos = 0
+        os.makedirs(ruta, exist_ok=True)
+
+    def clave(self, modelo, contenido):
+        h = hashlib.sha256()
+        h.update(str(modelo).encode("utf-8"))
+        for parte in contenido:
+            h.update(b"\x00")
+            if isinstance(parte, dict):
+                h.update(str(parte.get("mime_type", "")).encode("utf-8"))
+                h.update(b"\x00")
+                datos = parte.get("data", b"")
+                h.update(datos if isinstance(datos, bytes) else str(datos).encode("utf-8"))
+            else:
+                h.update(str(parte).encode("utf-8"))
+        return h.hexdigest()
+
+    def _fichero(self, clave):
+        return os.path.join(self.ruta, f"{clave}.json")
+
+    def obtener(self, clave):
+        fichero = self._fichero(clave)
+        try:
+            with open(fichero, "r", encoding="utf-8") as f:
+                resultado = json.load(f)
+            os.utime(fichero)
+        except (OSError, ValueError):
+            with self._lock:
+                self.fallos += 1
+            return None
+        with self._lock:
+            self.aciertos += 1
+        return resultado
+
+    def guardar(self, clave, resultado):
+        fichero = self._fichero(clave)
+        temporal = f"{fichero}.{threading.get_ident()}.tmp"
+        with open(temporal, "w", encoding="utf-8") as f:
+            json.dump(resultado, f, ensure_ascii=False)
+        os.replace(temporal, fichero)
+        self._expulsar()
+
+    def _expulsar(self):
+        with self._lock:
+            ficheros = []
+            for nombre in os.listdir(self.ruta):
+                if not nombre.endswith(".json"):
+                    continue
+                try:
+                    info = os.stat(os.path.join(self.ruta, nombre))
+                except OSError:
+                    continue
+                ficheros.append((info.st_mtime, info.st_size, nombre))
+            total = sum(f[1] for f in ficheros)
+            for _, tamano, nombre in sorted(ficheros):
+                if total <= self.max_bytes:
+                    break
+                try:
+                    os.remove(os.path.join(self.ruta, nombre))
+                    total -= tamano
+                except OSError:
+                    pass
+
+    def vaciar(self):
+        with self._lock:
+            for nombre in os.listdir(self.ruta):
+                if nombre.endswith(".json"):
+                    try:
+                        os.remove(os.path.join(self.ruta, nombre))
+                    except OSError:
+                        pass
+
+    def estadisticas(self):
+        ficheros = [f for f in os.listdir(self.ruta) if f.endswith(".json")]
+        tamano = sum(os.path.getsize(os.path.join(self.ruta, f)) for f in ficheros if os.path.exists(os.path.join(self.ruta, f)))
+        return {"aciertos": self.aciertos, "fallos": self.fallos, "entradas": len(ficheros), "bytes": tamano}
+
+
+_caches_ia = {}
+_lock_caches_ia = threading.Lock()
+
+
+def cache_resultados_ia(ruta, max_bytes=200 * 1024 * 1024):
+    # Una instancia por ruta y proceso (los contadores sobreviven a los reruns)
+    with _lock_caches_ia:
+        if ruta not in _caches_ia:
+            _caches_ia[ruta] = CacheResultadosIA(ruta, max_bytes)
+        _caches_ia[ruta].max_bytes = max_bytes
+        return _caches_ia[ruta]
+
+
+def extraer_con_cache(cache, modelo, contenido, llamada):
+    # llamada() hace la petición y devuelve el JSON parseado.
+    # Devuelve (resultado, desde_cache).
+    if cache is None:
+        return llamada(), False
+    clave = cache.clave(modelo, contenido)
+    resultado = cache.obtener(clave)
+    if resultado is not None:
+        return resultado, True
+    resultado = llamada()
+    cache.guardar(clave, resultado)
+    return resultado, False
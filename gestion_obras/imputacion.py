@@ -0,0 +1,292 @@
+import numpy as np
+import pandas as pd
+
+from gestion_obras.almacen import HojaNoEncontrada
+from gestion_obras.datos import huella_hoja
+from gestion_obras.escritura import COLUMNA_FILA
+from gestion_obras.ia import procesar_en_paralelo
+from gestion_obras.texto import AutomataPatrones
+
+
+# --- TARIFAS CON FECHA DE VIGENCIA ---
+# Cada fila de Tarifas_Personal_Maquinaria vale desde su Vigente_Desde (las
+# filas sin fecha, desde siempre). Para un parte de fecha F se aplica, por
+# recurso, la última tarifa vigente en F: un cambio de precio es una fila
+# nueva del mismo recurso con fecha posterior.
+TIPOS_TARIFA = ("Personal", "Maquinaria")
+COLUMNAS_DIARIO = {"Personal": ("Personal", "Horas_Personal"), "Maquinaria": ("Maquinaria", "Horas_Maq")}
+PREFIJOS_CONCEPTO = {"Personal": "Mano de obra", "Maquinaria": "Maquinaria"}
+COLUMNAS_COSTES = ["Fecha", "Proyecto", "Tarea", "Concepto", "Coste_Total"]
+DESDE_SIEMPRE = pd.Timestamp("1900-01-01")
+HASTA_SIEMPRE = pd.Timestamp("2200-01-01")
+
+
+def _texto_vacio(x):
+    try:
+        return not x
+    except (TypeError, ValueError):
+        return True
+
+
+def fechas_parte(serie, defecto=HASTA_SIEMPRE):
+    # Fechas ilegibles o vacías: se valoran con la tarifa más reciente
+    fechas = pd.to_datetime(pd.Series(serie, dtype=object), errors="coerce", format="%Y-%m-%d")
+    return fechas.fillna(defecto).astype("datetime64[ns]")
+
+
+class TarifasVigentes:
+    def __init__(self, df_tarifas):
+        self._por_tipo = {}
+        if df_tarifas.empty or not {"Recurso", "Coste_Hora"}.issubset(df_tarifas.columns):
+            return
+        vacia = pd.Series(None, index=df_tarifas.index, dtype=object)
+        df = pd.DataFrame({
+            "patron": df_tarifas["Recurso"].astype(object).map(lambda v: "" if _texto_vacio(v) else str(v).lower()),
+            "tipo": df_tarifas["Tipo"].astype(object) if "Tipo" in df_tarifas.columns else vacia,
+            "desde": fechas_parte(df_tarifas["Vigente_Desde"] if "Vigente_Desde" in df_tarifas.columns else vacia, DESDE_SIEMPRE).to_numpy(),
+            "coste_hora": pd.to_numeric(df_tarifas["Coste_Hora"], errors="coerce").to_numpy(),
+        })
+        df = df[(df["patron"] != "") & (df["patron"] != "nan")]
+        for tipo in TIPOS_TARIFA:
+            # Sin tipo indicado, la tarifa vale para personal y maquinaria
+            sub = df[df["tipo"].isna() | (df["tipo"].astype(str).str.strip().str.lower() == tipo.lower())]
+            # Mismo recurso y misma fecha: se suman (como siempre se han sumado
+            # todas las tarifas que casan con el texto)
+            sub = sub.groupby(["patron", "desde"], sort=False, as_index=False)["coste_hora"].sum(min_count=1)
+            if sub.empty:
+                continue
+            patrones = list(dict.fromkeys(sub["patron"]))
+            ids = {p: i for i, p in enumerate(patrones)}
+            tabla = pd.DataFrame({"patron": sub["patron"].map(ids).to_numpy(), "desde": sub["desde"].to_numpy(),
+                                  "coste_hora": sub["coste_hora"].to_numpy()}).sort_values("desde", kind="stable")
+            self._por_tipo[tipo] = (AutomataPatrones(patrones), tabla)
+
+    def valorar(self, tipo, textos, horas, fechas=None):
+        # Coste por fila: suma de las tarifas vigentes de los recursos nombrados × horas.
+        # Un paso de autómata por texto distinto; el cruce con fechas es vectorizado.
+        textos = pd.Series(textos, dtype=object).reset_index(drop=True)
+        costes = np.zeros(len(textos))
+        if tipo not in self._por_tipo or textos.empty:
+            return costes
+        automata, tabla = self._por_tipo[tipo]
+        horas = pd.to_numeric(pd.Series(horas).reset_index(drop=True), errors="coerce").fillna(0).to_numpy(dtype=float)
+        fechas = fechas_parte(fechas) if fechas is not None else pd.Series(HASTA_SIEMPRE, index=textos.index).astype("datetime64[ns]")
+
+        claves = textos.map(lambda v: None if _texto_vacio(v) else str(v).lower())
+        codigos, unicos = pd.factorize(claves)
+        pares = [(codigo, patron) for codigo, texto in enumerate(unicos) for patron in automata.buscar(texto)]
+        if not pares:
+            return costes
+        filas = pd.DataFrame({"fila": np.arange(len(textos)), "codigo": codigos, "fecha": fechas.to_numpy(), "horas": horas})
+        filas = filas[(filas["codigo"] >= 0) & (filas["horas"] > 0)]
+        cruce = filas.merge(pd.DataFrame(pares, columns=["codigo", "patron"]), on="codigo")
+        if cruce.empty:
+            return costes
+        cruce = pd.merge_asof(cruce.sort_values("fecha", kind="stable"), tabla, left_on="fecha", right_on="desde",
+                              by="patron", direction="backward")
+        importe = (cruce["coste_hora"] * cruce["horas"]).groupby(cruce["fila"]).sum()
+        costes[importe.index.to_numpy()] = importe.to_numpy()
+        return costes
+
+    def costes_diario(self, df_diario):
+        # DataFrame con Coste_Personal y Coste_Maquinaria por fila del diario
+        fechas = df_diario["Fecha"] if "Fecha" in df_diario.columns else None
+        resultado = pd.DataFrame(index=df_diario.index)
+        for tipo in TIPOS_TARIFA:
+            col_texto, col_horas = COLUMNAS_DIARIO[tipo]
+            if col_texto in df_diario.columns and col_horas in df_diario.columns:
+                resultado[f"Coste_{tipo}"] = self.valorar(tipo, df_diario[col_texto], df_diario[col_horas], fechas)
+            else:
+                resultado[f"Coste_{tipo}"] = 0.0
+        return resultado
+
+
+# --- IMPUTACIONES DERIVADAS DEL DIARIO ---
+def concepto(tipo, descripcion, recursos):
+    return f"{PREFIJOS_CONCEPTO[tipo]} ({descripcion}): {recursos}"
+
+
+def es_imputacion_diario(conceptos):
+    # Filas de Costes_Imputados generadas desde el diario (el resto son materiales)
+    texto = pd.Series(conceptos, dtype=object).astype(str)
+    return texto.str.startswith(tuple(f"{p} (" for p in PREFIJOS_CONCEPTO.values()))
+
+
+def _texto(serie):
+    return serie.astype(object).where(serie.notna(), "").astype(str)
+
+
+def imputaciones_diario(df_diario, tarifas, proyecto=None):
+    # Filas de Costes_Imputados (mano de obra y maquinaria) para las filas del diario
+    if df_diario.empty:
+        return pd.DataFrame(columns=COLUMNAS_COSTES)
+    costes = tarifas.costes_diario(df_diario)
+    vacia = pd.Series("", index=df_diario.index)
+    col = lambda c: _texto(df_diario[c]) if c in df_diario.columns else vacia
+    proyecto = pd.Series(proyecto, index=df_diario.index) if proyecto is not None else col("Proyecto")
+    trozos = []
+    for orden, tipo in enumerate(TIPOS_TARIFA):
+        coste = costes[f"Coste_{tipo}"]
+        hay = coste > 0
+        if not hay.any():
+            continue
+        descripcion, recursos = col("Descripción_Tarea")[hay], col(COLUMNAS_DIARIO[tipo][0])[hay]
+        trozos.append(pd.DataFrame({
+            "Fecha": df_diario["Fecha"][hay] if "Fecha" in df_diario.columns else vacia[hay],
+            "Proyecto": proyecto[hay],
+            "Tarea": col("Tarea")[hay],
+            "Concepto": [concepto(tipo, d, r) for d, r in zip(descripcion, recursos)],
+            "Coste_Total": coste[hay],
+            "_pos": np.flatnonzero(hay.to_numpy()) * len(TIPOS_TARIFA) + orden,
+        }))
+    if not trozos:
+        return pd.DataFrame(columns=COLUMNAS_COSTES)
+    # Orden del diario; dentro de cada parte, personal antes que maquinaria
+    return pd.concat(trozos).sort_values("_pos", kind="stable").drop(columns="_pos").reset_index(drop=True)
+
+
+def resumen_costes_por_tarea(df_diario, df_imputados, df_tarifas):
+    # Personal y maquinaria (diario × tarifas vigentes) + materiales imputados, por Tarea
+    columnas = ['Gasto_Personal', 'Gasto_Maquinaria', 'Gasto_Materiales']
+    resumen_diario = pd.DataFrame(columns=['Tarea', 'Gasto_Personal', 'Gasto_Maquinaria'])
+    if not df_diario.empty and not df_tarifas.empty and 'Tarea' in df_diario.columns:
+        costes = TarifasVigentes(df_tarifas).costes_diario(df_diario)
+        resumen_diario = pd.DataFrame({
+            'Tarea': df_diario['Tarea'], 'Gasto_Personal': costes['Coste_Personal'], 'Gasto_Maquinaria': costes['Coste_Maquinaria'],
+        }).groupby('Tarea').sum().reset_index()
+
+    resumen_materiales = pd.DataFrame(columns=['Tarea', 'Gasto_Materiales'])
+    if not df_imputados.empty:
+        # Fuera lo que sale del diario: la maquinaria derivada y, como siempre, todo
+        # concepto que mencione la mano de obra (aunque no lleve el prefijo exacto)
+        conceptos = df_imputados['Concepto']
+        del_diario = (conceptos.astype(object).astype(str).str.contains('Mano de obra', case=False, na=False).to_numpy()
+                      | es_imputacion_diario(conceptos).to_numpy())
+        df_solo_materiales = df_imputados[~del_diario]
+        if not df_solo_materiales.empty:
+            resumen_materiales = df_solo_materiales.groupby('Tarea').agg(Gasto_Materiales=('Coste_Total', 'sum')).reset_index()
+
+    if resumen_diario.empty and resumen_materiales.empty:
+        return pd.DataFrame()
+    resumen_final = pd.merge(resumen_diario, resumen_materiales, on='Tarea', how='outer').fillna(0)
+    resumen_final[columnas] = resumen_final[columnas].astype(float)
+    resumen_final['Coste_Total_Partida'] = resumen_final[columnas].sum(axis=1)
+    return resumen_final
+
+
+# --- REIMPUTACIÓN (SOLO FILAS QUE CAMBIAN) ---
+def _claves(df):
+    # Fecha + Tarea + Concepto (+ nº de repetición) identifica una imputación
+    claves = pd.DataFrame({c: _texto(df[c]).str.strip() if c in df.columns else "" for c in ("Fecha", "Tarea", "Concepto")}, index=df.index)
+    claves["n"] = claves.groupby(["Fecha", "Tarea", "Concepto"], sort=False).cumcount()
+    return claves
+
+
+def plan_reimputacion(df_costes, esperadas, tolerancia=0.005):
+    # Compara lo imputado con lo que sale de las tarifas vigentes.
+    # Devuelve {"actualizar": cambios con COLUMNA_FILA, "anexar": filas nuevas, + contadores}.
+    # Las imputaciones que ya no corresponden se dejan a 0 (no se borran filas:
+    # las posiciones del resto no se mueven y solo viajan las celdas cambiadas).
+    if df_costes.empty or "Concepto" not in df_costes.columns:
+        mascara = np.zeros(len(df_costes), dtype=bool)
+    else:
+        mascara = es_imputacion_diario(df_costes["Concepto"]).to_numpy()
+    derivadas = df_costes[mascara]
+    actuales = _claves(derivadas)
+    actuales[COLUMNA_FILA] = np.flatnonzero(mascara)
+    actuales["actual"] = pd.to_numeric(derivadas["Coste_Total"], errors="coerce").fillna(0).to_numpy() if mascara.any() else 0.0
+
+    nuevas = _claves(esperadas)
+    nuevas["_i"] = np.arange(len(esperadas))
+    nuevas["Coste_Total"] = pd.to_numeric(esperadas["Coste_Total"], errors="coerce").fillna(0).to_numpy()
+
+    cruce = actuales.merge(nuevas, on=["Fecha", "Tarea", "Concepto", "n"], how="outer", indicator=True)
+    ambos = cruce[cruce["_merge"] == "both"]
+    cambian = ambos[(ambos["Coste_Total"] - ambos["actual"]).abs() > tolerancia]
+    sobran = cruce[(cruce["_merge"] == "left_only") & (cruce["actual"].abs() > tolerancia)].assign(Coste_Total=0.0)
+    faltan = cruce.loc[cruce["_merge"] == "right_only", "_i"].astype(int).sort_values()
+
+    actualizar = pd.concat([cambian, sobran])[[COLUMNA_FILA, "Coste_Total"]].astype({COLUMNA_FILA: int, "Coste_Total": float})
+    return {
+        "actualizar": actualizar.sort_values(COLUMNA_FILA).reset_index(drop=True),
+        "anexar": esperadas.iloc[faltan.to_numpy()].reset_index(drop=True),
+        "modificadas": len(cambian),
+        "anuladas": len(sobran),
+        "nuevas": len(faltan),
+        "sin_cambios": len(ambos) - len(cambian),
+    }
+
+
+# --- REIMPUTACIÓN DE TODAS LAS OBRAS ---
+def _contadores(plan):
+    return {"Modificadas": plan["modificadas"], "Anuladas": plan["anuladas"], "Nuevas": plan["nuevas"], "Sin_Cambios": plan["sin_cambios"]}
+
+
+def _cargar_obra(datos, obra):
+    nombre, url = obra
+    df_diario = datos.leer("Diario", url)
+    try:
+        df_costes = datos.leer("Costes_Imputados", url)
+    except HojaNoEncontrada:
+        # Obra sin imputaciones todavía: se crean al anexar
+        df_costes = pd.DataFrame(columns=COLUMNAS_COSTES)
+    return df_diario, df_costes
+
+
+def _guardar_plan(datos, url, leida, esperadas):
+    # Las filas se actualizan por posición: con la pestaña bloqueada el plan se
+    # rehace sobre la versión guardada (si cambió desde `leida`, sale distinto)
+    return datos.confirmar_diferencias("Costes_Imputados", url, lambda actual: plan_reimputacion(actual, esperadas), leida=leida)
+
+
+def reimputar_obras(obras, datos, df_tarifas, max_concurrencia=8, avanzar=None, escribir=True):
+    # obras: [(nombre, url)]; datos: AccesoDatos (leer/anexar/actualizar_filas).
+    # Lee en paralelo, valora todos los diarios en una sola pasada y envía a
+    # cada obra solo las imputaciones que cambian. Devuelve un resumen por obra.
+    avanzar = avanzar or (lambda texto, fraccion=None: None)
+    obras = list(obras)
+    resumen = {nombre: {"Proyecto": nombre, "Partes": 0, "Imputaciones": 0, "Modificadas": 0, "Anuladas": 0,
+                        "Nuevas": 0, "Sin_Cambios": 0, "Estado": "OK"} for nombre, _ in obras}
+
+    avanzar(f"Leyendo {len(obras)} obras...", 0.0)
+    cargas = {}
+    for i, carga, error in procesar_en_paralelo(obras, lambda o: _cargar_obra(datos, o), max_concurrencia, intentos=2):
+        nombre = obras[i][0]
+        if error is not None:
+            resumen[nombre]["Estado"] = f"Error al leer: {type(error).__name__}: {error}"
+        else:
+            cargas[nombre] = carga
+
+    avanzar("Valorando partes con las tarifas vigentes...", 0.4)
+    diarios = [df.assign(Proyecto=nombre) for nombre, (df, _) in cargas.items() if not df.empty]
+    esperadas = imputaciones_diario(pd.concat(diarios, ignore_index=True), TarifasVigentes(df_tarifas)) if diarios else pd.DataFrame(columns=COLUMNAS_COSTES)
+    esperadas_obra = dict(tuple(esperadas.groupby("Proyecto", sort=False))) if not esperadas.empty else {}
+
+    planes = []
+    for (nombre, url) in obras:
+        if nombre not in cargas:
+            continue
+        df_diario, df_costes = cargas[nombre]
+        esperadas_o = esperadas_obra.get(nombre, pd.DataFrame(columns=COLUMNAS_COSTES)).reset_index(drop=True)
+        plan = plan_reimputacion(df_costes, esperadas_o)
+        resumen[nombre].update(Partes=len(df_diario), Imputaciones=len(esperadas_o), **_contadores(plan))
+        if plan["actualizar"].empty and plan["anexar"].empty:
+            continue
+        planes.append((nombre, url, huella_hoja(df_costes), esperadas_o))
+
+    if escribir and planes:
+        avanzar(f"Guardando cambios en {len(planes)} obras...", 0.7)
+
+        def guardar(entrada):
+            _, url, leida, esperadas_o = entrada
+            return _guardar_plan(datos, url, leida, esperadas_o)
+
+        for i, guardado, error in procesar_en_paralelo(planes, guardar, max_concurrencia, intentos=1):
+            nombre = planes[i][0]
+            if error is not None:
+                resumen[nombre]["Estado"] = f"Error al guardar: {type(error).__name__}: {error}"
+            elif guardado[1]:
+                resumen[nombre].update(_contadores(guardado[0]), Estado="OK (hoja cambiada durante el proceso, plan rehecho)")
+
+    avanzar("Reimputación terminada", 1.0)
+    return pd.DataFrame(list(resumen.values()))
@@ -0,0 +1,119 @@
+import pandas as pd
+
+from gestion_obras.certificacion import certificacion_ancha
+
+
+# --- AGREGADOS POR CÓDIGO DE CONTROL ---
+def normalizar_cod_control(serie):
+    return serie.astype(str).replace(r'\.0$', '', regex=True).str.strip()
+
+
+def columnas_meses(df_cert):
+    # Importe_Mes_1, Importe_Mes_2... en orden de mes
+    meses = [col for col in df_cert.columns if str(col).startswith("Importe_Mes_")]
+    return sorted(meses, key=lambda x: int(x.split('_')[2]))
+
+
+def resumen_presupuesto(df_pto):
+    df = pd.DataFrame({
+        'Cod_Control': normalizar_cod_control(df_pto['Cod_Control']),
+        'Coste': pd.to_numeric(df_pto['Coste'], errors='coerce').fillna(0),
+        'Cantidad_Proyecto': pd.to_numeric(df_pto['Cantidad_Proyecto'], errors='coerce').fillna(0),
+        'Importe_Total_Adjudicado': pd.to_numeric(df_pto['Importe_Total_Adjudicado'], errors='coerce').fillna(0),
+    })
+    df['Coste_Total_Fila'] = df['Coste'] * df['Cantidad_Proyecto']
+    return df.groupby('Cod_Control').agg(
+        Coste_Presupuestado=('Coste_Total_Fila', 'sum'),
+        Presupuesto_Adjudicado=('Importe_Total_Adjudicado', 'sum')
+    ).reset_index()
+
+
+def resumen_certificacion(df_cert):
+    df_cert = certificacion_ancha(df_cert)
+    meses = columnas_meses(df_cert) if not df_cert.empty else []
+    if df_cert.empty or not meses:
+        return pd.DataFrame(columns=['Cod_Control', 'Total_Certificado'])
+    df = pd.DataFrame({
+        'Cod_Control': normalizar_cod_control(df_cert['Cod_Control']),
+        'Total_Certificado': df_cert[meses].apply(pd.to_numeric, errors='coerce').sum(axis=1),
+    })
+    return df.groupby('Cod_Control').agg(Total_Certificado=('Total_Certificado', 'sum')).reset_index()
+
+
+def evolucion_certificaciones(df_cert):
+    # Certificado acumulado mes a mes
+    datos_grafica = {}
+    acumulado = 0
+    for mes_col in columnas_meses(df_cert):
+        nombre_mes = mes_col.replace("Importe_", "").replace("_", " ")
+        acumulado += pd.to_numeric(df_cert[mes_col], errors='coerce').sum()
+        datos_grafica[nombre_mes] = acumulado
+    return pd.DataFrame(list(datos_grafica.items()), columns=['Mes', 'Certificado Acumulado']).set_index('Mes')
+
+
+# --- RESUMEN ALMACENADO POR CÓDIGO DE CONTROL ---
+# Pestaña "Resumen_Cod_Control" de cada obra: totales de presupuesto y
+# certificado por mes. Se actualiza al confirmar un presupuesto o una
+# certificación y el informe lo lee tal cual.
+HOJA_RESUMEN = "Resumen_Cod_Control"
+COLUMNAS_PRESUPUESTO_RESUMEN = ['Coste_Presupuestado', 'Presupuesto_Adjudicado']
+
+
+def _certificado_por_mes(df_cert):
+    df_cert = certificacion_ancha(df_cert)
+    meses = columnas_meses(df_cert) if not df_cert.empty else []
+    if not meses or 'Cod_Control' not in df_cert.columns:
+        return pd.DataFrame(columns=['Cod_Control'])
+    df = df_cert[meses].apply(pd.to_numeric, errors='coerce').fillna(0)
+    df.insert(0, 'Cod_Control', normalizar_cod_control(df_cert['Cod_Control']))
+    return df.groupby('Cod_Control').sum().reset_index()
+
+
+def _ordenar_resumen(resumen):
+    resumen = resumen.drop(columns=['Total_Certificado'], errors='ignore')
+    meses = columnas_meses(resumen)
+    for col in COLUMNAS_PRESUPUESTO_RESUMEN + meses:
+        if col not in resumen.columns:
+            resumen[col] = 0.0
+        resumen[col] = pd.to_numeric(resumen[col], errors='coerce').fillna(0)
+    resumen['Total_Certificado'] = resumen[meses].sum(axis=1) if meses else 0.0
+    # Un código sin presupuesto ni certificado no aporta nada (el informe rellena con 0);
+    # fuera, el resumen actualizado por partes coincide con el construido desde cero
+    resumen = resumen[resumen[COLUMNAS_PRESUPUESTO_RESUMEN + meses].ne(0).any(axis=1)]
+    columnas = ['Cod_Control'] + COLUMNAS_PRESUPUESTO_RESUMEN + ['Total_Certificado'] + meses
+    return resumen[columnas].sort_values('Cod_Control', kind='stable').reset_index(drop=True)
+
+
+def construir_resumen(df_pto, df_cert):
+    pto = resumen_presupuesto(df_pto) if not df_pto.empty else pd.DataFrame(columns=['Cod_Control'] + COLUMNAS_PRESUPUESTO_RESUMEN)
+    return _ordenar_resumen(pto.merge(_certificado_por_mes(df_cert), on='Cod_Control', how='outer'))
+
+
+def resumen_con_presupuesto(resumen, df_pto):
+    # Sustituye los totales de presupuesto; lo certificado se conserva
+    cert = resumen.drop(columns=COLUMNAS_PRESUPUESTO_RESUMEN, errors='ignore') if not resumen.empty else pd.DataFrame(columns=['Cod_Control'])
+    cert = cert.assign(Cod_Control=normalizar_cod_control(cert['Cod_Control']))
+    return _ordenar_resumen(resumen_presupuesto(df_pto).merge(cert, on='Cod_Control', how='outer'))
+
+
+def resumen_con_certificacion(resumen, df_cert):
+    # Sustituye los importes por mes con la certificación que se guarda; el presupuesto se conserva
+    if resumen.empty:
+        pto = pd.DataFrame(columns=['Cod_Control'] + COLUMNAS_PRESUPUESTO_RESUMEN)
+    else:
+        pto = resumen[['Cod_Control'] + [c for c in COLUMNAS_PRESUPUESTO_RESUMEN if c in resumen.columns]]
+        pto = pto.assign(Cod_Control=normalizar_cod_control(pto['Cod_Control']))
+    return _ordenar_resumen(pto.merge(_certificado_por_mes(df_cert), on='Cod_Control', how='outer'))
+
+
+def informe_desde_resumen(df_codigos, resumen):
+    codigos = df_codigos.copy()
+    codigos['Cod_Control'] = normalizar_cod_control(codigos['Cod_Control'])
+    totales = resumen[['Cod_Control'] + COLUMNAS_PRESUPUESTO_RESUMEN + ['Total_Certificado']].copy()
+    totales['Cod_Control'] = normalizar_cod_control(totales['Cod_Control'])
+    for col in COLUMNAS_PRESUPUESTO_RESUMEN + ['Total_Certificado']:
+        totales[col] = pd.to_numeric(totales[col], errors='coerce').fillna(0)
+    informe = codigos.merge(totales, on='Cod_Control', how='left').fillna(0)
+    informe['% Certificado'] = (informe['Total_Certificado'] / informe['Presupuesto_Adjudicado']) * 100
+    informe['% Certificado'] = informe['% Certificado'].replace([float('inf'), -float('inf')], 0)
+    return informe
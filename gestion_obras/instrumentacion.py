@@ -0,0 +1,211 @@
+import contextvars
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from datetime import datetime
+
+import pandas as pd
+
+
+# --- MEDICIÓN DEL RERUN ACTUAL ---
+# Cada ejecución del script abre una Medicion y medir(...) anota en la activa.
+# Va en una variable de contexto: cada sesión de Streamlit (y los hilos que
+# lanza procesar_en_paralelo) ve solo la suya. Sin medición activa no se anota.
+_medicion_activa = contextvars.ContextVar("medicion_activa", default=None)
+
+
+class Medicion:
+    def __init__(self, vista=None):
+        self.vista = vista
+        self.fecha = datetime.now()
+        self._t0 = time.perf_counter()
+        self._lock = threading.Lock()
+        self.etapas = []
+        self.total_ms = None
+        self.completa = None
+
+    def anotar(self, etapa, inicio, segundos, **datos):
+        registro = {"etapa": etapa, "inicio_ms": round((inicio - self._t0) * 1000, 1), "ms": round(segundos * 1000, 2)}
+        registro.update({k: v for k, v in datos.items() if v is not None})
+        with self._lock:
+            self.etapas.append(registro)
+
+    @property
+    def cerrada(self):
+        return self.total_ms is not None
+
+    def cerrar(self, completa=True):
+        # Un rerun cortado (st.stop, excepción) se cierra después: su duración
+        # es hasta el final de la última etapa anotada, no hasta ahora
+        if self.total_ms is None:
+            if completa:
+                self.total_ms = round((time.perf_counter() - self._t0) * 1000, 2)
+            else:
+                self.total_ms = max((e["inicio_ms"] + e["ms"] for e in self.etapas), default=0.0)
+            self.completa = completa
+        return self
+
+    def como_dict(self):
+        with self._lock:
+            etapas = list(self.etapas)
+        return {"fecha": self.fecha.isoformat(timespec="seconds"), "vista": self.vista, "total_ms": self.total_ms,
+                "completa": self.completa, "etapas": etapas}
+
+    def tabla(self):
+        with self._lock:
+            etapas = list(self.etapas)
+        columnas = ["etapa", "ms", "filas", "bytes", "inicio_ms"]
+        df = pd.DataFrame(etapas)
+        for col in columnas:
+            if col not in df.columns:
+                df[col] = None
+        return df[columnas + [c for c in df.columns if c not in columnas]]
+
+
+def iniciar_medicion(vista=None):
+    medicion = Medicion(vista)
+    _medicion_activa.set(medicion)
+    return medicion
+
+
+def medicion_activa():
+    return _medicion_activa.get()
+
+
+@contextmanager
+def medir(etapa, **datos):
+    # with medir("etapa", filas=...) as m: ...; m["bytes"] = ...  (los datos se pueden completar dentro)
+    medicion = _medicion_activa.get()
+    if medicion is None:
+        yield datos
+        return
+    inicio = time.perf_counter()
+    try:
+        yield datos
+    except Exception as e:
+        datos["error"] = type(e).__name__
+        raise
+    finally:
+        medicion.anotar(etapa, inicio, time.perf_counter() - inicio, **datos)
+
+
+# --- VOLUMEN DE DATOS ---
+def tamano_df(df):
+    # (filas, bytes en memoria)
+    if df is None:
+        return None, None
+    return len(df), int(df.memory_usage(index=False, deep=True).sum())
+
+
+def bytes_contenido(contenido):
+    # Tamaño aproximado de lo que se envía a Gemini (texto + ficheros)
+    if isinstance(contenido, (str, bytes, dict)):
+        contenido = [contenido]
+    total = 0
+    for parte in contenido:
+        datos = parte.get("data", b"") if isinstance(parte, dict) else parte
+        total += len(datos) if isinstance(datos, bytes) else len(str(datos).encode("utf-8"))
+    return total
+
+
+# --- REGISTRO ROTATIVO Y PERCENTILES POR VISTA ---
+def _percentil(valores, q):
+    return round(float(pd.Series(valores, dtype=float).quantile(q)), 2) if len(valores) else None
+
+
+class RegistroRendimiento:
+    # Una línea JSON por rerun en `ruta`; al pasar de max_bytes se rota a
+    # ruta.1, ruta.2... (se conservan `copias`). En memoria se guardan los
+    # últimos `ventana` reruns por vista para los p50/p95 del panel.
+    def __init__(self, ruta, max_bytes=5 * 1024 * 1024, copias=5, ventana=500):
+        self.ruta = ruta
+        self.max_bytes = max_bytes
+        self.copias = copias
+        self.ventana = ventana
+        self._lock = threading.Lock()
+        self._por_vista = {}
+        self._por_etapa = {}
+        if ruta:
+            os.makedirs(os.path.dirname(os.path.abspath(ruta)), exist_ok=True)
+
+    def registrar(self, medicion):
+        datos = medicion.cerrar().como_dict()
+        vista = datos["vista"] or "-"
+        with self._lock:
+            tiempos = self._por_vista.setdefault(vista, deque(maxlen=self.ventana))
+            tiempos.append(datos["total_ms"])
+            for etapa in datos["etapas"]:
+                self._por_etapa.setdefault((vista, etapa["etapa"]), deque(maxlen=self.ventana)).append(etapa["ms"])
+            datos["p50_ms"] = _percentil(tiempos, 0.5)
+            datos["p95_ms"] = _percentil(tiempos, 0.95)
+            if self.ruta:
+                try:
+                    self._escribir(json.dumps(datos, ensure_ascii=False, default=str) + "\n")
+                except OSError:
+                    pass  # El registro nunca debe tumbar la app
+        return datos
+
+    def _escribir(self, linea):
+        datos = linea.encode("utf-8")
+        if os.path.exists(self.ruta) and os.path.getsize(self.ruta) + len(datos) > self.max_bytes:
+            for i in range(self.copias - 1, 0, -1):
+                if os.path.exists(f"{self.ruta}.{i}"):
+                    os.replace(f"{self.ruta}.{i}", f"{self.ruta}.{i + 1}")
+            os.replace(self.ruta, f"{self.ruta}.1")
+        with open(self.ruta, "ab") as f:
+            f.write(datos)
+
+    def percentiles(self):
+        with self._lock:
+            filas = [{"Vista": v, "Reruns": len(t), "p50_ms": _percentil(t, 0.5), "p95_ms": _percentil(t, 0.95), "Ultimo_ms": t[-1]}
+                     for v, t in self._por_vista.items()]
+        return pd.DataFrame(filas, columns=["Vista", "Reruns", "p50_ms", "p95_ms", "Ultimo_ms"])
+
+    def percentiles_etapas(self, vista):
+        with self._lock:
+            filas = [{"Etapa": e, "Veces": len(t), "p50_ms": _percentil(t, 0.5), "p95_ms": _percentil(t, 0.95)}
+                     for (v, e), t in self._por_etapa.items() if v == (vista or "-")]
+        return pd.DataFrame(filas, columns=["Etapa", "Veces", "p50_ms", "p95_ms"])
+
+    def ficheros(self):
+        candidatos = [self.ruta] + [f"{self.ruta}.{i}" for i in range(1, self.copias + 1)]
+        return [f for f in candidatos if self.ruta and os.path.exists(f)]
+
+
+def percentiles_registro(ficheros):
+    # p50/p95 por vista leyendo el histórico completo (incluidas las rotaciones)
+    filas = []
+    for fichero in ficheros:
+        with open(fichero, "r", encoding="utf-8") as f:
+            for linea in f:
+                try:
+                    datos = json.loads(linea)
+                except ValueError:
+                    continue
+                filas.append({"Vista": datos.get("vista") or "-", "total_ms": datos.get("total_ms"), "fecha": datos.get("fecha")})
+    if not filas:
+        return pd.DataFrame(columns=["Vista", "Reruns", "p50_ms", "p95_ms", "Desde", "Hasta"])
+    df = pd.DataFrame(filas)
+    df["total_ms"] = pd.to_numeric(df["total_ms"], errors="coerce")
+    return df.groupby("Vista").agg(
+        Reruns=("total_ms", "size"),
+        p50_ms=("total_ms", lambda s: round(s.quantile(0.5), 2)),
+        p95_ms=("total_ms", lambda s: round(s.quantile(0.95), 2)),
+        Desde=("fecha", "min"),
+        Hasta=("fecha", "max"),
+    ).reset_index()
+
+
+_registros = {}
+_lock_registros = threading.Lock()
+
+
+def registro_rendimiento(ruta, max_bytes=5 * 1024 * 1024, copias=5):
+    # Una instancia por ruta y proceso (los percentiles sobreviven a los reruns)
+    with _lock_registros:
+        if ruta not in _registros:
+            _registros[ruta] = RegistroRendimiento(ruta, max_bytes, copias)
+        return _registros[ruta]
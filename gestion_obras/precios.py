@@ -0,0 +1,284 @@
+import bisect
+import copy
+import hashlib
+import threading
+
+import numpy as np
+import pandas as pd
+
+from gestion_obras.texto import normalizar_serie, tokens, trigramas
+
+
+# --- CLAVES NORMALIZADAS ---
+def clave_texto(serie):
+    # str(valor).strip().lower(); las celdas vacías quedan a None (no casan con nada)
+    serie = serie.astype(object)
+    hay = serie.notna()
+    claves = pd.Series(None, index=serie.index, dtype=object)
+    if hay.any():
+        claves[hay] = serie[hay].map(str).str.strip().str.lower()
+    return claves
+
+
+def clave_valor(valor):
+    return str(valor).strip().lower()
+
+
+def _codigo_valido(codigo):
+    return codigo not in (None, "", "nan", "none")
+
+
+def _numero(valor, defecto=np.nan):
+    try:
+        numero = float(valor)
+    except (TypeError, ValueError):
+        return defecto
+    return defecto if np.isnan(numero) else numero
+
+
+# --- ÍNDICE QUE CRECE CON EL HISTÓRICO ---
+# Guarda una huella de las filas ya indexadas. Un índice no se modifica una vez
+# construido (otras sesiones pueden estar consultándolo): sincronizar devuelve
+# uno nuevo. Si la tabla recibida empieza por las mismas filas (caso normal: se
+# han anexado facturas) se parte de una copia y solo se indexa lo nuevo; si ha
+# cambiado cualquier otra cosa se construye entero.
+class IndiceIncremental:
+    columnas_huella = []
+
+    def __init__(self):
+        self.filas = 0
+        self._huella = hashlib.sha1()
+        self._reiniciar()
+
+    @classmethod
+    def hashes(cls, df):
+        if not len(df):
+            return np.zeros(0, dtype=np.uint64)
+        df_v = df.reindex(columns=cls.columnas_huella)
+        try:
+            return pd.util.hash_pandas_object(df_v, index=False).to_numpy()
+        except TypeError:
+            return pd.util.hash_pandas_object(df_v.astype(str), index=False).to_numpy()
+
+    def es_prefijo(self, hashes):
+        # ¿Las filas indexadas son las primeras de la tabla con estos hashes?
+        n = self.filas
+        return n <= len(hashes) and hashlib.sha1(hashes[:n].tobytes()).digest() == self._huella.digest()
+
+    def sincronizar(self, df, hashes=None):
+        hashes = self.hashes(df) if hashes is None else hashes
+        if self.es_prefijo(hashes):
+            if self.filas == len(hashes):
+                return self
+            nuevo, n = self._copia(), self.filas
+        else:
+            nuevo, n = type(self)(), 0
+        nuevo._anexar(df.iloc[n:].reset_index(drop=True), n)
+        nuevo._huella.update(hashes[n:].tobytes())
+        nuevo.filas = len(hashes)
+        return nuevo
+
+    def _copia(self):
+        # Copia superficial: _anexar sustituye los valores que cambia, no los modifica
+        nuevo = copy.copy(self)
+        nuevo._huella = self._huella.copy()
+        nuevo._copiar()
+        return nuevo
+
+    def _reiniciar(self):
+        raise NotImplementedError
+
+    def _copiar(self):
+        raise NotImplementedError
+
+    def _anexar(self, df_nuevas, inicio):
+        raise NotImplementedError
+
+
+# --- ÍNDICE DE ÚLTIMOS PRECIOS ---
+# (proveedor, descripción) -> último precio/descuento/fecha registrado, y como
+# respaldo (proveedor, código de producto) para descripciones que cambian.
+class IndicePrecios(IndiceIncremental):
+    columnas_huella = ["Proveedor", "Descripcion", "Codigo_Producto", "Precio_Unitario", "Descuento", "Fecha"]
+
+    def _reiniciar(self):
+        self._por_descripcion = {}
+        self._por_codigo = {}
+
+    def _copiar(self):
+        self._por_descripcion = dict(self._por_descripcion)
+        self._por_codigo = dict(self._por_codigo)
+
+    def _anexar(self, df_nuevas, inicio):
+        if df_nuevas.empty or not {"Proveedor", "Descripcion", "Precio_Unitario"}.issubset(df_nuevas.columns):
+            return
+        vacia = pd.Series(None, index=df_nuevas.index, dtype=object)
+        d = pd.DataFrame({
+            "prov": clave_texto(df_nuevas["Proveedor"]),
+            "desc": clave_texto(df_nuevas["Descripcion"]),
+            "cod": clave_texto(df_nuevas["Codigo_Producto"]) if "Codigo_Producto" in df_nuevas.columns else vacia,
+            "precio": pd.to_numeric(df_nuevas["Precio_Unitario"], errors="coerce"),
+            "dto": pd.to_numeric(df_nuevas["Descuento"], errors="coerce") if "Descuento" in df_nuevas.columns else np.nan,
+            "fecha": df_nuevas["Fecha"].astype(object) if "Fecha" in df_nuevas.columns else vacia,
+        })
+        d = d[d["prov"].notna()]
+        valores = lambda filas: zip(filas["precio"], filas["dto"], filas["fecha"])
+        # La última aparición manda (mismo criterio que match.iloc[-1])
+        por_desc = d[d["desc"].notna()].drop_duplicates(["prov", "desc"], keep="last")
+        self._por_descripcion.update(zip(zip(por_desc["prov"], por_desc["desc"]), valores(por_desc)))
+        por_cod = d[d["cod"].map(_codigo_valido)].drop_duplicates(["prov", "cod"], keep="last")
+        self._por_codigo.update(zip(zip(por_cod["prov"], por_cod["cod"]), valores(por_cod)))
+
+    def ultimo(self, proveedor, descripcion, codigo=None):
+        prov = clave_valor(proveedor)
+        encontrado = self._por_descripcion.get((prov, clave_valor(descripcion)))
+        if encontrado is None and codigo is not None and _codigo_valido(clave_valor(codigo)):
+            encontrado = self._por_codigo.get((prov, clave_valor(codigo)))
+        if encontrado is None:
+            return None
+        precio, dto, fecha = encontrado
+        return {"Precio_Unitario": precio, "Descuento": dto, "Fecha": None if pd.isna(fecha) else fecha}
+
+    def estado(self, proveedor, descripcion, precio, descuento, codigo=None):
+        anterior = self.ultimo(proveedor, descripcion, codigo)
+        if anterior is None:
+            return "🟢 NUEVO"
+        precio_bd, dto_bd = anterior["Precio_Unitario"], anterior["Descuento"]
+        # Comparaciones en positivo: un precio ilegible en cualquiera de los lados cuenta como cambio
+        if abs(_numero(precio) - precio_bd) <= 0.01 and abs(_numero(descuento, 0.0) - _numero(dto_bd, 0.0)) <= 0.01:
+            return "⚪ SIN CAMBIOS"
+        fecha = f" · {anterior['Fecha']}" if anterior["Fecha"] else ""
+        return f"🟡 CAMBIO PRECIO (Antes: {precio_bd}€ / Dto: {dto_bd}%{fecha})"
+
+    def clasificar(self, df_factura):
+        codigos = df_factura["Codigo_Producto"] if "Codigo_Producto" in df_factura.columns else [None] * len(df_factura)
+        descuentos = df_factura["Descuento"] if "Descuento" in df_factura.columns else [0.0] * len(df_factura)
+        return [
+            self.estado(prov, desc, precio, dto, cod)
+            for prov, desc, precio, dto, cod in zip(
+                df_factura["Proveedor"], df_factura["Descripcion"], df_factura["Precio_Unitario"], descuentos, codigos)
+        ]
+
+
+# --- BUSCADOR DEL HISTÓRICO ---
+# Índice invertido palabra -> filas sobre las columnas de texto de la factura.
+# Cada término de la búsqueda casa por prefijo sin tildes ("ladri" -> "ladrillo");
+# si no hay ninguna palabra con ese prefijo se buscan las que lo contienen
+# (trigramas del vocabulario). Todos los términos deben aparecer en la fila.
+class BuscadorPrecios(IndiceIncremental):
+    columnas_huella = ["Proveedor", "Descripcion", "Codigo_Producto", "Num_Factura", "Obra"]
+
+    def _reiniciar(self):
+        self._filas_palabra = {}
+        self._trigramas = {}
+        self._vocabulario = []
+
+    def _copiar(self):
+        self._filas_palabra = dict(self._filas_palabra)
+        self._trigramas = dict(self._trigramas)
+
+    def _anexar(self, df_nuevas, inicio):
+        columnas = [c for c in self.columnas_huella if c in df_nuevas.columns]
+        if df_nuevas.empty or not columnas:
+            return
+        # Proveedor, obra, factura... se repiten mucho: se tokeniza cada valor distinto una vez
+        trozos = []
+        for c in columnas:
+            codigos, unicos = pd.factorize(df_nuevas[c].astype(object))
+            palabras = normalizar_serie(pd.Series(unicos, dtype=object)).str.findall(r'[a-z0-9]+').explode().dropna()
+            palabras = pd.DataFrame({"valor": palabras.index.to_numpy(), "palabra": palabras.to_numpy()})
+            filas = pd.DataFrame({"valor": codigos, "fila": np.arange(len(codigos)) + inicio})
+            trozos.append(filas[filas["valor"] >= 0].merge(palabras, on="valor")[["palabra", "fila"]])
+        pares = pd.concat(trozos, ignore_index=True).drop_duplicates()
+        nuevas = []
+        for palabra, filas in pares.groupby("palabra", sort=False)["fila"]:
+            filas = filas.to_numpy(dtype=np.int64)
+            previas = self._filas_palabra.get(palabra)
+            if previas is None:
+                nuevas.append(palabra)
+                self._filas_palabra[palabra] = filas
+            else:
+                self._filas_palabra[palabra] = np.concatenate([previas, filas])
+        por_trigrama = {}
+        for palabra in nuevas:
+            for tg in trigramas(palabra):
+                por_trigrama.setdefault(tg, []).append(palabra)
+        for tg, palabras in por_trigrama.items():
+            self._trigramas[tg] = self._trigramas.get(tg, frozenset()).union(palabras)
+        if nuevas:
+            self._vocabulario = sorted(self._vocabulario + nuevas)
+
+    def _palabras_para(self, termino):
+        # Prefijo sobre el vocabulario ordenado
+        i = bisect.bisect_left(self._vocabulario, termino)
+        j = bisect.bisect_left(self._vocabulario, termino + "\uffff")
+        if i < j:
+            return self._vocabulario[i:j]
+        # Sin prefijo: palabras que contienen el término
+        if len(termino) < 3:
+            return []
+        conjuntos = sorted((self._trigramas.get(tg, set()) for tg in trigramas(termino)), key=len)
+        candidatas = set(conjuntos[0]).intersection(*conjuntos[1:]) if conjuntos else set()
+        return [p for p in candidatas if termino in p]
+
+    def buscar(self, consulta, limite=500):
+        # Devuelve (posiciones de fila en orden del histórico, total de coincidencias)
+        terminos = list(dict.fromkeys(tokens(consulta)))
+        if not terminos or not self.filas:
+            return np.zeros(0, dtype=np.int64), 0
+        coinciden = None
+        for termino in terminos:
+            mascara = np.zeros(self.filas, dtype=bool)
+            for palabra in self._palabras_para(termino):
+                mascara[self._filas_palabra[palabra]] = True
+            coinciden = mascara if coinciden is None else coinciden & mascara
+            if not coinciden.any():
+                return np.zeros(0, dtype=np.int64), 0
+        posiciones = np.flatnonzero(coinciden)
+        return posiciones[:limite] if limite else posiciones, len(posiciones)
+
+
+# --- LECTURA DE FACTURAS CON IA ---
+PROMPT_FACTURA = """
+    Eres un experto analista de compras para una constructora. Analiza esta factura.
+    Extrae TODAS las líneas de productos facturados.
+    Devuelve ÚNICAMENTE un array en formato JSON puro (sin comillas invertidas de markdown, sin la palabra json).
+    Cada objeto del array debe tener EXACTAMENTE estas claves:
+    - "Proveedor": nombre del emisor.
+    - "Codigo_Producto": SKU o referencia (vacío si no hay).
+    - "Descripcion": nombre exacto del producto.
+    - "Precio_Unitario": número float (usa punto para decimales).
+    - "Descuento": número float (porcentaje, 0 si no hay).
+    - "Num_Factura": número de la factura.
+    - "Fecha": fecha (YYYY-MM-DD).
+    - "Obra": nombre de la obra o dirección de envío (vacío si no hay).
+    """
+
+
+_indices = {}
+_lock_indices = threading.Lock()
+MAX_VERSIONES = 4
+
+
+def indice_para(clase, nombre, df):
+    # Las últimas versiones de cada (tipo, tabla) en el proceso: cada sesión
+    # recibe la de la tabla que tiene (aunque su copia vaya por detrás de la de
+    # otra sesión) y una versión nueva se construye a partir de la más larga
+    # que sea su prefijo, sin tocar las que ya se están usando.
+    hashes = clase.hashes(df)
+    with _lock_indices:
+        versiones = list(_indices.get((clase, nombre), []))
+    base = max((v for v in versiones if v.es_prefijo(hashes)), key=lambda v: v.filas, default=None)
+    indice = (base if base is not None else clase()).sincronizar(df, hashes)
+    with _lock_indices:
+        versiones = [v for v in _indices.get((clase, nombre), []) if v is not indice]
+        _indices[(clase, nombre)] = [indice] + versiones[:MAX_VERSIONES - 1]
+    return indice
+
+
+def indice_precios(df_hist, nombre="Historico_Precios"):
+    return indice_para(IndicePrecios, nombre, df_hist)
+
+
+def buscador_precios(df_hist, nombre="Historico_Precios"):
+    return indice_para(BuscadorPrecios, nombre, df_hist)
@@ -0,0 +1,126 @@
+import os
+import threading
+import time
+import uuid
+
+import pandas as pd
+
+
+# --- IMPORTACIONES PREPARADAS EN DISCO ---
+# Lo procesado en una importación (presupuesto, certificación) espera a que el
+# usuario confirme en un Parquet, no en st.session_state: la sesión solo guarda
+# el identificador. La vista previa lee por páginas (grupos de filas del
+# fichero, con memory-map) y las preparaciones abandonadas se borran al pasar
+# `ttl` segundos sin usarse.
+FILAS_GRUPO = 1000
+
+
+def _columnas_compatibles(df):
+    # Parquet no admite columnas con tipos mezclados (números y textos):
+    # esas pasan a texto, respetando los vacíos
+    df = df.copy()
+    df.columns = [str(c) for c in df.columns]
+    for col in df.columns:
+        if df[col].dtype == object and pd.api.types.infer_dtype(df[col], skipna=True) in ("mixed", "mixed-integer"):
+            df[col] = df[col].map(lambda v: v if v is None or (not isinstance(v, str) and pd.isna(v)) else str(v))
+    return df
+
+
+class AreaPreparacion:
+    def __init__(self, ruta, ttl=6 * 3600, intervalo_limpieza=600):
+        import pyarrow  # noqa: F401  (solo para fallar pronto si no está instalado)
+        self.ruta = ruta
+        self.ttl = ttl
+        self.intervalo_limpieza = intervalo_limpieza
+        self._ultima_limpieza = 0.0
+        self._lock = threading.Lock()
+        os.makedirs(ruta, exist_ok=True)
+
+    def _fichero(self, id_prep):
+        # Solo identificadores generados aquí (nada de rutas desde fuera)
+        return os.path.join(self.ruta, f"{uuid.UUID(str(id_prep)).hex}.parquet")
+
+    def guardar(self, df, tipo=""):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+        self.limpiar()
+        id_prep = uuid.uuid4().hex
+        tabla = pa.Table.from_pandas(_columnas_compatibles(df), preserve_index=False)
+        tabla = tabla.replace_schema_metadata({**(tabla.schema.metadata or {}), b"tipo": str(tipo).encode("utf-8")})
+        temporal = self._fichero(id_prep) + ".tmp"
+        pq.write_table(tabla, temporal, row_group_size=FILAS_GRUPO, compression="zstd")
+        os.replace(temporal, self._fichero(id_prep))
+        return id_prep
+
+    def existe(self, id_prep):
+        try:
+            return id_prep is not None and os.path.exists(self._fichero(id_prep))
+        except ValueError:
+            return False
+
+    def _abrir(self, id_prep):
+        import pyarrow.parquet as pq
+        fichero = self._fichero(id_prep)
+        os.utime(fichero)  # en uso: no caduca
+        return pq.ParquetFile(fichero, memory_map=True)
+
+    def filas(self, id_prep):
+        return self._abrir(id_prep).metadata.num_rows
+
+    def tipo(self, id_prep):
+        metadatos = self._abrir(id_prep).schema_arrow.metadata or {}
+        return metadatos.get(b"tipo", b"").decode("utf-8")
+
+    def pagina(self, id_prep, pagina, filas_pagina=50):
+        # Solo se leen los grupos de filas que tocan a la página pedida
+        fichero = self._abrir(id_prep)
+        total = fichero.metadata.num_rows
+        inicio = max(0, min(int(pagina), max(0, (total - 1) // filas_pagina))) * filas_pagina
+        fin = min(inicio + filas_pagina, total)
+        if fin <= inicio:
+            return fichero.schema_arrow.empty_table().to_pandas()
+        grupos = range(inicio // FILAS_GRUPO, (fin - 1) // FILAS_GRUPO + 1)
+        df = fichero.read_row_groups(list(grupos)).to_pandas()
+        desplazamiento = grupos[0] * FILAS_GRUPO
+        df = df.iloc[inicio - desplazamiento: fin - desplazamiento]
+        df.index = pd.RangeIndex(inicio, fin)
+        return df
+
+    def leer(self, id_prep):
+        return self._abrir(id_prep).read().to_pandas()
+
+    def borrar(self, id_prep):
+        try:
+            os.remove(self._fichero(id_prep))
+        except (OSError, ValueError):
+            pass
+
+    def limpiar(self, forzar=False):
+        # Borra lo que lleva más de `ttl` sin tocarse (como mucho una pasada cada intervalo)
+        ahora = time.time()
+        with self._lock:
+            if not forzar and ahora - self._ultima_limpieza < self.intervalo_limpieza:
+                return 0
+            self._ultima_limpieza = ahora
+        borrados = 0
+        for nombre in os.listdir(self.ruta):
+            fichero = os.path.join(self.ruta, nombre)
+            try:
+                if nombre.endswith((".parquet", ".tmp")) and ahora - os.path.getmtime(fichero) > self.ttl:
+                    os.remove(fichero)
+                    borrados += 1
+            except OSError:
+                pass
+        return borrados
+
+
+_areas = {}
+_lock_areas = threading.Lock()
+
+
+def area_preparacion(ruta, ttl=6 * 3600):
+    # Una instancia por ruta y proceso
+    with _lock_areas:
+        if ruta not in _areas:
+            _areas[ruta] = AreaPreparacion(ruta, ttl)
+        return _areas[ruta]
@@ -0,0 +1,232 @@
+import atexit
+import multiprocessing
+import os
+import tempfile
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+import numpy as np
+import pandas as pd
+
+
+COLUMNAS_PRESUPUESTO = [
+    "Cod_Control", "Capítulo", "Partida_Codigo", "Partida_Nombre", "Partida_Descripcion", "Unidad",
+    "Cantidad_Proyecto", "PrPres", "Precio_Licitacion", "Precio_Adjudicado", "Coste", "Importe_Total_Adjudicado",
+]
+
+
+def letra_idx(letra): return ord(letra) - 65
+
+
+def indices_columnas(map_codigo, map_unidad, map_texto, map_cant, map_precio, map_coste, map_cod_control):
+    return {
+        "codigo": letra_idx(map_codigo), "unidad": letra_idx(map_unidad), "texto": letra_idx(map_texto),
+        "cantidad": letra_idx(map_cant), "precio": letra_idx(map_precio),
+        "coste": letra_idx(map_coste) if map_coste != "No disponible" else -1,
+        "cod_control": letra_idx(map_cod_control) if map_cod_control != "No disponible" else -1,
+    }
+
+
+# --- LIMPIEZA VECTORIZADA DE CELDAS ---
+def _texto_celda(serie):
+    # str(valor).strip() si hay dato, "" si la celda está vacía
+    return serie.map(str).where(serie.notna(), "").str.strip()
+
+
+def _codigo_celda(serie):
+    txt = _texto_celda(serie).str.replace(r'\.0$', '', regex=True)
+    return txt.where(txt.str.lower() != "nan", "")
+
+
+def _importe_celda(serie):
+    # Los textos llegan con formato español (1.234,56); los números se respetan
+    serie = serie.astype(object)
+    es_texto = serie.map(type).eq(str)
+    if es_texto.any():
+        serie = serie.copy()
+        serie[es_texto] = serie[es_texto].str.replace(".", "", regex=False).str.replace(",", ".", regex=False)
+    return pd.to_numeric(serie, errors='coerce')
+
+
+# --- CLASIFICACIÓN DE UNA PESTAÑA ---
+# Cada fila útil es cabecera de capítulo, partida con precio o continuación de
+# descripción. El capítulo vigente se propaga hacia abajo dentro de la pestaña.
+def clasificar_hoja(df_h, idx):
+    if df_h.shape[1] <= max(idx["codigo"], idx["unidad"], idx["texto"], idx["cantidad"], idx["precio"]):
+        return pd.DataFrame()
+
+    df_h = df_h.reset_index(drop=True)
+    codigo = _codigo_celda(df_h[idx["codigo"]])
+    texto = _texto_celda(df_h[idx["texto"]])
+    texto = texto.where(texto.str.lower() != "nan", "")
+    precio = _importe_celda(df_h[idx["precio"]])
+
+    cod_lower = codigo.str.lower()
+    valida = ~(cod_lower.str.contains("código", regex=False) | cod_lower.str.contains("codigo", regex=False))
+    hay_cod = codigo != ""
+    hay_txt = texto != ""
+
+    es_cap = valida & hay_cod & hay_txt & precio.isna()
+    es_item = valida & hay_cod & precio.notna()
+    es_cont = valida & ~hay_cod & precio.isna() & hay_txt
+
+    capitulo = texto.where(es_cap).ffill().fillna("Sin Capítulo")
+
+    filas = es_item | es_cont
+    if not filas.any():
+        return pd.DataFrame()
+
+    items = es_item[filas]
+    df = pd.DataFrame({
+        "Es_Partida": items,
+        "Capítulo": capitulo[filas],
+        "Partida_Codigo": codigo[filas],
+        "Texto": texto[filas],
+    })
+
+    if idx["cod_control"] != -1 and df_h.shape[1] > idx["cod_control"]:
+        df["Cod_Control"] = _codigo_celda(df_h[idx["cod_control"]])[filas]
+    else:
+        df["Cod_Control"] = ""
+
+    unidad_raw = df_h[idx["unidad"]][filas]
+    unidad = unidad_raw.map(str).where(unidad_raw.notna(), "")
+    df["Unidad"] = unidad.where(unidad != "nan", "")
+
+    # Solo las partidas llevan números; las continuaciones se quedan a NaN
+    df["PrPres"] = precio[filas].where(items).astype(float)
+    df["Cantidad_Proyecto"] = pd.Series(np.nan, index=df.index, dtype=object)
+    df["Coste"] = pd.Series(np.nan, index=df.index, dtype=object)
+    pos_items = df.index[items]
+    df.loc[pos_items, "Cantidad_Proyecto"] = pd.to_numeric(df_h[idx["cantidad"]][pos_items], errors='coerce').fillna(0.0).astype(object)
+    if idx["coste"] != -1 and df_h.shape[1] > idx["coste"]:
+        df.loc[pos_items, "Coste"] = pd.to_numeric(df_h[idx["coste"]][pos_items], errors='coerce').fillna(0.0).astype(object)
+    else:
+        df.loc[pos_items, "Coste"] = 0.0
+    return df.reset_index(drop=True)
+
+
+# --- ENSAMBLADO DEL PRESUPUESTO ---
+def ensamblar_presupuesto(clasificadas, gg_bi, baja):
+    # clasificadas: resultados de clasificar_hoja en el orden de las pestañas.
+    # Las continuaciones se pegan a la última partida vista, aunque sea de la pestaña anterior.
+    clasificadas = [c for c in clasificadas if not c.empty]
+    if not clasificadas:
+        return pd.DataFrame()
+    df = pd.concat(clasificadas, ignore_index=True)
+
+    es_item = df["Es_Partida"].to_numpy(dtype=bool)
+    propietaria = np.cumsum(es_item) - 1
+    conts = df[~es_item & (propietaria >= 0)]
+    extra = conts["Texto"].groupby(propietaria[conts.index]).agg("\n".join)
+
+    partidas = df[es_item].reset_index(drop=True)
+    if partidas.empty:
+        return pd.DataFrame()
+    descripcion = partidas["Texto"].copy()
+    if not extra.empty:
+        descripcion.loc[extra.index] = descripcion.loc[extra.index] + "\n" + extra
+
+    precio_licitacion = partidas["PrPres"] * (1 + (gg_bi / 100.0))
+    precio_adjudicado = precio_licitacion * (1 - (baja / 100.0))
+    cantidad = pd.Series(partidas["Cantidad_Proyecto"].tolist())
+    coste = pd.Series(partidas["Coste"].tolist())
+
+    return pd.DataFrame({
+        "Cod_Control": partidas["Cod_Control"],
+        "Capítulo": partidas["Capítulo"],
+        "Partida_Codigo": partidas["Partida_Codigo"],
+        "Partida_Nombre": partidas["Texto"],
+        "Partida_Descripcion": descripcion,
+        "Unidad": partidas["Unidad"],
+        "Cantidad_Proyecto": cantidad,
+        "PrPres": partidas["PrPres"],
+        "Precio_Licitacion": precio_licitacion,
+        "Precio_Adjudicado": precio_adjudicado,
+        "Coste": coste,
+        "Importe_Total_Adjudicado": cantidad * precio_adjudicado,
+    }, columns=COLUMNAS_PRESUPUESTO)
+
+
+def parsear_presupuesto(xls, hojas, idx, gg_bi, baja):
+    # Una pestaña viva cada vez: se lee (openpyxl en modo solo lectura), se
+    # clasifica y solo se conserva el resultado compacto.
+    clasificadas = []
+    for hoja in hojas:
+        df_h = pd.read_excel(xls, sheet_name=hoja, header=None)
+        clasificadas.append(clasificar_hoja(df_h, idx))
+        del df_h
+    return ensamblar_presupuesto(clasificadas, gg_bi, baja)
+
+
+# --- LECTURA DE PESTAÑAS EN PARALELO (PROCESOS) ---
+# Leer el Excel y clasificar es CPU (openpyxl + pandas), así que con hilos no
+# se gana nada: cada pestaña va a un proceso del pool, que abre el fichero por
+# su cuenta y devuelve solo la clasificación compacta. El ensamblado (que pega
+# continuaciones entre pestañas) sigue siendo secuencial y en el orden pedido.
+_pool = None
+_lock_pool = threading.Lock()
+
+
+def _pool_procesos():
+    # Un pool por proceso, creado al primer uso. "spawn": el servidor de
+    # Streamlit tiene hilos vivos y hacer fork con ellos no es seguro.
+    global _pool
+    with _lock_pool:
+        if _pool is None:
+            _pool = ProcessPoolExecutor(max_workers=os.cpu_count() or 1, mp_context=multiprocessing.get_context("spawn"))
+            atexit.register(_pool.shutdown, wait=False, cancel_futures=True)
+        return _pool
+
+
+def _descartar_pool(pool):
+    global _pool
+    with _lock_pool:
+        if _pool is pool:
+            _pool = None
+    pool.shutdown(wait=False, cancel_futures=True)
+
+
+def clasificar_pestana(ruta, hoja, idx):
+    df_h = pd.read_excel(ruta, sheet_name=hoja, header=None)
+    return clasificar_hoja(df_h, idx)
+
+
+def clasificar_pestanas(ruta, hojas, idx, paralelo=True):
+    # [(clasificada, error)] en el orden de `hojas`; un fallo no para al resto
+    resultados = [(None, None)] * len(hojas)
+    if paralelo and len(hojas) > 1:
+        pool = _pool_procesos()
+        try:
+            futuros = [pool.submit(clasificar_pestana, ruta, hoja, idx) for hoja in hojas]
+            for i, futuro in enumerate(futuros):
+                try:
+                    resultados[i] = (futuro.result(), None)
+                except BrokenProcessPool:
+                    raise
+                except Exception as e:
+                    resultados[i] = (None, e)
+            return resultados
+        except BrokenProcessPool:
+            # Un proceso murió (memoria, señal...): se rehace el pool y se sigue en este proceso
+            _descartar_pool(pool)
+    for i, hoja in enumerate(hojas):
+        try:
+            resultados[i] = (clasificar_pestana(ruta, hoja, idx), None)
+        except Exception as e:
+            resultados[i] = (None, e)
+    return resultados
+
+
+def parsear_presupuesto_paralelo(contenido, hojas, idx, gg_bi, baja, sufijo=".xlsx", paralelo=True):
+    # contenido: bytes del fichero subido. Devuelve (presupuesto, {pestaña: error});
+    # el presupuesto solo incluye las pestañas que se han podido leer.
+    with tempfile.TemporaryDirectory() as directorio:
+        ruta = os.path.join(directorio, f"presupuesto{sufijo}")
+        with open(ruta, "wb") as f:
+            f.write(contenido)
+        resultados = clasificar_pestanas(ruta, list(hojas), idx, paralelo)
+    errores = {hoja: f"{type(error).__name__}: {error}" for hoja, (_, error) in zip(hojas, resultados) if error is not None}
+    df = ensamblar_presupuesto([c for c, error in resultados if error is None], gg_bi, baja)
+    return df, errores
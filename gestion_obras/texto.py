@@ -0,0 +1,79 @@
+import re
+import unicodedata
+from collections import deque
+
+import pandas as pd
+
+
+# --- NORMALIZACIÓN DE TEXTO ---
+def limpiar_texto(texto):
+    if pd.isna(texto): return ""
+    t = str(texto).lower().replace("\n", " ").replace("\r", " ")
+    t = unicodedata.normalize('NFKD', t).encode('ASCII', 'ignore').decode('utf-8')
+    t = re.sub(r'[.,;:_\-]', ' ', t)
+    return " ".join(t.split())
+
+
+def normalizar(texto):
+    # Minúsculas y sin acentos ("Cemento Pórtland" -> "cemento portland")
+    t = unicodedata.normalize('NFKD', str(texto).lower())
+    return t.encode('ASCII', 'ignore').decode('ascii')
+
+
+def normalizar_serie(serie):
+    serie = serie.where(serie.notna(), "").astype(str)
+    return serie.str.lower().str.normalize('NFKD').str.encode('ascii', 'ignore').str.decode('ascii')
+
+
+def tokens(texto):
+    return re.findall(r'[a-z0-9]+', normalizar(texto))
+
+
+def trigramas(texto):
+    return {texto[i:i + 3] for i in range(len(texto) - 2)}
+
+
+# --- AUTÓMATA MULTIPATRÓN (AHO-CORASICK) ---
+# Encuentra en una sola pasada todos los patrones contenidos en el texto,
+# incluidos los solapados ("juan" y "juan pedro"), igual que probar
+# `patron in texto` patrón a patrón.
+class AutomataPatrones:
+    def __init__(self, patrones):
+        self._goto = [{}]
+        self._fallo = [0]
+        self._salida = [[]]
+        for id_patron, patron in enumerate(patrones):
+            estado = 0
+            for car in patron:
+                siguiente = self._goto[estado].get(car)
+                if siguiente is None:
+                    siguiente = len(self._goto)
+                    self._goto[estado][car] = siguiente
+                    self._goto.append({})
+                    self._fallo.append(0)
+                    self._salida.append([])
+                estado = siguiente
+            self._salida[estado].append(id_patron)
+
+        cola = deque(self._goto[0].values())
+        while cola:
+            estado = cola.popleft()
+            for car, siguiente in self._goto[estado].items():
+                cola.append(siguiente)
+                f = self._fallo[estado]
+                while f and car not in self._goto[f]:
+                    f = self._fallo[f]
+                destino = self._goto[f].get(car, 0)
+                self._fallo[siguiente] = destino if destino != siguiente else 0
+                self._salida[siguiente] = self._salida[siguiente] + self._salida[self._fallo[siguiente]]
+
+    def buscar(self, texto):
+        encontrados = set()
+        estado = 0
+        for car in texto:
+            while estado and car not in self._goto[estado]:
+                estado = self._fallo[estado]
+            estado = self._goto[estado].get(car, 0)
+            if self._salida[estado]:
+                encontrados.update(self._salida[estado])
+        return encontrados
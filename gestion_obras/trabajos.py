@@ -0,0 +1,73 @@
+import threading
+import time
+
+
+# --- TRABAJOS EN SEGUNDO PLANO ---
+# Procesos largos (reimputaciones, recálculos de cartera...) que no deben
+# bloquear el rerun. Viven a nivel de proceso: cualquier sesión ve su estado
+# y un mismo trabajo no se lanza dos veces a la vez.
+class Trabajo:
+    def __init__(self, nombre, funcion):
+        self.nombre = nombre
+        self._funcion = funcion
+        self._lock = threading.Lock()
+        self.estado = "pendiente"
+        self.progreso = ""
+        self.fraccion = 0.0
+        self.resultado = None
+        self.error = None
+        self.inicio = None
+        self.fin = None
+        self._hilo = threading.Thread(target=self._ejecutar, name=f"trabajo-{nombre}", daemon=True)
+
+    def _ejecutar(self):
+        with self._lock:
+            self.estado, self.inicio = "en curso", time.time()
+        try:
+            resultado = self._funcion(self.avanzar)
+        except Exception as e:
+            with self._lock:
+                self.estado, self.error, self.fin = "error", f"{type(e).__name__}: {e}", time.time()
+            return
+        with self._lock:
+            self.estado, self.resultado, self.fin, self.fraccion = "terminado", resultado, time.time(), 1.0
+
+    def avanzar(self, texto, fraccion=None):
+        with self._lock:
+            self.progreso = texto
+            if fraccion is not None:
+                self.fraccion = min(max(float(fraccion), 0.0), 1.0)
+
+    @property
+    def activo(self):
+        return self.estado in ("pendiente", "en curso")
+
+    @property
+    def segundos(self):
+        if self.inicio is None:
+            return 0.0
+        return (self.fin or time.time()) - self.inicio
+
+    def esperar(self, timeout=None):
+        self._hilo.join(timeout)
+        return not self.activo
+
+
+_trabajos = {}
+_lock_trabajos = threading.Lock()
+
+
+def lanzar_trabajo(nombre, funcion):
+    # funcion(avanzar) -> resultado; si ya hay uno activo con ese nombre se devuelve ese
+    with _lock_trabajos:
+        trabajo = _trabajos.get(nombre)
+        if trabajo is not None and trabajo.activo:
+            return trabajo
+        trabajo = _trabajos[nombre] = Trabajo(nombre, funcion)
+    trabajo._hilo.start()
+    return trabajo
+
+
+def trabajo(nombre):
+    with _lock_trabajos:
+        return _trabajos.get(nombre)
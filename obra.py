@@ -1,17 +1,42 @@
 import streamlit as st
 import pandas as pd
-from streamlit_gsheets import GSheetsConnection
 from datetime import datetime
-import google.generativeai as genai
-import json
 import os
-import re
-import unicodedata
-import difflib
+from gestion_obras.cache_hojas import cache_hojas
+from gestion_obras.almacen import crear_almacen
+from gestion_obras.cola_escritura import cola_escritura
+from gestion_obras.datos import AccesoDatos, huella_hoja
+from gestion_obras.diario import avisos_jornada, fila_diario, filas_coste_diario, partes_desde_ia, prompt_partes
+from gestion_obras.imputacion import reimputar_obras, resumen_costes_por_tarea
+from gestion_obras.certificacion import (
+    VALORES_CERTIFICACION, a_formato_largo, cantidad_anterior, casar_certificacion, es_formato_ancho,
+    lineas_certificacion, mes_desde_origen, origen_certificacion, plan_desde_origen,
+)
+from gestion_obras.presupuesto import indices_columnas, parsear_presupuesto_paralelo
+from gestion_obras.preparacion import area_preparacion
+from gestion_obras.contexto_ia import construir_contexto
+from gestion_obras.informe import HOJA_RESUMEN, columnas_meses, evolucion_certificaciones, informe_desde_resumen
+from gestion_obras.cartera import HOJAS_CARTERA, cargar_cartera, resumen_cartera
+from gestion_obras.precios import PROMPT_FACTURA, buscador_precios, indice_precios
+from gestion_obras.ia import (
+    cache_resultados_ia, extraer_con_cache, generar_contenido, modelo_gemini, parsear_json_ia, procesar_en_paralelo,
+)
+from gestion_obras.instrumentacion import iniciar_medicion, medir, percentiles_registro, registro_rendimiento
+from gestion_obras.trabajos import lanzar_trabajo, trabajo
 
 # --- CONFIGURACIÓN DE PÁGINA ---
 st.set_page_config(page_title="ERP Construcción", layout="wide", initial_sidebar_state="expanded")
 
+# --- INSTRUMENTACIÓN DEL RERUN ---
+# Tiempos de lecturas/escrituras, llamadas a Gemini y cálculos de este rerun.
+# Al final del script se vuelcan a un registro JSONL rotativo (p50/p95 por vista).
+RUTA_REGISTRO_RENDIMIENTO = os.environ.get("ERP_REGISTRO_RENDIMIENTO", os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos_locales", "rendimiento.jsonl"))
+registro_tiempos = registro_rendimiento(RUTA_REGISTRO_RENDIMIENTO, max_bytes=5 * 1024 * 1024, copias=5)
+# Un rerun cortado con st.stop() no llega al final: se registra al empezar el siguiente
+if "medicion_rerun" in st.session_state and not st.session_state.medicion_rerun.cerrada:
+    registro_tiempos.registrar(st.session_state.medicion_rerun.cerrar(completa=False))
+medicion_rerun = st.session_state.medicion_rerun = iniciar_medicion(st.session_state.get("vista_activa"))
+
 # --- ESTÉTICA VERDE CLARO PROFESIONAL (INYECCIÓN DE CSS) ---
 st.markdown("""
     <style>
@@ -81,36 +106,70 @@ st.markdown("""
     </style>
 """, unsafe_allow_html=True)
 
-conn = st.connection("gsheets", type=GSheetsConnection)
+# --- MOTOR DE ALMACENAMIENTO ---
+# "gsheets": Google Sheets directo · "local": SQLite local (pruebas, benchmarks, sin red)
+# "local+gsheets": SQLite como almacén principal, sincronizado con Sheets
+MOTOR_ALMACEN = os.environ.get("ERP_ALMACEN", "gsheets")
+RUTA_ALMACEN_LOCAL = os.environ.get("ERP_RUTA_LOCAL", os.path.join(os.path.dirname(os.path.abspath(__file__)), "datos_locales", "erp.sqlite"))
+
+# Escritura diferida: los guardados hacia Sheets se apuntan en un diario local y
+# un hilo de fondo los envía agrupados por pestaña ("0" para escribir en línea)
+ESCRITURA_DIFERIDA = os.environ.get("ERP_ESCRITURA_DIFERIDA", "1") == "1"
+RUTA_COLA_ESCRITURA = os.path.join(os.path.dirname(RUTA_ALMACEN_LOCAL), "cola_escrituras.sqlite")
+
+conn = None
+if "gsheets" in MOTOR_ALMACEN:
+    # El cliente de Sheets solo se importa si el motor lo usa (el local arranca sin él)
+    from streamlit_gsheets import GSheetsConnection
+    conn = st.connection("gsheets", type=GSheetsConnection)
+credenciales_gsheets = None
+if conn is not None and "gsheets" in st.secrets.get("connections", {}):
+    credenciales_gsheets = st.secrets["connections"]["gsheets"].to_dict()
+almacen = crear_almacen(MOTOR_ALMACEN, conn=conn, ruta_local=RUTA_ALMACEN_LOCAL,
+                        ruta_cola=RUTA_COLA_ESCRITURA if ESCRITURA_DIFERIDA else None,
+                        credenciales=credenciales_gsheets)
+cola_escrituras = cola_escritura(RUTA_COLA_ESCRITURA)
 
 # 🔴 PEGA AQUÍ LA URL COMPLETA DE TU GOOGLE SHEETS "MAESTRO" 🔴
 URL_MAESTRO = "https://docs.google.com/spreadsheets/d/1Ua_8c_VgY_mKN_xN_TX_yXkwhoolkl8KOx3YRndcVdo/edit?gid=1271955705#gid=1271955705"
 
 # --- CONEXIÓN IA ---
-if "GEMINI_API_KEY" in st.secrets:
-    genai.configure(api_key=st.secrets["GEMINI_API_KEY"])
-else:
+CONCURRENCIA_IA = 4   # orígenes procesados a la vez en el asistente de voz
+TIMEOUT_IA = 120      # segundos por petición a Gemini
+REINTENTOS_IA = 3     # intentos ante errores transitorios (cuota, red, 5xx)
+MODELO_IA = 'gemini-2.5-flash'
+PRESUPUESTO_TOKENS_CHAT = 30000   # tope aproximado del contexto de datos de los asistentes
+# Resultados ya extraídos (mismo fichero + mismo prompt + mismo modelo) no se vuelven a pedir
+cache_ia = cache_resultados_ia(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".cache_ia"), max_bytes=200 * 1024 * 1024)
+# google.generativeai se importa y configura en la primera llamada (modelo_gemini)
+CLAVE_GEMINI = st.secrets["GEMINI_API_KEY"] if "GEMINI_API_KEY" in st.secrets else None
+if CLAVE_GEMINI is None:
     st.sidebar.warning("Aviso: Clave de Gemini no encontrada en Secrets.")
 
+# Segundos que una pestaña descargada se reutiliza entre reruns y sesiones
+TTL_CACHE_HOJAS = 60
+cache_hojas.ttl = TTL_CACHE_HOJAS
+
+# Obras descargadas a la vez en la vista de cartera
+CONCURRENCIA_CARTERA = 8
+
+# Filas mostradas como máximo en la búsqueda del histórico de precios
+LIMITE_BUSQUEDA_PRECIOS = 500
+
+# Importaciones pendientes de confirmar: en disco (Parquet), no en la sesión.
+# Las que nadie confirma se borran pasadas TTL_IMPORTACIONES sin tocarse.
+RUTA_IMPORTACIONES = os.environ.get("ERP_RUTA_IMPORTACIONES", os.path.join(os.path.dirname(RUTA_ALMACEN_LOCAL), "importaciones"))
+TTL_IMPORTACIONES = 6 * 3600
+FILAS_VISTA_PREVIA = 50
+importaciones = area_preparacion(RUTA_IMPORTACIONES, TTL_IMPORTACIONES)
+importaciones.limpiar()
+
 # --- FUNCIONES DE BASE DE DATOS ---
-def cargar_datos(hoja, url):
-    try:
-        return conn.read(spreadsheet=url, worksheet=hoja, ttl=0)
-    except Exception:
-        return pd.DataFrame()
-
-def guardar_datos(hoja, df, url):
-    conn.update(spreadsheet=url, worksheet=hoja, data=df)
-
-def calcular_coste_personal(texto_personal, horas, df_tarifas):
-    if not texto_personal or horas <= 0 or df_tarifas.empty: return 0.0
-    texto_personal = str(texto_personal).lower()
-    costes = []
-    for _, tarifa in df_tarifas.iterrows():
-        nombre_tarifa = str(tarifa['Recurso']).lower()
-        if nombre_tarifa and nombre_tarifa != "nan" and nombre_tarifa in texto_personal:
-            costes.append(pd.to_numeric(tarifa['Coste_Hora'], errors='coerce'))
-    return sum(costes) * float(horas) if costes else 0.0
+datos = AccesoDatos(almacen, cache_hojas)
+cargar_datos = datos.cargar     # DataFrame vacío si la pestaña no se puede leer
+guardar_datos = datos.guardar
+anexar_datos = datos.anexar     # solo envía las filas nuevas
+actualizar_resumen_cod_control = datos.actualizar_resumen_cod_control
 
 # --- ASISTENTE IA GENÉRICO ---
 def modulo_chat_ia(nombre_modulo, dicc_dataframes):
@@ -128,24 +187,85 @@ def modulo_chat_ia(nombre_modulo, dicc_dataframes):
         with st.chat_message("user"):
             st.markdown(prompt)
             
-        contexto = f"Eres un analista de datos para un ERP de construcción. Módulo: '{nombre_modulo}'.\nDATOS:\n"
-        for nombre_tabla, df in dicc_dataframes.items():
-            if isinstance(df, pd.DataFrame) and not df.empty:
-                contexto += f"--- {nombre_tabla} ---\n{df.to_csv(index=False)}\n\n"
-            else:
-                contexto += f"--- {nombre_tabla} ---\n(Sin datos)\n\n"
-                
-        contexto += """Instrucciones: Responde de forma profesional, clara y concisa. Basa tus cálculos estrictamente en los datos adjuntos.\n\nUsuario: """ + prompt
+        # Esquemas + agregados + solo las filas relevantes, dentro del presupuesto de tokens
+        contexto, info_contexto = construir_contexto(nombre_modulo, dicc_dataframes, prompt, PRESUPUESTO_TOKENS_CHAT)
         with st.chat_message("assistant"):
             with st.spinner("Procesando consulta..."):
                 try:
-                    modelo = genai.GenerativeModel('gemini-2.5-flash')
-                    respuesta = modelo.generate_content(contexto)
+                    modelo = modelo_gemini(MODELO_IA, CLAVE_GEMINI)
+                    respuesta = generar_contenido(modelo, contexto)
                     st.markdown(respuesta.text)
+                    st.caption(f"Contexto enviado: ~{info_contexto['tokens']:,} tokens · {info_contexto['filas']:,} filas de datos")
                     st.session_state[chat_key].append({"role": "assistant", "content": respuesta.text})
                 except Exception as e:
                     st.error(f"Error de IA: {e}")
 
+# --- IMPORTACIONES PREPARADAS ---
+def preparar_importacion(clave, df, tipo):
+    # Sustituye la preparación anterior de esta sesión (si la había)
+    descartar_importacion(clave)
+    st.session_state[clave] = importaciones.guardar(df, tipo)
+
+
+def importacion_preparada(clave):
+    # Identificador vigente o None (caducada o nunca preparada)
+    id_prep = st.session_state.get(clave)
+    if id_prep is not None and not importaciones.existe(id_prep):
+        del st.session_state[clave]
+        st.warning("La importación preparada ha caducado. Vuelve a procesar el fichero.")
+        return None
+    return id_prep
+
+
+def descartar_importacion(clave):
+    if clave in st.session_state:
+        importaciones.borrar(st.session_state[clave])
+        del st.session_state[clave]
+
+
+def vista_previa_importacion(id_prep, clave):
+    total = importaciones.filas(id_prep)
+    paginas = max(1, -(-total // FILAS_VISTA_PREVIA))
+    c1, c2 = st.columns([1, 3])
+    pagina = c1.number_input("Página", min_value=1, max_value=paginas, value=1, step=1, key=f"pagina_{clave}")
+    c2.caption(f"{total:,} filas · página {pagina} de {paginas}")
+    st.dataframe(importaciones.pagina(id_prep, pagina - 1, FILAS_VISTA_PREVIA), use_container_width=True)
+
+
+# --- MÓDULOS (RERUNS PARCIALES) ---
+# Cada vista es un módulo registrado con las pestañas que lee (obra=: de la obra
+# activa · maestro=: de la BD Maestra) y se ejecuta como fragmento: sus widgets
+# solo vuelven a ejecutar el módulo, sin CSS, BD Maestra ni barra lateral. Las
+# pestañas declaradas se cargan en paralelo al entrar y, en los reruns del
+# módulo, se reutilizan mientras su entrada en la caché de hojas siga vigente
+# (sin caducar y sin que ninguna sesión ni trabajo de fondo la haya cambiado).
+MODULOS = {}
+
+
+def modulo(vista, obra=(), maestro=()):
+    def registrar(funcion):
+        MODULOS[vista] = (funcion, [(hoja, "obra") for hoja in obra] + [(hoja, "maestro") for hoja in maestro])
+        return funcion
+    return registrar
+
+
+@st.fragment
+def ejecutar_modulo(vista):
+    # Sin "copia_modulo" en la sesión es un rerun completo (el script la borra antes de llamar)
+    parcial = "copia_modulo" in st.session_state
+    medicion = iniciar_medicion(f"{vista} (módulo)") if parcial else medicion_rerun
+    try:
+        funcion, dependencias = MODULOS[vista]
+        urls = {"obra": url_obra, "maestro": URL_MAESTRO}
+        claves = [(hoja, urls[origen]) for hoja, origen in dependencias]
+        with medir("datos_modulo", hojas=len(claves)):
+            cargadas, st.session_state.copia_modulo = datos.cargar_varias(claves, st.session_state.get("copia_modulo"))
+        funcion({hoja: cargadas[clave] for (hoja, _), clave in zip(dependencias, claves)})
+    finally:
+        if parcial:
+            registro_tiempos.registrar(medicion.cerrar())
+
+
 # --- MEMORIA TEMPORAL ---
 if 'ia_datos' not in st.session_state:
     st.session_state.ia_datos = {"Fecha": datetime.today().strftime("%Y-%m-%d"), "Tarea": "", "Descripción_Tarea": "", "Personal": "", "Maquinaria": ""}
@@ -159,21 +279,8 @@ if URL_MAESTRO == "PEGAR_AQUI_LA_URL_DEL_MAESTRO":
 
 # Estructura compacta de la barra lateral
 st.sidebar.markdown('<p class="app-title">ERP Construcción</p>', unsafe_allow_html=True)
-
-df_maestro = cargar_datos(0, URL_MAESTRO)
-if df_maestro.empty:
-    st.sidebar.error("Error BD Maestra.")
-    st.stop()
-
-obras_activas = df_maestro[df_maestro['Estado'] == 'Activa']
-if obras_activas.empty:
-    st.sidebar.warning("No hay proyectos.")
-    st.stop()
-
-st.sidebar.markdown('<p class="small-text" style="margin-top: 5px;">PROYECTO ACTIVO</p>', unsafe_allow_html=True)
-obra_actual = st.sidebar.selectbox("", obras_activas['Nombre_Proyecto'].tolist(), label_visibility="collapsed")
-url_obra = obras_activas[obras_activas['Nombre_Proyecto'] == obra_actual]['Enlace_Google_Sheet'].values[0]
-
+# El selector de obra se rellena después: el menú se pinta sin esperar a la BD Maestra
+zona_proyecto = st.sidebar.container()
 st.sidebar.markdown('<hr>', unsafe_allow_html=True)
 
 # --- LÓGICA DE NAVEGACIÓN INSTANTÁNEA ---
@@ -200,16 +307,64 @@ st.sidebar.markdown('<hr>', unsafe_allow_html=True)
 
 st.sidebar.markdown('<p class="small-text">BASES DE DATOS GLOBALES</p>', unsafe_allow_html=True)
 st.sidebar.radio("", [
+    "Cartera de Obras",
     "Base de Precios",
     "Tarifas (Personal/Maquinaria)"
 ], key="rad_glob", label_visibility="collapsed", on_change=cambiar_vista_global)
 
+st.sidebar.markdown('<hr>', unsafe_allow_html=True)
+with st.sidebar.expander("Caché de hojas"):
+    stats_cache = cache_hojas.estadisticas()
+    st.caption(f"Aciertos: {stats_cache['aciertos']} · Fallos: {stats_cache['fallos']} · Invalidaciones: {stats_cache['invalidaciones']} · Ratio: {stats_cache['ratio_aciertos']:.0%}")
+    st.dataframe(cache_hojas.estadisticas_df(), use_container_width=True, hide_index=True)
+    if st.button("Vaciar caché"):
+        cache_hojas.vaciar()
+    stats_ia = cache_ia.estadisticas()
+    st.caption(f"Caché IA: {stats_ia['entradas']} resultados · {stats_ia['bytes'] / 1024:.0f} KB · Aciertos: {stats_ia['aciertos']} · Fallos: {stats_ia['fallos']}")
+
+if cola_escrituras is not None:
+    with st.sidebar.expander("Escrituras pendientes"):
+        stats_cola = cola_escrituras.estadisticas()
+        fmt_ms = lambda v: f"{v:.0f} ms" if v is not None else "-"
+        st.caption(f"En cola: {stats_cola['pendientes']} · Encoladas: {stats_cola['encoladas']} · Envíos: {stats_cola['envios']}")
+        st.caption(f"Guardado: {fmt_ms(stats_cola['ultima_encolada_ms'])} · Último envío: {fmt_ms(stats_cola['ultima_latencia_ms'])} · Medio: {fmt_ms(stats_cola['latencia_media_ms'])}")
+        if stats_cola['ultima_sincronizacion']:
+            st.caption(f"Última sincronización: {datetime.fromtimestamp(stats_cola['ultima_sincronizacion']).strftime('%H:%M:%S')}")
+        if stats_cola['ultimo_error']:
+            st.warning(f"Último error de envío: {stats_cola['ultimo_error']}")
+        if stats_cola['descartadas']:
+            # No se reintentan: hay que revisarlas y volver a introducir los datos
+            st.error(f"Escrituras descartadas: {stats_cola['descartadas']}")
+            df_descartadas = cola_escrituras.descartadas()
+            df_descartadas['descartada'] = pd.to_datetime(df_descartadas['descartada'], unit='s')
+            st.dataframe(df_descartadas.drop(columns=['url']), use_container_width=True, hide_index=True)
+        if st.button("Sincronizar ahora"):
+            if not cola_escrituras.esperar(timeout=60):
+                st.warning("Quedan escrituras pendientes; se reintentarán en segundo plano.")
+
 vista_activa = st.session_state.vista_activa
+medicion_rerun.vista = vista_activa
+
+with zona_proyecto:
+    df_maestro = cargar_datos(0, URL_MAESTRO)
+    if df_maestro.empty:
+        st.error("Error BD Maestra.")
+        st.stop()
+
+    obras_activas = df_maestro[df_maestro['Estado'] == 'Activa']
+    if obras_activas.empty:
+        st.warning("No hay proyectos.")
+        st.stop()
+
+    st.markdown('<p class="small-text" style="margin-top: 5px;">PROYECTO ACTIVO</p>', unsafe_allow_html=True)
+    obra_actual = st.selectbox("", obras_activas['Nombre_Proyecto'].tolist(), label_visibility="collapsed")
+    url_obra = obras_activas[obras_activas['Nombre_Proyecto'] == obra_actual]['Enlace_Google_Sheet'].values[0]
 
 # ==========================================
 # 1. GESTIÓN DE OBRAS Y DIARIO
 # ==========================================
-if vista_activa == "Gestión de Obras (Diario)":
+@modulo("Gestión de Obras (Diario)")
+def modulo_diario(d):
     st.title(f"Gestión de Obra: {obra_actual}")
     
     tab_parte, tab_chat = st.tabs(["📝 Registro Manual", "🎙️ Asistente de Voz Múltiple (IA)"])
@@ -238,26 +393,14 @@ if vista_activa == "Gestión de Obras (Diario)":
             ud = c8.text_input("Unidad (ej: m2, ml, ud)")
             
             if st.form_submit_button("Guardar Registro"):
-                df_diario = cargar_datos("Diario", url_obra)
-                nuevo_parte = pd.DataFrame([{
-                    "Fecha": fecha_input, "Proyecto": obra_actual, "Tipo_Entrada": "Manual",
-                    "Contenido": "Texto manual", "Tarea": tarea, "Descripción_Tarea": desc_tarea,
-                    "Personal": personal, "Horas_Personal": h_pers, 
-                    "Maquinaria": maq, "Horas_Maq": h_maq, "Produccion": prod, "Unidad": ud
-                }])
-                df_diario = pd.concat([df_diario, nuevo_parte], ignore_index=True)
-                guardar_datos("Diario", df_diario, url_obra)
+                nuevo_parte = pd.DataFrame([fila_diario(fecha_input, obra_actual, "Manual", "Texto manual", tarea, desc_tarea,
+                                                        personal, h_pers, maq, h_maq, prod, ud)])
+                anexar_datos("Diario", nuevo_parte, url_obra)
                 
                 df_tarifas = cargar_datos("Tarifas_Personal_Maquinaria", URL_MAESTRO)
-                coste_p = calcular_coste_personal(personal, h_pers, df_tarifas)
-                if coste_p > 0:
-                    df_costes = cargar_datos("Costes_Imputados", url_obra)
-                    nuevo_coste = pd.DataFrame([{
-                        "Fecha": fecha_input, "Proyecto": obra_actual, "Tarea": tarea,
-                        "Concepto": f"Mano de obra ({desc_tarea}): {personal}", "Coste_Total": coste_p
-                    }])
-                    df_costes = pd.concat([df_costes, nuevo_coste], ignore_index=True)
-                    guardar_datos("Costes_Imputados", df_costes, url_obra)
+                nuevos_costes = filas_coste_diario(nuevo_parte.to_dict("records"), df_tarifas)
+                if nuevos_costes:
+                    anexar_datos("Costes_Imputados", pd.DataFrame(nuevos_costes), url_obra)
                 st.success("Registro guardado correctamente.")
 
     # --- PESTAÑA 2: ASISTENTE DE VOZ Y LECTOR DE AUDIOS (MULTIPLE) ---
@@ -288,105 +431,56 @@ if vista_activa == "Gestión de Obras (Diario)":
                 st.warning("Por favor, proporciona al menos un audio o un texto para procesar.")
             else:
                 with st.spinner(f"Procesando {len(tareas_a_procesar)} origen(es) de datos..."):
-                    df_diario = cargar_datos("Diario", url_obra)
-                    df_costes = cargar_datos("Costes_Imputados", url_obra)
                     df_tarifas = cargar_datos("Tarifas_Personal_Maquinaria", URL_MAESTRO)
                     
                     nuevos_partes_diario = []
                     nuevos_partes_costes = []
                     
-                    modelo = genai.GenerativeModel('gemini-2.5-flash')
+                    modelo = modelo_gemini(MODELO_IA, CLAVE_GEMINI)
                     fecha_hoy = datetime.today().strftime("%Y-%m-%d")
                     
-                    # PROMPT ACTUALIZADO CON TUS DIRECTRICES ESTRICTAS
-                    prompt_ia = f"""
-                    Eres el encargado de obra. Extrae los datos del parte de trabajo y devuélvelos ÚNICAMENTE como un ARRAY (lista) de objetos JSON, sin comillas invertidas de markdown.
-                    
-                    REGLAS OBLIGATORIAS:
-                    1. SEPARACIÓN DE TAJOS: Si hay distintos trabajos o personas en tareas diferentes (Ej: José en tarea A y Fernando en tarea B), DEBES crear un objeto JSON independiente para cada uno. No los agrupes en una sola línea.
-                    2. CÁLCULO DE HORAS: 
-                       - Si no se especifican horas para una persona, asume por defecto 8.0 horas.
-                       - Si dice "mediodía" o "media jornada", son 4.0 horas.
-                       - Si da un número de horas exacto, usa ese número.
-                    
-                    Claves requeridas por cada objeto JSON de la lista:
-                    - "Fecha": (YYYY-MM-DD, si no se dice una fecha, usa por defecto {fecha_hoy})
-                    - "Tarea": Agrupador general (ej: Albañilería, Cimentación).
-                    - "Descripción_Tarea": Qué se ha hecho exactamente en esta línea.
-                    - "Personal": Nombre(s) del trabajador(es) asignado(s) A ESTE TRABAJO.
-                    - "Horas_Personal": número float (horas imputadas a ESTE trabajo).
-                    - "Maquinaria": Máquinas usadas (vacío si no hay).
-                    - "Horas_Maq": número float.
-                    - "Produccion": número float (cantidad ejecutada).
-                    - "Unidad": ud, m2, m3, ml, etc.
-                    """
+                    prompt_ia = prompt_partes(fecha_hoy)
 
+                    # Se preparan los envíos en el hilo principal (los ficheros subidos no se leen desde otros hilos)
+                    contenidos_enviar = []
                     for tarea in tareas_a_procesar:
+                        contenido_enviar = [prompt_ia]
+                        if tarea["tipo"] == "audio":
+                            tipo_mime = tarea["datos"].type if hasattr(tarea["datos"], 'type') and tarea["datos"].type else "audio/wav"
+                            contenido_enviar.append({"mime_type": tipo_mime, "data": tarea["datos"].getvalue()})
+                        elif tarea["tipo"] == "texto":
+                            contenido_enviar.append(tarea["datos"])
+                        contenidos_enviar.append(contenido_enviar)
+
+                    def extraer_partes(contenido_enviar):
+                        def llamada():
+                            respuesta = generar_contenido(modelo, contenido_enviar, request_options={"timeout": TIMEOUT_IA})
+                            return parsear_json_ia(respuesta.text)
+                        return extraer_con_cache(cache_ia, MODELO_IA, contenido_enviar, llamada)
+
+                    # Filas por origen, para guardarlas después en el orden de entrada
+                    filas_por_tarea = {}
+
+                    for i, resultado, error in procesar_en_paralelo(contenidos_enviar, extraer_partes, CONCURRENCIA_IA, REINTENTOS_IA):
+                        tarea = tareas_a_procesar[i]
                         try:
-                            contenido_enviar = [prompt_ia]
-                            
-                            if tarea["tipo"] == "audio":
-                                tipo_mime = tarea["datos"].type if hasattr(tarea["datos"], 'type') and tarea["datos"].type else "audio/wav"
-                                contenido_enviar.append({"mime_type": tipo_mime, "data": tarea["datos"].getvalue()})
-                            elif tarea["tipo"] == "texto":
-                                contenido_enviar.append(tarea["datos"])
-                                
-                            respuesta = modelo.generate_content(contenido_enviar)
-                            
-                            texto_json = respuesta.text.strip().replace("```json", "").replace("```", "")
-                            lista_partes = json.loads(texto_json)
-                            
-                            # Asegurarnos de que siempre sea una lista para iterar
+                            if error is not None:
+                                raise error
+                            lista_partes, desde_cache = resultado
                             if isinstance(lista_partes, dict):
                                 lista_partes = [lista_partes]
-                                
-                            # Diccionario para sumar las horas y lanzar el "chivato"
-                            horas_trabajadores = {}
-
-                            for datos_parte in lista_partes:
-                                # Preparamos la fila del diario
-                                nuevos_partes_diario.append({
-                                    "Fecha": datos_parte.get("Fecha", fecha_hoy),
-                                    "Proyecto": obra_actual, 
-                                    "Tipo_Entrada": "IA Asistente",
-                                    "Contenido": f"Procesado de: {tarea['nombre']}",
-                                    "Tarea": datos_parte.get("Tarea", ""),
-                                    "Descripción_Tarea": datos_parte.get("Descripción_Tarea", ""),
-                                    "Personal": datos_parte.get("Personal", ""),
-                                    "Horas_Personal": float(datos_parte.get("Horas_Personal", 0.0)),
-                                    "Maquinaria": datos_parte.get("Maquinaria", ""),
-                                    "Horas_Maq": float(datos_parte.get("Horas_Maq", 0.0)),
-                                    "Produccion": float(datos_parte.get("Produccion", 0.0)),
-                                    "Unidad": datos_parte.get("Unidad", "")
-                                })
-                                
-                                # Preparamos la fila de costes si hay personal
-                                horas_imputadas = float(datos_parte.get("Horas_Personal", 0.0))
-                                personal_str = datos_parte.get("Personal", "")
-                                
-                                coste_p = calcular_coste_personal(personal_str, horas_imputadas, df_tarifas)
-                                if coste_p > 0:
-                                    nuevos_partes_costes.append({
-                                        "Fecha": datos_parte.get("Fecha", fecha_hoy), 
-                                        "Proyecto": obra_actual, 
-                                        "Tarea": datos_parte.get("Tarea", ""),
-                                        "Concepto": f"Mano de obra ({datos_parte.get('Descripción_Tarea', '')}): {personal_str}", 
-                                        "Coste_Total": coste_p
-                                    })
-                                
-                                # Sumar horas para el chivato (separamos por "y" o comas)
-                                nombres_limpios = [n.strip() for n in re.split(r',| y | e ', personal_str) if n.strip()]
-                                for nombre in nombres_limpios:
-                                    horas_trabajadores[nombre] = horas_trabajadores.get(nombre, 0.0) + horas_imputadas
+                            filas_diario, filas_costes, horas_trabajadores = partes_desde_ia(
+                                lista_partes, obra_actual, tarea['nombre'], fecha_hoy, df_tarifas)
 
-                            st.success(f"✅ Procesado con éxito: {tarea['nombre']} ({len(lista_partes)} líneas generadas)")
+                            filas_por_tarea[i] = (filas_diario, filas_costes)
+                            origen_resultado = " · recuperado de caché" if desde_cache else ""
+                            st.success(f"✅ Procesado con éxito: {tarea['nombre']} ({len(lista_partes)} líneas generadas{origen_resultado})")
                             
                             # EL CHIVATO DE HORAS INCOMPLETAS
-                            for trabajador, horas_totales in horas_trabajadores.items():
-                                if 0.0 < horas_totales < 8.0:
-                                    horas_faltantes = 8.0 - horas_totales
-                                    st.warning(f"⚠️ **¡Ojo con {trabajador}!** Le has imputado {horas_totales}h. Te faltan por justificar **{horas_faltantes}h** de su jornada.")
-                                elif horas_totales > 8.0:
+                            for trabajador, horas_totales, diferencia in avisos_jornada(horas_trabajadores):
+                                if diferencia < 0:
+                                    st.warning(f"⚠️ **¡Ojo con {trabajador}!** Le has imputado {horas_totales}h. Te faltan por justificar **{-diferencia}h** de su jornada.")
+                                else:
                                     st.info(f"⏱️ Nota: A {trabajador} se le han imputado {horas_totales}h (tiene horas extra).")
                             
                             with st.expander(f"Ver desglose de líneas extraídas"):
@@ -394,84 +488,62 @@ if vista_activa == "Gestión de Obras (Diario)":
                                 
                         except Exception as e:
                             st.error(f"❌ Error procesando {tarea['nombre']}: {e}")
+
+                    for i in sorted(filas_por_tarea):
+                        nuevos_partes_diario.extend(filas_por_tarea[i][0])
+                        nuevos_partes_costes.extend(filas_por_tarea[i][1])
                             
                     # --- GUARDADO EN LOTE AL FINALIZAR ---
                     if nuevos_partes_diario:
-                        df_diario = pd.concat([df_diario, pd.DataFrame(nuevos_partes_diario)], ignore_index=True)
-                        guardar_datos("Diario", df_diario, url_obra)
+                        anexar_datos("Diario", pd.DataFrame(nuevos_partes_diario), url_obra)
                         
                     if nuevos_partes_costes:
-                        df_costes = pd.concat([df_costes, pd.DataFrame(nuevos_partes_costes)], ignore_index=True)
-                        guardar_datos("Costes_Imputados", df_costes, url_obra)
+                        anexar_datos("Costes_Imputados", pd.DataFrame(nuevos_partes_costes), url_obra)
 
 # ==========================================
 # 2. COSTES Y RENDIMIENTOS
 # ==========================================
-elif vista_activa == "Costes y Rendimientos":
+@modulo("Costes y Rendimientos", obra=["Diario", "Costes_Imputados"], maestro=["Tarifas_Personal_Maquinaria"])
+def modulo_costes(d):
     st.title("Análisis de Costes Imputados")
     
-    df_diario = cargar_datos("Diario", url_obra)
-    df_imputados = cargar_datos("Costes_Imputados", url_obra)
-    df_tarifas = cargar_datos("Tarifas_Personal_Maquinaria", URL_MAESTRO)
+    df_diario = d["Diario"]
+    df_imputados = d["Costes_Imputados"]
+    df_tarifas = d["Tarifas_Personal_Maquinaria"]
     
     if df_diario.empty and df_imputados.empty:
         st.info("Sin registros de costes en este proyecto.")
     else:
-        df_obra = df_diario.copy()
-        resumen_personal = pd.DataFrame(columns=['Tarea', 'Gasto_Personal'])
-        if not df_obra.empty and not df_tarifas.empty:
-            df_obra['Horas_Personal'] = pd.to_numeric(df_obra['Horas_Personal'], errors='coerce').fillna(0)
-            df_obra['Gasto_Personal_Total'] = df_obra.apply(lambda row: calcular_coste_personal(row['Personal'], row['Horas_Personal'], df_tarifas), axis=1)
-            resumen_personal = df_obra.groupby('Tarea').agg(Gasto_Personal=('Gasto_Personal_Total', 'sum')).reset_index()
-
-        df_solo_materiales = df_imputados[~df_imputados['Concepto'].str.contains('Mano de obra', case=False, na=False)] if not df_imputados.empty else pd.DataFrame()
-        resumen_materiales = df_solo_materiales.groupby('Tarea').agg(Gasto_Materiales=('Coste_Total', 'sum')).reset_index() if not df_solo_materiales.empty else pd.DataFrame()
-
-        if not resumen_personal.empty or not resumen_materiales.empty:
-            resumen_final = pd.merge(resumen_personal, resumen_materiales, on='Tarea', how='outer').fillna(0)
-            resumen_final['Coste_Total_Partida'] = resumen_final['Gasto_Personal'] + resumen_final['Gasto_Materiales']
-            st.dataframe(resumen_final.style.format({"Gasto_Personal": "{:.2f} €", "Gasto_Materiales": "{:.2f} €", "Coste_Total_Partida": "{:.2f} €"}), use_container_width=True)
+        with medir("resumen_costes", filas=len(df_diario) + len(df_imputados)):
+            resumen_final = resumen_costes_por_tarea(df_diario, df_imputados, df_tarifas)
+        if not resumen_final.empty:
+            st.dataframe(resumen_final.style.format({"Gasto_Personal": "{:.2f} €", "Gasto_Maquinaria": "{:.2f} €", "Gasto_Materiales": "{:.2f} €", "Coste_Total_Partida": "{:.2f} €"}), use_container_width=True)
 
 # ==========================================
 # 3. INFORME EJECUTIVO (FINANZAS)
 # ==========================================
-elif vista_activa == "Informe Ejecutivo (Finanzas)":
+@modulo("Informe Ejecutivo (Finanzas)", obra=["Codigos_Control", HOJA_RESUMEN])
+def modulo_informe(d):
     st.title("Informe Ejecutivo y Curva de Evolución")
     
-    df_codigos = cargar_datos("Codigos_Control", url_obra)
-    df_pto = cargar_datos("Presupuesto_Base", url_obra)
-    df_cert = cargar_datos("Certificaciones_Ingresos", url_obra)
+    df_codigos = d["Codigos_Control"]
+    # Totales por Cod_Control ya calculados (se actualizan al importar presupuesto o certificación)
+    df_resumen = d[HOJA_RESUMEN]
+    # El botón se dibuja siempre (con el resumen vacío el "or" no llegaría a evaluarlo)
+    recalcular = st.button("Recalcular resumen desde Presupuesto y Certificaciones")
+    # Vacío: se construye una vez por sesión y obra (sin presupuesto seguiría vacío y
+    # se volvería a descargar en cada rerun; importar presupuesto ya lo construye)
+    clave_resumen = f"resumen_construido_{url_obra}"
+    if (df_resumen.empty and clave_resumen not in st.session_state) or recalcular:
+        # Con el bloqueo del resumen: no pisa lo que anote una certificación a la vez
+        df_resumen = datos.recalcular_resumen(url_obra)
+        st.session_state[clave_resumen] = True
     
-    if df_codigos.empty or df_pto.empty:
+    if df_codigos.empty or df_resumen.empty:
         st.warning("Estructura de presupuesto o códigos incompleta.")
     else:
-        df_pto_obra = df_pto.copy()
-        df_cert_obra = df_cert.copy() if not df_cert.empty else pd.DataFrame()
-        
-        df_codigos['Cod_Control'] = df_codigos['Cod_Control'].astype(str).replace(r'\.0$', '', regex=True).str.strip()
-        df_pto_obra['Cod_Control'] = df_pto_obra['Cod_Control'].astype(str).replace(r'\.0$', '', regex=True).str.strip()
-        
-        df_pto_obra['Coste'] = pd.to_numeric(df_pto_obra['Coste'], errors='coerce').fillna(0)
-        df_pto_obra['Cantidad_Proyecto'] = pd.to_numeric(df_pto_obra['Cantidad_Proyecto'], errors='coerce').fillna(0)
-        df_pto_obra['Importe_Total_Adjudicado'] = pd.to_numeric(df_pto_obra['Importe_Total_Adjudicado'], errors='coerce').fillna(0)
-        df_pto_obra['Coste_Total_Fila'] = df_pto_obra['Coste'] * df_pto_obra['Cantidad_Proyecto']
-        
-        resumen_pto = df_pto_obra.groupby('Cod_Control').agg(
-            Coste_Presupuestado=('Coste_Total_Fila', 'sum'),
-            Presupuesto_Adjudicado=('Importe_Total_Adjudicado', 'sum')
-        ).reset_index()
-
-        meses_certificados = [col for col in df_cert_obra.columns if col.startswith("Importe_Mes_")]
-        
-        resumen_cert = pd.DataFrame(columns=['Cod_Control', 'Total_Certificado'])
-        if not df_cert_obra.empty and meses_certificados:
-            df_cert_obra['Cod_Control'] = df_cert_obra['Cod_Control'].astype(str).replace(r'\.0$', '', regex=True).str.strip()
-            df_cert_obra['Total_Certificado_Calculado'] = df_cert_obra[meses_certificados].apply(pd.to_numeric, errors='coerce').sum(axis=1)
-            resumen_cert = df_cert_obra.groupby('Cod_Control').agg(Total_Certificado=('Total_Certificado_Calculado', 'sum')).reset_index()
-
-        informe_final = df_codigos.merge(resumen_pto, on='Cod_Control', how='left').merge(resumen_cert, on='Cod_Control', how='left').fillna(0)
-        informe_final['% Certificado'] = (informe_final['Total_Certificado'] / informe_final['Presupuesto_Adjudicado']) * 100
-        informe_final['% Certificado'] = informe_final['% Certificado'].replace([float('inf'), -float('inf')], 0)
+        with medir("informe_ejecutivo", filas=len(df_resumen)):
+            informe_final = informe_desde_resumen(df_codigos, df_resumen)
         
         st.markdown("### Estado General EDT")
         st.dataframe(
@@ -497,24 +569,18 @@ elif vista_activa == "Informe Ejecutivo (Finanzas)":
 
         st.markdown("---")
         st.markdown("### Evolución de Certificaciones")
-        if not df_cert_obra.empty and meses_certificados:
-            datos_grafica = {}
-            acumulado = 0
-            for mes_col in sorted(meses_certificados, key=lambda x: int(x.split('_')[2])):
-                nombre_mes = mes_col.replace("Importe_", "").replace("_", " ")
-                total_mes = pd.to_numeric(df_cert_obra[mes_col], errors='coerce').sum()
-                acumulado += total_mes
-                datos_grafica[nombre_mes] = acumulado
-                
-            df_evolucion = pd.DataFrame(list(datos_grafica.items()), columns=['Mes', 'Certificado Acumulado']).set_index('Mes')
-            st.line_chart(df_evolucion, y='Certificado Acumulado')
+        if columnas_meses(df_resumen):
+            with medir("grafica_evolucion", filas=len(df_resumen)):
+                df_evolucion = evolucion_certificaciones(df_resumen)
+                st.line_chart(df_evolucion, y='Certificado Acumulado')
         else:
             st.info("No hay datos de certificaciones para generar la gráfica.")
 
 # ==========================================
 # 4. IMPORTAR PRESUPUESTO
 # ==========================================
-elif vista_activa == "Importar Presupuesto":
+@modulo("Importar Presupuesto")
+def modulo_importar_presupuesto(d):
     st.title("Importación de Presupuesto Base")
     archivo_excel = st.file_uploader("Subir Archivo de Presupuesto (.xlsx)", type=['xlsx', 'xls'])
     if archivo_excel:
@@ -544,86 +610,49 @@ elif vista_activa == "Importar Presupuesto":
             
             if st.form_submit_button("Procesar Datos"):
                 try:
-                    def letra_idx(letra): return ord(letra) - 65
-                    filas_procesadas = []
-                    for hoja in hojas_pto:
-                        df_h = pd.read_excel(xls, sheet_name=hoja, header=None)
-                        capitulo_actual = "Sin Capítulo"
-                        
-                        idx_c = letra_idx(map_codigo)
-                        idx_u = letra_idx(map_unidad)
-                        idx_t = letra_idx(map_texto)
-                        idx_can = letra_idx(map_cant)
-                        idx_p = letra_idx(map_precio)
-                        idx_cost = letra_idx(map_coste) if map_coste != "No disponible" else -1
-                        idx_cc = letra_idx(map_cod_control) if map_cod_control != "No disponible" else -1
-                        
-                        for index, row in df_h.iterrows():
-                            if len(row) <= max(idx_c, idx_u, idx_t, idx_can, idx_p): continue
-                            
-                            codigo_val = str(row[idx_c]).strip() if pd.notna(row[idx_c]) else ""
-                            if codigo_val.endswith('.0'): codigo_val = codigo_val[:-2]
-
-                            texto_val = str(row[idx_t]).strip() if pd.notna(row[idx_t]) else ""
-                            precio_raw = str(row[idx_p]).replace(".", "").replace(",", ".") if isinstance(row[idx_p], str) else row[idx_p]
-                            precio_val = pd.to_numeric(precio_raw, errors='coerce')
-                            
-                            if codigo_val.lower() == "nan": codigo_val = ""
-                            if texto_val.lower() == "nan": texto_val = ""
-                            if "código" in codigo_val.lower() or "codigo" in codigo_val.lower(): continue
-                            
-                            cod_control_asignado = ""
-                            if idx_cc != -1 and len(row) > idx_cc:
-                                cc_raw = str(row[idx_cc]).strip() if pd.notna(row[idx_cc]) else ""
-                                if cc_raw.endswith('.0'): cc_raw = cc_raw[:-2]
-                                if cc_raw.lower() != "nan": cod_control_asignado = cc_raw
-                            
-                            if codigo_val and texto_val and pd.isna(precio_val):
-                                capitulo_actual = texto_val
-                            elif codigo_val and pd.notna(precio_val):
-                                cantidad = pd.to_numeric(row[idx_can], errors='coerce')
-                                if pd.isna(cantidad): cantidad = 0.0
-                                
-                                coste = 0.0
-                                if idx_cost != -1 and len(row) > idx_cost:
-                                    coste_val = pd.to_numeric(row[idx_cost], errors='coerce')
-                                    if pd.notna(coste_val): coste = coste_val
-                                
-                                pr_pres = float(precio_val)
-                                precio_licitacion = pr_pres * (1 + (gg_bi / 100.0))
-                                precio_adjudicado = precio_licitacion * (1 - (baja / 100.0))
-                                importe_total = cantidad * precio_adjudicado
-                                
-                                filas_procesadas.append({
-                                    "Cod_Control": cod_control_asignado, "Capítulo": capitulo_actual,
-                                    "Partida_Codigo": codigo_val, "Partida_Nombre": texto_val, 
-                                    "Partida_Descripcion": texto_val, "Unidad": str(row[idx_u]) if pd.notna(row[idx_u]) and str(row[idx_u]) != "nan" else "",
-                                    "Cantidad_Proyecto": cantidad, "PrPres": pr_pres,
-                                    "Precio_Licitacion": precio_licitacion, "Precio_Adjudicado": precio_adjudicado,
-                                    "Coste": coste, "Importe_Total_Adjudicado": importe_total
-                                })
-                            elif not codigo_val and pd.isna(precio_val) and texto_val:
-                                if filas_procesadas: filas_procesadas[-1]["Partida_Descripcion"] += "\n" + texto_val
-                                
-                    st.session_state.df_importacion = pd.DataFrame(filas_procesadas)
-                    st.success("Datos procesados correctamente.")
+                    idx_cols = indices_columnas(map_codigo, map_unidad, map_texto, map_cant, map_precio, map_coste, map_cod_control)
+                    # Una pestaña por proceso; se ensamblan en el orden elegido
+                    with medir("parsear_presupuesto", hojas=len(hojas_pto), bytes=archivo_excel.size) as m:
+                        df_pto_nuevo, errores_hojas = parsear_presupuesto_paralelo(
+                            archivo_excel.getvalue(), hojas_pto, idx_cols, gg_bi, baja, sufijo=os.path.splitext(archivo_excel.name)[1])
+                        m["filas"], m["errores"] = len(df_pto_nuevo), len(errores_hojas)
+                    if errores_hojas:
+                        for hoja_error, error in errores_hojas.items():
+                            st.error(f"No se ha podido leer la pestaña '{hoja_error}': {error}")
+                        st.warning("Presupuesto no procesado: corrige o deselecciona las pestañas con error.")
+                        descartar_importacion('importacion_pto')
+                    else:
+                        preparar_importacion('importacion_pto', df_pto_nuevo, "presupuesto")
+                        st.success("Datos procesados correctamente.")
                 except Exception as e:
                     st.error(f"Error procesando: {e}")
 
-        if 'df_importacion' in st.session_state and not st.session_state.df_importacion.empty:
-            st.dataframe(st.session_state.df_importacion.head(50), use_container_width=True)
+        id_pto = importacion_preparada('importacion_pto')
+        if id_pto is not None and importaciones.filas(id_pto) > 0:
+            vista_previa_importacion(id_pto, 'importacion_pto')
             if st.button("Confirmar y Subir a BD", type="primary"):
-                guardar_datos("Presupuesto_Base", st.session_state.df_importacion, url_obra)
+                df_pto_importado = importaciones.leer(id_pto)
+                guardar_datos("Presupuesto_Base", df_pto_importado, url_obra)
+                actualizar_resumen_cod_control(url_obra, df_pto=df_pto_importado)
                 st.success("Presupuesto guardado con éxito.")
-                del st.session_state['df_importacion']
+                descartar_importacion('importacion_pto')
 
 # ==========================================
 # 4.1 IMPORTAR CERTIFICACIÓN (Memoria Secuencial)
 # ==========================================
-elif vista_activa == "Importar Certificación":
+@modulo("Importar Certificación", obra=["Certificaciones_Ingresos"])
+def modulo_importar_certificacion(d):
     st.title("Importación de Certificación de Producción")
     st.markdown("Macheo contra Presupuesto Base. (Filtro inteligente y mapeo 1 a 1 de capítulos idénticos).")
     
+    # Hojas antiguas con columnas Cantidad_Mes_N / Importe_Mes_N: se pasan a una fila por partida y mes
+    df_cert_guardada = d["Certificaciones_Ingresos"]
+    if not df_cert_guardada.empty and es_formato_ancho(df_cert_guardada):
+        st.info("Las certificaciones de esta obra están en el formato antiguo (dos columnas por mes). Se convertirán al guardar la próxima certificación.")
+        if st.button("Convertir ahora al formato mensual"):
+            df_cert_largo, _ = datos.confirmar("Certificaciones_Ingresos", url_obra, a_formato_largo)
+            st.success(f"Certificaciones convertidas: {len(df_cert_largo)} filas (partida × mes).")
+
     archivo_cert = st.file_uploader("Subir Archivo de Certificación (.xlsx o .csv)", type=['xlsx', 'xls', 'csv'])
     if archivo_cert:
         if archivo_cert.name.endswith('.csv'):
@@ -648,7 +677,7 @@ elif vista_activa == "Importar Certificación":
             
             if st.form_submit_button("Validar Certificación"):
                 df_pto = cargar_datos("Presupuesto_Base", url_obra)
-                df_cert_db = cargar_datos("Certificaciones_Ingresos", url_obra)
+                df_cert_db = df_cert_guardada
 
                 if df_pto.empty:
                     st.error("Presupuesto Base no encontrado. Importación abortada.")
@@ -666,129 +695,58 @@ elif vista_activa == "Importar Certificación":
 
                     df_base = df_pto[['Cod_Control', 'Capítulo', 'Partida_Codigo', 'Partida_Nombre', 'Unidad', 'Precio_Adjudicado']].copy()
                     
-                    if not df_cert_db.empty and 'Partida_Codigo' in df_cert_db.columns:
-                        cols_historicas = [c for c in df_cert_db.columns if c.startswith("Cantidad_Mes_") or c.startswith("Importe_Mes_")]
-                        if cols_historicas:
-                            df_hist = df_cert_db[['Partida_Codigo'] + cols_historicas].drop_duplicates(subset=['Partida_Codigo'])
-                            df_base = df_base.merge(df_hist, on='Partida_Codigo', how='left')
-                            for c in cols_historicas:
-                                df_base[c] = df_base[c].fillna(0.0)
-
-                    col_cant_mes = f"Cantidad_Mes_{mes_cert}"
-                    col_imp_mes = f"Importe_Mes_{mes_cert}"
-                    df_base[col_cant_mes] = 0.0
-                    df_base[col_imp_mes] = 0.0
-
-                    pto_codigos = df_base['Partida_Codigo'].astype(str).replace(r'\.0$', '', regex=True).str.strip().tolist()
-                    
-                    def limpiar_texto(texto):
-                        if pd.isna(texto): return ""
-                        t = str(texto).lower().replace("\n", " ").replace("\r", " ")
-                        t = unicodedata.normalize('NFKD', t).encode('ASCII', 'ignore').decode('utf-8')
-                        t = re.sub(r'[.,;:_\-]', ' ', t)
-                        return " ".join(t.split())
-                        
-                    pto_nombres = df_base['Partida_Nombre'].apply(limpiar_texto).tolist()
+                    # Cantidad ya certificada a origen antes de este mes, por partida
+                    cantidad_previa = cantidad_anterior(a_formato_largo(df_cert_db), mes_cert)
 
-                    huerfanas = []
-                    encontradas = 0
-                    
-                    # --- EL BLOQUEO DE MEMORIA ---
-                    lineas_usadas = set()
-
-                    for index, row in df_excel.iterrows():
-                        if len(row) <= max(letra_idx(map_cod), letra_idx(map_nom), letra_idx(map_can)): continue
-
-                        if map_nat != "Omitir":
-                            idx_nat = letra_idx(map_nat)
-                            if len(row) > idx_nat and pd.notna(row[idx_nat]):
-                                nat_val = str(row[idx_nat]).strip().lower()
-                                if "capítulo" in nat_val or "capitulo" in nat_val:
-                                    continue 
-
-                        cod_val = str(row[letra_idx(map_cod)]).strip() if pd.notna(row[letra_idx(map_cod)]) else ""
-                        if cod_val.endswith('.0'): cod_val = cod_val[:-2]
-                        nom_val = str(row[letra_idx(map_nom)]).strip() if pd.notna(row[letra_idx(map_nom)]) else ""
-                        can_raw = str(row[letra_idx(map_can)]).replace(".", "").replace(",", ".") if isinstance(row[letra_idx(map_can)], str) else row[letra_idx(map_can)]
-                        can_val = pd.to_numeric(can_raw, errors='coerce')
-
-                        if pd.isna(can_val) or can_val == 0: continue
-                        if "código" in cod_val.lower() or "codigo" in cod_val.lower() or "cancert" in cod_val.lower(): continue
-                        if "pptoagrupado" in cod_val.lower() or "pptoagrupado" in nom_val.lower(): continue
-                        if cod_val == "" and (nom_val == "" or nom_val.replace(".", "").replace(",", "").isnumeric()): continue
-
-                        nom_val_norm = limpiar_texto(nom_val)
-                        match_idx = -1
-
-                        # 1. Búsqueda exacta por Código (Ignorando las ya usadas)
-                        if cod_val:
-                            for i, c in enumerate(pto_codigos):
-                                if c == cod_val and i not in lineas_usadas:
-                                    match_idx = i
-                                    break
-                                    
-                        # 2. Búsqueda exacta por Nombre Normalizado
-                        if match_idx == -1 and nom_val_norm:
-                            for i, n in enumerate(pto_nombres):
-                                if n == nom_val_norm and i not in lineas_usadas:
-                                    match_idx = i
-                                    break
-                                    
-                        # 3. Búsqueda PARCIAL
-                        if match_idx == -1 and nom_val_norm and len(nom_val_norm) > 4:
-                            for i, n in enumerate(pto_nombres):
-                                if n and len(n) > 4 and (nom_val_norm in n or n in nom_val_norm) and i not in lineas_usadas:
-                                    match_idx = i
-                                    break
-                                    
-                        # 4. Fuzzy Matching
-                        if match_idx == -1 and nom_val_norm:
-                            indices_disponibles = [i for i in range(len(pto_nombres)) if i not in lineas_usadas and pto_nombres[i]]
-                            nombres_disponibles = [pto_nombres[i] for i in indices_disponibles]
-                            if nombres_disponibles:
-                                coincidencias = difflib.get_close_matches(nom_val_norm, nombres_disponibles, n=1, cutoff=0.85)
-                                if coincidencias:
-                                    for i in indices_disponibles:
-                                        if pto_nombres[i] == coincidencias[0]:
-                                            match_idx = i
-                                            break
-
-                        if match_idx != -1:
-                            # Bloqueamos la línea para no sobrescribirla con capítulos siguientes
-                            lineas_usadas.add(match_idx)
-                            
-                            precio = pd.to_numeric(df_base.at[match_idx, 'Precio_Adjudicado'], errors='coerce')
-                            cant_mes_actual = can_val
-                            for m in range(1, mes_cert):
-                                col_ant = f"Cantidad_Mes_{m}"
-                                if col_ant in df_base.columns:
-                                    cant_mes_actual -= pd.to_numeric(df_base.at[match_idx, col_ant], errors='coerce')
-                                    
-                            df_base.at[match_idx, col_cant_mes] = cant_mes_actual
-                            df_base.at[match_idx, col_imp_mes] = cant_mes_actual * precio
-                            encontradas += 1
-                        else:
-                            huerfanas.append({"Código": cod_val, "Nombre Original": nom_val, "Cantidad": can_val})
+                    with medir("casar_certificacion", filas=len(df_excel), bytes=archivo_cert.size) as m:
+                        lineas_doc = lineas_certificacion(df_excel, letra_idx(map_cod), letra_idx(map_nom), letra_idx(map_can),
+                                                          letra_idx(map_nat) if map_nat != "Omitir" else -1)
+                        casadas, huerfanas = casar_certificacion(lineas_doc, df_base)
+                        m["casadas"], m["huerfanas"] = len(casadas), len(huerfanas)
 
                     if huerfanas:
                         st.error(f"Validación Fallida: {len(huerfanas)} partidas no registradas en el Presupuesto Base.")
                         st.dataframe(pd.DataFrame(huerfanas), use_container_width=True)
-                        if 'df_cert_importacion' in st.session_state: del st.session_state['df_cert_importacion']
+                        descartar_importacion('importacion_cert')
                     else:
-                        st.success(f"Validación Exitosa. {encontradas} partidas mapeadas secuencialmente.")
-                        st.session_state.df_cert_importacion = df_base
-
-        if 'df_cert_importacion' in st.session_state and not st.session_state.df_cert_importacion.empty:
+                        st.success(f"Validación Exitosa. {len(casadas)} partidas mapeadas secuencialmente.")
+                        # Se prepara lo certificado a origen por partida; lo del mes se vuelve a
+                        # calcular al guardar contra la pestaña de ese momento (la columna
+                        # Cantidad es solo la vista previa con lo leído ahora)
+                        df_origen = origen_certificacion(df_base, casadas)
+                        df_preparada = mes_desde_origen(df_origen, cantidad_previa, mes_cert).assign(
+                            Cantidad_Origen=df_origen['Cantidad_Origen'].to_numpy(), Precio=df_origen['Precio'].to_numpy())
+                        preparar_importacion('importacion_cert', df_preparada, "certificacion")
+                        # Versión de la hoja sobre la que se ha validado (para detectar guardados de otros usuarios)
+                        st.session_state.huella_cert_importacion = huella_hoja(df_cert_db)
+
+        id_cert = importacion_preparada('importacion_cert')
+        if id_cert is not None and importaciones.filas(id_cert) > 0:
+            vista_previa_importacion(id_cert, 'importacion_cert')
             if st.button("Confirmar y Guardar Certificación", type="primary"):
-                guardar_datos("Certificaciones_Ingresos", st.session_state.df_cert_importacion, url_obra)
+                df_origen_cert = importaciones.leer(id_cert)
+                mes_guardar = int(df_origen_cert['Mes'].iloc[0])
+                # Solo se envían las filas (partida × mes) que cambian, no la pestaña entera
+                plan_cert, rebase = datos.confirmar_diferencias(
+                    "Certificaciones_Ingresos", url_obra, lambda actual: plan_desde_origen(actual, df_origen_cert, mes_guardar),
+                    leida=st.session_state.get('huella_cert_importacion'))
+                actualizar_resumen_cod_control(url_obra, df_cert=plan_cert["resultado"])
+                if rebase:
+                    st.info("Otro usuario guardó certificaciones mientras validabas: se han conservado sus cambios y este mes se ha aplicado encima.")
+                if plan_cert["guardar"] is not None:
+                    st.caption(f"Pestaña reescrita entera ({len(plan_cert['guardar'])} filas): estaba en el formato antiguo o tenía filas repetidas.")
+                else:
+                    st.caption(f"Cambios enviados: {plan_cert['modificadas']} filas modificadas ({plan_cert['modificadas'] * len(VALORES_CERTIFICACION)} celdas) "
+                               f"y {plan_cert['nuevas']} nuevas · {plan_cert['sin_cambios']} sin cambios.")
                 st.success("Certificación registrada y volcada al Informe Ejecutivo.")
-                del st.session_state['df_cert_importacion']
+                descartar_importacion('importacion_cert')
 
 
 # ==========================================
 # 5. SUBCONTRATAS
 # ==========================================
-elif vista_activa == "Subcontratas":
+@modulo("Subcontratas")
+def modulo_subcontratas(d):
     st.title("Gestión de Subcontratas")
     with st.form("form_subcontratas"):
         c1, c2 = st.columns(2)
@@ -800,25 +758,24 @@ elif vista_activa == "Subcontratas":
         estado = c5.selectbox("Estado", ["En curso", "Finalizado", "Paralizado"])
         notas = st.text_area("Notas / Avance")
         if st.form_submit_button("Registrar"):
-            df_sub = cargar_datos("Subcontratas", url_obra)
             nueva_sub = pd.DataFrame([{
                 "Proyecto": obra_actual, "Gremio": gremio, "Empresa": empresa,
                 "Fecha_Inicio": f_inicio.strftime("%Y-%m-%d"), "Fecha_Fin_Prevista": f_fin.strftime("%Y-%m-%d"),
                 "Fecha_Fin_Real": "", "Estado": estado, "Avance_Notas": notas
             }])
-            df_sub = pd.concat([df_sub, nueva_sub], ignore_index=True)
-            guardar_datos("Subcontratas", df_sub, url_obra)
+            anexar_datos("Subcontratas", nueva_sub, url_obra)
             st.success("Registrado.")
 
 # ==========================================
 # 6. BASES GLOBALES (PRECIOS Y TARIFAS)
 # ==========================================
-elif vista_activa == "Base de Precios":
+@modulo("Base de Precios", maestro=["Historico_Precios"])
+def modulo_precios(d):
     st.title("Base de Precios Inteligente")
     st.markdown("Carga facturas, actualiza tu base de datos automáticamente y consulta con la IA.")
     
     # Descargamos la base de datos actual para comparar y para el chat
-    df_hist = cargar_datos("Historico_Precios", URL_MAESTRO)
+    df_hist = d["Historico_Precios"]
     
     tab_lector, tab_bd, tab_chat = st.tabs(["🧾 Lector de Facturas", "🗄️ Base de Datos Actual", "🤖 Asistente de Compras"])
     
@@ -834,30 +791,16 @@ elif vista_activa == "Base de Precios":
                         mime_type = "application/pdf" if archivo_factura.name.endswith('pdf') else "image/jpeg"
                         documento = {"mime_type": mime_type, "data": archivo_factura.getvalue()}
                         
-                        prompt_ia = """
-                        Eres un experto analista de compras para una constructora. Analiza esta factura.
-                        Extrae TODAS las líneas de productos facturados.
-                        Devuelve ÚNICAMENTE un array en formato JSON puro (sin comillas invertidas de markdown, sin la palabra json).
-                        Cada objeto del array debe tener EXACTAMENTE estas claves:
-                        - "Proveedor": nombre del emisor.
-                        - "Codigo_Producto": SKU o referencia (vacío si no hay).
-                        - "Descripcion": nombre exacto del producto.
-                        - "Precio_Unitario": número float (usa punto para decimales).
-                        - "Descuento": número float (porcentaje, 0 si no hay).
-                        - "Num_Factura": número de la factura.
-                        - "Fecha": fecha (YYYY-MM-DD).
-                        - "Obra": nombre de la obra o dirección de envío (vacío si no hay).
-                        """
-                        
-                        modelo = genai.GenerativeModel('gemini-2.5-flash')
-                        respuesta = modelo.generate_content([documento, prompt_ia])
+                        modelo = modelo_gemini(MODELO_IA, CLAVE_GEMINI)
+                        contenido_enviar = [documento, PROMPT_FACTURA]
                         
-                        # Limpiar posible formato markdown del JSON
-                        texto_json = respuesta.text.strip().replace("```json", "").replace("```", "")
-                        datos_factura = json.loads(texto_json)
+                        def llamada():
+                            respuesta = generar_contenido(modelo, contenido_enviar, request_options={"timeout": TIMEOUT_IA})
+                            return parsear_json_ia(respuesta.text)
+                        datos_factura, desde_cache = extraer_con_cache(cache_ia, MODELO_IA, contenido_enviar, llamada)
                         
                         st.session_state.df_factura_procesada = pd.DataFrame(datos_factura)
-                        st.success("¡Factura procesada con éxito!")
+                        st.success("¡Factura procesada con éxito!" + (" (resultado recuperado de caché)" if desde_cache else ""))
                         
                     except Exception as e:
                         st.error(f"Error al analizar la factura: {e}")
@@ -869,34 +812,9 @@ elif vista_activa == "Base de Precios":
                 
                 st.markdown("### Resultado de la Extracción")
                 
-                # Lógica de Macheo contra el histórico
+                # Lógica de Macheo contra el histórico (índice de últimos precios, una consulta por línea)
                 if not df_hist.empty:
-                    estados = []
-                    for _, row in df_fac.iterrows():
-                        desc_fac = str(row['Descripcion']).strip().lower()
-                        prov_fac = str(row['Proveedor']).strip().lower()
-                        precio_fac = float(row['Precio_Unitario'])
-                        dto_fac = float(row['Descuento'])
-                        
-                        # Buscar si existe en la BD (coincidencia de descripción y proveedor)
-                        match = df_hist[
-                            (df_hist['Descripcion'].astype(str).str.strip().str.lower() == desc_fac) &
-                            (df_hist['Proveedor'].astype(str).str.strip().str.lower() == prov_fac)
-                        ]
-                        
-                        if match.empty:
-                            estados.append("🟢 NUEVO")
-                        else:
-                            # Comprobamos si el precio o descuento han cambiado respecto al último registro
-                            precio_bd = float(match.iloc[-1]['Precio_Unitario'])
-                            dto_bd = float(match.iloc[-1]['Descuento'])
-                            
-                            if abs(precio_fac - precio_bd) > 0.01 or abs(dto_fac - dto_bd) > 0.01:
-                                estados.append(f"🟡 CAMBIO PRECIO (Antes: {precio_bd}€ / Dto: {dto_bd}%)")
-                            else:
-                                estados.append("⚪ SIN CAMBIOS")
-                                
-                    df_fac['Estado en BD'] = estados
+                    df_fac['Estado en BD'] = indice_precios(df_hist).clasificar(df_fac)
                 else:
                     df_fac['Estado en BD'] = "🟢 NUEVO (BD Vacía)"
                 
@@ -906,10 +824,16 @@ elif vista_activa == "Base de Precios":
                 if st.button("Confirmar y Guardar en Base de Datos Global", type="primary"):
                     # Quitamos la columna de estado para guardarlo limpio
                     df_guardar = df_fac.drop(columns=['Estado en BD'], errors='ignore')
-                    df_nuevo_hist = pd.concat([df_hist, df_guardar], ignore_index=True)
-                    guardar_datos("Historico_Precios", df_nuevo_hist, URL_MAESTRO)
-                    st.success("¡Artículos registrados correctamente en tu Base de Precios Global!")
-                    del st.session_state['df_factura_procesada']
+                    try:
+                        anexar_datos("Historico_Precios", df_guardar, URL_MAESTRO)
+                    except ValueError as e:
+                        # La factura trae columnas que el histórico no tiene
+                        st.error(f"No se ha guardado: {e}")
+                    else:
+                        # Solo se indexan las líneas recién añadidas
+                        indice_precios(cargar_datos("Historico_Precios", URL_MAESTRO))
+                        st.success("¡Artículos registrados correctamente en tu Base de Precios Global!")
+                        del st.session_state['df_factura_procesada']
 
     # --- PESTAÑA 2: BASE DE DATOS ACTUAL ---
     with tab_bd:
@@ -917,11 +841,12 @@ elif vista_activa == "Base de Precios":
         if df_hist.empty:
             st.info("La base de precios está vacía. Sube tu primera factura en la pestaña anterior.")
         else:
-            # Filtro rápido
+            # Filtro rápido (índice de palabras: proveedor, descripción, código, factura y obra)
             busqueda = st.text_input("Buscar producto o proveedor...")
             if busqueda:
-                mask = df_hist.apply(lambda row: row.astype(str).str.contains(busqueda, case=False, na=False).any(), axis=1)
-                st.dataframe(df_hist[mask], use_container_width=True)
+                posiciones, total = buscador_precios(df_hist).buscar(busqueda, limite=LIMITE_BUSQUEDA_PRECIOS)
+                st.caption(f"{total} coincidencias" + (f" (se muestran las {len(posiciones)} primeras)" if total > len(posiciones) else ""))
+                st.dataframe(df_hist.iloc[posiciones], use_container_width=True)
             else:
                 st.dataframe(df_hist, use_container_width=True)
 
@@ -937,21 +862,141 @@ elif vista_activa == "Base de Precios":
 # ==========================================
 # 6.2 TARIFAS (PERSONAL/MAQUINARIA)
 # ==========================================
-elif vista_activa == "Tarifas (Personal/Maquinaria)":
+@modulo("Tarifas (Personal/Maquinaria)", maestro=["Tarifas_Personal_Maquinaria"])
+def modulo_tarifas(d):
     st.title("Base de Datos Global: Costes Internos")
     st.markdown("Estas tarifas se aplicarán al cálculo de costes de **todas las obras**.")
+    df_ver_t = d["Tarifas_Personal_Maquinaria"]
     
     with st.form("form_tarifas_global"):
-        c1, c2, c3 = st.columns(3)
+        c1, c2, c3, c4 = st.columns(4)
         recurso = c1.text_input("Identificador")
         tipo = c2.selectbox("Clasificación", ["Personal", "Maquinaria"])
         coste = c3.number_input("Coste (€/h)", min_value=0.0, format="%.2f")
+        vigente_desde = c4.date_input("Vigente desde", value=datetime.today())
         if st.form_submit_button("Guardar Tarifa"):
-            df_tar = cargar_datos("Tarifas_Personal_Maquinaria", URL_MAESTRO) 
-            nueva_tarifa = pd.DataFrame([{"Recurso": recurso, "Tipo": tipo, "Coste_Hora": coste}])
-            df_tar = pd.concat([df_tar, nueva_tarifa], ignore_index=True)
-            guardar_datos("Tarifas_Personal_Maquinaria", df_tar, URL_MAESTRO)
-            st.success("Registrado.")
+            nueva_tarifa = pd.DataFrame([{"Recurso": recurso, "Tipo": tipo, "Coste_Hora": coste,
+                                          "Vigente_Desde": vigente_desde.strftime("%Y-%m-%d")}])
+            # ampliar: las hojas de tarifas anteriores no tienen la columna Vigente_Desde
+            anexar_datos("Tarifas_Personal_Maquinaria", nueva_tarifa, URL_MAESTRO, ampliar=True)
+            st.success("Registrado. Los partes anteriores conservan su coste hasta que se reimputen.")
+            df_ver_t = cargar_datos("Tarifas_Personal_Maquinaria", URL_MAESTRO)  # con la nueva (de la caché)
             
-    df_ver_t = cargar_datos("Tarifas_Personal_Maquinaria", URL_MAESTRO)
-    if not df_ver_t.empty: st.dataframe(df_ver_t, use_container_width=True)
\ No newline at end of file
+    if not df_ver_t.empty: st.dataframe(df_ver_t, use_container_width=True)
+
+    # --- REIMPUTACIÓN DE COSTES EN TODAS LAS OBRAS ---
+    st.markdown("---")
+    st.subheader("Reimputar costes con las tarifas vigentes")
+    st.markdown("Revalora las horas de personal y maquinaria de los diarios de **todas las obras activas** y guarda solo las imputaciones que cambian.")
+    reimputacion = trabajo("reimputacion_costes")
+    if st.button("Reimputar todas las obras", disabled=reimputacion is not None and reimputacion.activo):
+        obras_reimputar = list(zip(obras_activas['Nombre_Proyecto'], obras_activas['Enlace_Google_Sheet']))
+        reimputacion = lanzar_trabajo("reimputacion_costes", lambda avanzar: reimputar_obras(
+            obras_reimputar, datos, df_ver_t, CONCURRENCIA_CARTERA, avanzar))
+    if reimputacion is not None:
+        if reimputacion.activo:
+            st.progress(reimputacion.fraccion, text=f"{reimputacion.progreso} ({reimputacion.segundos:.0f} s)")
+            if st.button("Actualizar estado"):
+                st.rerun(scope="fragment")
+        elif reimputacion.error:
+            st.error(f"La reimputación ha fallado: {reimputacion.error}")
+        else:
+            resultado = reimputacion.resultado
+            st.success(f"Reimputación terminada en {reimputacion.segundos:.1f} s: {int(resultado['Modificadas'].sum())} modificadas, "
+                       f"{int(resultado['Anuladas'].sum())} anuladas y {int(resultado['Nuevas'].sum())} nuevas.")
+            st.dataframe(resultado, use_container_width=True)
+
+# ==========================================
+# 7. CARTERA DE OBRAS (INFORME GLOBAL)
+# ==========================================
+@modulo("Cartera de Obras")
+def modulo_cartera(d):
+    st.title("Informe Ejecutivo de Cartera")
+    st.markdown("Presupuesto, certificación y costes de todas las obras activas.")
+
+    obras_cartera = list(zip(obras_activas['Nombre_Proyecto'], obras_activas['Enlace_Google_Sheet']))
+    recargar = st.button("Recargar datos de todas las obras")
+    if recargar:
+        for _, url_c in obras_cartera:
+            cache_hojas.invalidar(url_c)
+
+    # Los filtros de abajo reutilizan el resumen mientras las pestañas de las obras
+    # sigan en caché sin cambios (sin caducar ni escritas por nadie)
+    claves_cartera = [(hoja, url_c) for _, url_c in obras_cartera for hoja in HOJAS_CARTERA]
+    copia = st.session_state.get("copia_cartera")
+    vigente = (copia is not None and copia[0] == tuple(obras_cartera)
+               and all(copia[1].get(clave) is not None and copia[1][clave] == datos.generacion(*clave) for clave in claves_cartera))
+    if recargar or not vigente:
+        generaciones = {}
+
+        def leer_cartera(hoja, url_c):
+            df, generaciones[(hoja, url_c)] = datos.leer_con_generacion(hoja, url_c)
+            return df
+
+        with st.spinner(f"Cargando {len(obras_cartera)} obras..."):
+            inicio_carga = datetime.now()
+            with medir("cargar_cartera", obras=len(obras_cartera)):
+                cargas = cargar_cartera(obras_cartera, leer_cartera, max_concurrencia=CONCURRENCIA_CARTERA)
+            segundos_carga = (datetime.now() - inicio_carga).total_seconds()
+        with medir("resumen_cartera", obras=len(cargas)):
+            por_obra, por_cod_control = resumen_cartera(cargas)
+        copia = st.session_state.copia_cartera = (tuple(obras_cartera), generaciones, por_obra, por_cod_control, segundos_carga)
+    _, _, por_obra, por_cod_control, segundos_carga = copia
+
+    con_error = por_obra[por_obra['Estado'] != "OK"]
+    st.caption(f"{len(por_obra)} obras cargadas en {segundos_carga:.1f} s" + (f" · {len(con_error)} con errores" if not con_error.empty else ""))
+    for _, fila in con_error.iterrows():
+        st.warning(f"{fila['Proyecto']}: {fila['Estado']}")
+
+    total_adj = por_obra['Presupuesto_Adjudicado'].sum()
+    total_cert = por_obra['Total_Certificado'].sum()
+    c1, c2, c3, c4 = st.columns(4)
+    c1.metric("Licitación (Coste Base)", f"{por_obra['Coste_Presupuestado'].sum():,.2f} €")
+    c2.metric("Adjudicación Total", f"{total_adj:,.2f} €")
+    c3.metric("Certificado a Origen", f"{total_cert:,.2f} €", f"{(total_cert / total_adj * 100) if total_adj > 0 else 0:.2f}% Avance")
+    c4.metric("Costes Imputados", f"{por_obra['Coste_Imputado'].sum():,.2f} €")
+
+    st.markdown("### Resumen por Obra")
+    st.dataframe(
+        por_obra.style.format({
+            "Presupuesto_Adjudicado": "{:,.2f} €", "Coste_Presupuestado": "{:,.2f} €",
+            "Total_Certificado": "{:,.2f} €", "% Avance": "{:.2f} %", "Coste_Imputado": "{:,.2f} €",
+            "Segundos_Carga": "{:.2f} s",
+        }, na_rep="-").bar(subset=['% Avance'], color='#5fba7d', vmax=100),
+        use_container_width=True, hide_index=True
+    )
+
+    st.markdown("### Detalle por Obra y Código de Control")
+    obras_filtro = st.multiselect("Obras", por_obra['Proyecto'].tolist())
+    detalle = por_cod_control[por_cod_control['Proyecto'].isin(obras_filtro)] if obras_filtro else por_cod_control
+    st.dataframe(
+        detalle.style.format({
+            "Coste_Presupuestado": "{:,.2f} €", "Presupuesto_Adjudicado": "{:,.2f} €",
+            "Total_Certificado": "{:,.2f} €", "% Avance": "{:.2f} %",
+        }),
+        use_container_width=True, hide_index=True
+    )
+
+# ==========================================
+# MÓDULO ACTIVO
+# ==========================================
+# Rerun completo (navegación, cambio de obra, barra lateral): el módulo vuelve a leer sus pestañas
+for clave in ("copia_modulo", "copia_cartera"):
+    st.session_state.pop(clave, None)
+ejecutar_modulo(vista_activa)
+
+# ==========================================
+# PANEL DE RENDIMIENTO (FINAL DEL RERUN)
+# ==========================================
+registro_tiempos.registrar(medicion_rerun)
+st.sidebar.markdown('<hr>', unsafe_allow_html=True)
+if st.sidebar.toggle("Panel de rendimiento", key="panel_rendimiento"):
+    with st.sidebar.expander("Rendimiento", expanded=True):
+        st.caption(f"Este rerun ({vista_activa}): {medicion_rerun.total_ms:,.0f} ms · {len(medicion_rerun.etapas)} mediciones")
+        st.dataframe(medicion_rerun.tabla(), use_container_width=True, hide_index=True)
+        st.caption("p50/p95 por vista (este proceso)")
+        st.dataframe(registro_tiempos.percentiles(), use_container_width=True, hide_index=True)
+        st.caption(f"p50/p95 por etapa en {vista_activa}")
+        st.dataframe(registro_tiempos.percentiles_etapas(vista_activa), use_container_width=True, hide_index=True)
+        if st.button("Percentiles del registro completo"):
+            st.dataframe(percentiles_registro(registro_tiempos.ficheros()), use_container_width=True, hide_index=True)
@@ -0,0 +1,64 @@
+import pandas as pd
+
+from gestion_obras.almacen import AlmacenLocal
+from gestion_obras.cache_hojas import CacheHojas
+from gestion_obras.certificacion import (
+    a_formato_largo, cantidad_anterior, certificacion_mes, mes_desde_origen, origen_certificacion, plan_desde_origen,
+)
+from gestion_obras.datos import AccesoDatos, huella_hoja
+
+URL = "https://docs.google.com/spreadsheets/d/PRUEBA/edit"
+
+
+def _presupuesto():
+    return pd.DataFrame({
+        'Cod_Control': ["1", "1", "2"],
+        'Capítulo': ["C1", "C1", "C2"],
+        'Partida_Codigo': ["1.01", "1.01", "2.01"],
+        'Partida_Nombre': ["Excavación", "Excavación", "Relleno"],
+        'Unidad': ["m3", "m3", "m3"],
+        'Precio_Adjudicado': [10.0, 10.0, 4.0],
+    })
+
+
+def test_clave_repetida_descuenta_lo_anterior_una_vez():
+    # La partida 1.01 aparece en dos líneas del presupuesto: el documento trae 4 + 6 a origen
+    historico = a_formato_largo(pd.DataFrame({
+        'Cod_Control': ["1", "2"], 'Partida_Codigo': ["1.01", "2.01"], 'Partida_Nombre': ["Excavación", "Relleno"],
+        'Mes': [1, 1], 'Cantidad': [7.0, 2.0], 'Importe': [70.0, 8.0],
+    }))
+    mes = certificacion_mes(_presupuesto(), [(0, 4.0), (1, 6.0), (2, 5.0)], cantidad_anterior(historico, 2), 2)
+
+    fila = mes.set_index('Partida_Codigo')
+    assert len(mes) == 2
+    assert fila.loc["1.01", 'Cantidad'] == 3.0
+    assert fila.loc["1.01", 'Importe'] == 30.0
+    assert fila.loc["2.01", 'Cantidad'] == 3.0
+    assert fila.loc["2.01", 'Importe'] == 12.0
+    assert (mes['Mes'] == 2).all()
+
+
+def test_rebase_descuenta_un_mes_anterior_guardado_por_otro_usuario(tmp_path):
+    datos = AccesoDatos(AlmacenLocal(str(tmp_path / "erp.sqlite")), CacheHojas())
+    hoja = "Certificaciones_Ingresos"
+    datos.guardar(hoja, a_formato_largo(pd.DataFrame({
+        'Cod_Control': ["1"], 'Partida_Codigo': ["1.01"], 'Partida_Nombre': ["Excavación"],
+        'Mes': [1], 'Cantidad': [2.0], 'Importe': [20.0],
+    })), URL)
+
+    # Se valida el mes 3 (10 a origen) cuando solo está guardado el mes 1
+    leida = datos.leer(hoja, URL)
+    df_origen = origen_certificacion(_presupuesto(), [(0, 10.0)])
+    assert mes_desde_origen(df_origen, cantidad_anterior(a_formato_largo(leida), 3), 3)['Cantidad'].tolist() == [8.0]
+
+    # Entretanto otro usuario guarda el mes 2 (5 a origen)
+    otro = origen_certificacion(_presupuesto(), [(0, 5.0)])
+    datos.confirmar_diferencias(hoja, URL, lambda actual: plan_desde_origen(actual, otro, 2))
+
+    _, rebase = datos.confirmar_diferencias(hoja, URL, lambda actual: plan_desde_origen(actual, df_origen, 3),
+                                            leida=huella_hoja(leida))
+    assert rebase
+    guardada = a_formato_largo(datos.almacen.leer(URL, hoja)).set_index('Mes')
+    assert guardada['Cantidad'].tolist() == [2.0, 3.0, 5.0]
+    assert guardada.loc[3, 'Cantidad_Origen'] == 10.0
+    assert guardada.loc[3, 'Importe'] == 50.0
@@ -0,0 +1,126 @@
+import pandas as pd
+
+from gestion_obras.almacen import AlmacenLocal
+from gestion_obras.cola_escritura import ColaEscritura, aplicar, combinar
+from gestion_obras.escritura import COLUMNA_FILA
+
+URL = "https://docs.google.com/spreadsheets/d/PRUEBA/edit"
+
+# Con este retardo el hilo de fondo no llega a enviar nada durante la prueba:
+# las pruebas llaman a sincronizar cuando quieren
+SIN_HILO = 3600
+
+
+class _DestinoCaido(AlmacenLocal):
+    # Falla al anexar en las pestañas indicadas, como Sheets sin conexión
+    def __init__(self, ruta, caidas):
+        super().__init__(ruta)
+        self.caidas = set(caidas)
+        self.llamadas = 0
+
+    def anexar(self, url, hoja, df_nuevas, ampliar=False):
+        self.llamadas += 1
+        if hoja in self.caidas:
+            raise ConnectionError("sin conexión")
+        return super().anexar(url, hoja, df_nuevas, ampliar)
+
+
+def _fila(**valores):
+    return pd.DataFrame([valores])
+
+
+def test_combinar_escritura_completa_absorbe_lo_anterior_y_lo_posterior():
+    ops = [
+        ("anexar", _fila(Fecha="2024-01-01", Importe=1.0)),
+        ("actualizar", pd.DataFrame({COLUMNA_FILA: [0], "Importe": [9.0]})),
+        ("escribir", pd.DataFrame({"Fecha": ["2024-02-01", "2024-02-02"], "Importe": [2.0, 3.0]})),
+        ("anexar", _fila(Fecha="2024-02-03", Importe=4.0)),
+        ("actualizar", pd.DataFrame({COLUMNA_FILA: [1], "Importe": [30.0]})),
+    ]
+    combinadas = combinar(ops)
+    assert [(tipo, cuantas) for tipo, _, cuantas in combinadas] == [("escribir", 5)]
+    assert combinadas[0][1]["Importe"].tolist() == [2.0, 30.0, 4.0]
+    # Mismo resultado que aplicarlas una a una
+    assert combinadas[0][1].equals(aplicar(pd.DataFrame(), [(t, df) for t, df in ops]))
+
+
+def test_combinar_sin_escritura_completa_junta_solo_lo_consecutivo():
+    ops = [
+        ("anexar", _fila(Fecha="2024-01-01", Importe=1.0)),
+        ("anexar", _fila(Fecha="2024-01-02", Importe=2.0)),
+        ("actualizar", pd.DataFrame({COLUMNA_FILA: [0], "Importe": [5.0]})),
+        ("actualizar", pd.DataFrame({COLUMNA_FILA: [0], "Importe": [6.0]})),
+        ("ampliar", _fila(Fecha="2024-01-03", Importe=3.0, Nota="x")),
+    ]
+    combinadas = combinar(ops)
+    assert [(tipo, cuantas) for tipo, _, cuantas in combinadas] == [("anexar", 2), ("actualizar", 2), ("ampliar", 1)]
+    assert combinadas[1][1].to_dict("records") == [{COLUMNA_FILA: 0, "Importe": 6.0}]
+
+
+def test_leer_aplica_lo_pendiente(tmp_path):
+    destino = AlmacenLocal(str(tmp_path / "erp.sqlite"))
+    destino.escribir(URL, "Diario", pd.DataFrame({"Fecha": ["2024-01-01"], "Horas": [8]}))
+    cola = ColaEscritura(str(tmp_path / "cola.sqlite"), destino, retardo=SIN_HILO)
+    cola.encolar(URL, "Diario", "anexar", _fila(Horas=6, Fecha="2024-01-02"))
+    cola.encolar(URL, "Diario", "actualizar", pd.DataFrame({COLUMNA_FILA: [0], "Horas": [7]}))
+    # Una columna que la hoja no tiene se enseña igualmente al leer
+    cola.encolar(URL, "Diario", "anexar", _fila(Fecha="2024-01-03", Horas=5, Nota="x"))
+
+    leido = cola.leer(URL, "Diario")
+    assert leido["Fecha"].tolist() == ["2024-01-01", "2024-01-02", "2024-01-03"]
+    assert leido["Horas"].tolist() == [7, 6, 5]
+    assert len(destino.leer(URL, "Diario")) == 1
+    # Pestaña que aún no existe en el destino: solo lo pendiente
+    cola.encolar(URL, "Nueva", "anexar", _fila(A=1))
+    assert cola.leer(URL, "Nueva").to_dict("records") == [{"A": 1}]
+
+
+def test_lo_pendiente_se_reenvia_al_arrancar(tmp_path):
+    ruta_cola = str(tmp_path / "cola.sqlite")
+    caido = _DestinoCaido(str(tmp_path / "erp.sqlite"), {"Diario"})
+    cola = ColaEscritura(ruta_cola, caido, retardo=SIN_HILO)
+    cola.encolar(URL, "Diario", "anexar", _fila(Fecha="2024-01-01", Horas=8))
+    cola.encolar(URL, "Diario", "anexar", _fila(Fecha="2024-01-02", Horas=6))
+    assert cola.sincronizar() == 1
+    assert cola.profundidad() == 2
+
+    # Otro proceso sobre el mismo diario, ya con conexión
+    destino = AlmacenLocal(str(tmp_path / "erp.sqlite"))
+    nueva = ColaEscritura(ruta_cola, destino, retardo=0.01)
+    assert nueva.esperar(timeout=10)
+    assert destino.leer(URL, "Diario")["Horas"].tolist() == [8, 6]
+
+
+def test_operacion_que_siempre_falla_pasa_a_descartadas(tmp_path):
+    caido = _DestinoCaido(str(tmp_path / "erp.sqlite"), {"Diario"})
+    cola = ColaEscritura(str(tmp_path / "cola.sqlite"), caido, retardo=SIN_HILO, max_intentos=3)
+    cola.encolar(URL, "Diario", "anexar", _fila(Fecha="2024-01-01", Horas=8))
+    cola.encolar(URL, "Costes_Imputados", "anexar", _fila(Fecha="2024-01-01", Coste=100.0))
+
+    for _ in range(3):
+        cola.sincronizar()
+    assert cola.profundidad() == 0
+    assert caido.llamadas == 4  # 3 intentos en Diario y 1 en Costes_Imputados
+    descartadas = cola.descartadas()
+    assert descartadas[["hoja", "tipo", "filas", "intentos"]].values.tolist() == [["Diario", "anexar", 1, 3]]
+    assert "ConnectionError" in descartadas["error"].iloc[0]
+    assert cola.estadisticas()["descartadas"] == 1
+    assert caido.leer(URL, "Costes_Imputados")["Coste"].tolist() == [100.0]
+
+
+def test_error_de_datos_se_descarta_sin_bloquear_la_pestana(tmp_path):
+    destino = AlmacenLocal(str(tmp_path / "erp.sqlite"))
+    destino.escribir(URL, "Diario", pd.DataFrame({"Fecha": ["2024-01-01"], "Horas": [8]}))
+    cola = ColaEscritura(str(tmp_path / "cola.sqlite"), destino, retardo=SIN_HILO)
+    cola.encolar(URL, "Diario", "anexar", _fila(Fecha="2024-01-02", Horas=6))
+    cola.encolar(URL, "Diario", "anexar", _fila(Fecha="2024-01-03", Horas=5, Nota="x"))
+    cola.encolar(URL, "Diario", "anexar", _fila(Fecha="2024-01-04", Horas=4))
+
+    # Juntas fallan; en la siguiente pasada van de una en una y solo se descarta la mala
+    assert cola.sincronizar() == 1
+    assert cola.sincronizar() == 0
+    assert cola.profundidad() == 0
+    assert destino.leer(URL, "Diario")["Horas"].tolist() == [8, 6, 4]
+    descartadas = cola.descartadas()
+    assert descartadas["intentos"].tolist() == [2]
+    assert "ValueError" in descartadas["error"].iloc[0]
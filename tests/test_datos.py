@@ -0,0 +1,113 @@
+import threading
+import time
+
+import pandas as pd
+
+from gestion_obras.almacen import AlmacenLocal
+from gestion_obras.cache_hojas import CacheHojas
+from gestion_obras.datos import AccesoDatos
+
+URL = "https://docs.google.com/spreadsheets/d/PRUEBA/edit"
+
+
+def _dos_accesos(tmp_path):
+    # Como dos sesiones de Streamlit: cada una construye su almacén y su AccesoDatos
+    ruta = str(tmp_path / "erp.sqlite")
+    return AccesoDatos(AlmacenLocal(ruta), CacheHojas()), AccesoDatos(AlmacenLocal(ruta), CacheHojas())
+
+
+def test_bloqueo_compartido_entre_instancias(tmp_path):
+    datos_a, datos_b = _dos_accesos(tmp_path)
+    dentro, salir = threading.Event(), threading.Event()
+
+    def retener():
+        with datos_a.bloqueo("Diario", URL):
+            dentro.set()
+            salir.wait(5)
+
+    hilo = threading.Thread(target=retener)
+    hilo.start()
+    dentro.wait(5)
+    esperando = threading.Event()
+    obtenido = threading.Event()
+
+    def entrar():
+        esperando.set()
+        with datos_b.bloqueo("Diario", URL):
+            obtenido.set()
+
+    otro = threading.Thread(target=entrar)
+    otro.start()
+    esperando.wait(5)
+    assert not obtenido.wait(0.2)
+    # Otra pestaña no espera
+    with datos_b.bloqueo("Costes_Imputados", URL):
+        pass
+    salir.set()
+    hilo.join(5)
+    otro.join(5)
+    assert obtenido.is_set()
+
+
+def test_confirmar_desde_dos_instancias_no_pierde_filas(tmp_path):
+    datos_a, datos_b = _dos_accesos(tmp_path)
+    datos_a.guardar("Subcontratas", pd.DataFrame({"Empresa": ["inicial"]}), URL)
+    confirmaciones = datos_a.confirmaciones
+
+    def anadir(datos, nombre):
+        def cambio(actual):
+            time.sleep(0.01)  # lectura-modificación-escritura lenta: sin bloqueo común se pisarían
+            return pd.concat([actual, pd.DataFrame({"Empresa": [nombre]})], ignore_index=True)
+        datos.confirmar("Subcontratas", URL, cambio)
+
+    hilos = [threading.Thread(target=anadir, args=(datos, f"{i}-{j}"))
+             for i, datos in enumerate((datos_a, datos_b)) for j in range(5)]
+    for hilo in hilos:
+        hilo.start()
+    for hilo in hilos:
+        hilo.join(30)
+
+    guardada = datos_a.almacen.leer(URL, "Subcontratas")
+    assert len(guardada) == 11
+    assert datos_b.confirmaciones == datos_a.confirmaciones == confirmaciones + 10
+
+
+def test_copia_de_modulo_caduca_con_la_cache(tmp_path):
+    ruta = str(tmp_path / "erp.sqlite")
+    cache = CacheHojas(ttl=60)
+    datos = AccesoDatos(AlmacenLocal(ruta), cache)
+    datos.guardar("Diario", pd.DataFrame({"Tarea": ["a"]}), URL)
+    claves = [("Diario", URL)]
+    cargadas, copia = datos.cargar_varias(claves)
+    # Sin cambios: la misma copia, sin pasar por la caché
+    assert datos.cargar_varias(claves, copia)[1][claves[0]] is copia[claves[0]]
+
+    # Escritura desde otra sesión (otro AccesoDatos sobre la misma caché del proceso)
+    otra = AccesoDatos(AlmacenLocal(ruta), cache)
+    otra.anexar("Diario", pd.DataFrame({"Tarea": ["b"]}), URL)
+    cargadas, copia = datos.cargar_varias(claves, copia)
+    assert len(cargadas[claves[0]]) == 2
+
+    # Escritura fuera del proceso: se ve en cuanto caduca la entrada de caché
+    AlmacenLocal(ruta).anexar(URL, "Diario", pd.DataFrame({"Tarea": ["c"]}))
+    assert len(datos.cargar_varias(claves, copia)[0][claves[0]]) == 2
+    cache.ttl = 0
+    assert len(datos.cargar_varias(claves, copia)[0][claves[0]]) == 3
+
+
+def test_recalcular_resumen_lee_lo_guardado_por_otra_sesion(tmp_path):
+    datos_a, datos_b = _dos_accesos(tmp_path)
+    datos_a.guardar("Presupuesto_Base", pd.DataFrame({
+        "Cod_Control": ["1"], "Coste": [2.0], "Cantidad_Proyecto": [10.0], "Importe_Total_Adjudicado": [100.0],
+    }), URL)
+    # La sesión B tiene en su caché la pestaña de certificaciones antes del guardado de A
+    assert datos_b.cargar("Certificaciones_Ingresos", URL).empty
+    datos_a.guardar("Certificaciones_Ingresos", pd.DataFrame({
+        "Cod_Control": ["1"], "Partida_Codigo": ["1.01"], "Partida_Nombre": ["Excavación"],
+        "Mes": [1], "Cantidad": [3.0], "Importe": [30.0], "Cantidad_Origen": [3.0], "Importe_Origen": [30.0],
+    }), URL)
+
+    resumen = datos_b.recalcular_resumen(URL)
+    assert resumen["Total_Certificado"].tolist() == [30.0]
+    assert resumen["Coste_Presupuestado"].tolist() == [20.0]
+    assert len(datos_a.almacen.leer(URL, "Resumen_Cod_Control")) == 1
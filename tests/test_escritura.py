@@ -0,0 +1,103 @@
+import pandas as pd
+import pytest
+
+from gestion_obras.almacen import AlmacenGSheets, AlmacenLocal
+from gestion_obras.escritura import anexar_en_hoja
+
+URL = "https://docs.google.com/spreadsheets/d/PRUEBA/edit"
+
+
+class _Pestana:
+    # Lo que anexar_en_hoja usa de una pestaña de gspread, sobre una lista de filas
+    def __init__(self, filas):
+        self.filas = [list(f) for f in filas]
+
+    @property
+    def col_count(self):
+        return max((len(f) for f in self.filas), default=0)
+
+    def row_values(self, fila):
+        return self.filas[fila - 1] if len(self.filas) >= fila else []
+
+    def add_cols(self, n):
+        pass
+
+    def update(self, values, range_name, value_input_option=None):
+        columna = ord(range_name[0]) - ord("A")
+        for i, valores in enumerate(values):
+            fila = int(range_name[1:]) - 1 + i
+            while len(self.filas) <= fila:
+                self.filas.append([])
+            self.filas[fila] = self.filas[fila][:columna] + [""] * (columna - len(self.filas[fila])) + list(valores)
+
+    def append_rows(self, values, value_input_option=None, table_range=None):
+        self.filas.extend(list(v) for v in values)
+
+
+class _Conexion:
+    # Sustituye a la conexión de st.connection: una pestaña como DataFrame
+    def __init__(self, df):
+        self.df = df
+
+    def read(self, spreadsheet, worksheet, ttl=0):
+        return self.df.copy()
+
+    def update(self, spreadsheet, worksheet, data):
+        self.df = data.copy()
+
+
+def _nuevas():
+    return pd.DataFrame([{"Importe": 5.0, "Fecha": "2024-03-01", "Concepto": "Zahorra"}])
+
+
+def test_anexar_en_hoja_respeta_el_orden_de_la_cabecera():
+    ws = _Pestana([["Fecha", "Concepto", "Importe"], ["2024-01-01", "Arena", 3.0]])
+    anexar_en_hoja(ws, _nuevas())
+    assert ws.filas == [["Fecha", "Concepto", "Importe"], ["2024-01-01", "Arena", 3.0], ["2024-03-01", "Zahorra", 5.0]]
+
+
+def test_anexar_en_hoja_rechaza_columnas_que_la_cabecera_no_tiene():
+    ws = _Pestana([["Fecha", "Importe"], ["2024-01-01", 3.0]])
+    with pytest.raises(ValueError, match="Concepto"):
+        anexar_en_hoja(ws, _nuevas())
+    assert ws.filas == [["Fecha", "Importe"], ["2024-01-01", 3.0]]
+
+    anexar_en_hoja(ws, _nuevas(), ampliar=True)
+    assert ws.filas == [["Fecha", "Importe", "Concepto"], ["2024-01-01", 3.0], ["2024-03-01", 5.0, "Zahorra"]]
+
+
+def test_anexar_en_hoja_vacia_pone_la_cabecera():
+    ws = _Pestana([])
+    anexar_en_hoja(ws, _nuevas())
+    assert ws.filas == [["Importe", "Fecha", "Concepto"], [5.0, "2024-03-01", "Zahorra"]]
+
+
+def test_anexar_local_con_cabecera_en_otro_orden_o_incompleta(tmp_path):
+    almacen = AlmacenLocal(str(tmp_path / "erp.sqlite"))
+    almacen.escribir(URL, "Gastos", pd.DataFrame([{"Fecha": "2024-01-01", "Concepto": "Arena", "Importe": 3.0}]))
+    almacen.anexar(URL, "Gastos", _nuevas())
+    leido = almacen.leer(URL, "Gastos")
+    assert list(leido.columns) == ["Fecha", "Concepto", "Importe"]
+    assert leido.iloc[-1].tolist() == ["2024-03-01", "Zahorra", 5.0]
+
+    extra = _nuevas().assign(Proveedor="Áridos Sur")
+    with pytest.raises(ValueError, match="Proveedor"):
+        almacen.anexar(URL, "Gastos", extra)
+    assert len(almacen.leer(URL, "Gastos")) == 2
+
+    almacen.anexar(URL, "Gastos", extra, ampliar=True)
+    leido = almacen.leer(URL, "Gastos")
+    assert list(leido.columns) == ["Fecha", "Concepto", "Importe", "Proveedor"]
+    assert leido["Proveedor"].tolist()[-1] == "Áridos Sur"
+
+
+def test_anexar_gsheets_sin_cuenta_de_servicio_reescribe_alineado():
+    conn = _Conexion(pd.DataFrame([{"Fecha": "2024-01-01", "Importe": 3.0}]))
+    almacen = AlmacenGSheets(conn)
+    with pytest.raises(ValueError, match="Concepto"):
+        almacen.anexar(URL, "Gastos", _nuevas())
+    assert len(conn.df) == 1
+
+    almacen.anexar(URL, "Gastos", _nuevas(), ampliar=True)
+    assert list(conn.df.columns) == ["Fecha", "Importe", "Concepto"]
+    assert conn.df.iloc[-1].tolist() == ["2024-03-01", 5.0, "Zahorra"]
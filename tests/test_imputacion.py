@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+
+from gestion_obras.almacen import AlmacenLocal
+from gestion_obras.cache_hojas import CacheHojas
+from gestion_obras.datos import AccesoDatos, huella_hoja
+from gestion_obras.escritura import COLUMNA_FILA
+from gestion_obras.imputacion import TarifasVigentes, _guardar_plan, plan_reimputacion
+
+URL = "https://docs.google.com/spreadsheets/d/PRUEBA/edit"
+
+
+def calcular_coste_personal(texto_personal, horas, df_tarifas):
+    # Copia de la valoración original (fila a fila, todas las tarifas)
+    if not texto_personal or horas <= 0 or df_tarifas.empty: return 0.0
+    texto_personal = str(texto_personal).lower()
+    costes = []
+    for _, tarifa in df_tarifas.iterrows():
+        nombre_tarifa = str(tarifa['Recurso']).lower()
+        if nombre_tarifa and nombre_tarifa != "nan" and nombre_tarifa in texto_personal:
+            costes.append(pd.to_numeric(tarifa['Coste_Hora'], errors='coerce'))
+    return sum(costes) * float(horas) if costes else 0.0
+
+
+def _costes(filas):
+    return pd.DataFrame(filas, columns=["Fecha", "Proyecto", "Tarea", "Concepto", "Coste_Total"])
+
+
+def test_plan_reimputacion_cambiadas_obsoletas_y_nuevas():
+    guardadas = _costes([
+        ["2024-01-02", "Obra", "T1", "Cemento", 100.0],
+        ["2024-01-02", "Obra", "T1", "Mano de obra (muro): José", 80.0],
+        ["2024-01-03", "Obra", "T2", "Mano de obra (zanja): Luis", 50.0],
+        ["2024-01-03", "Obra", "T2", "Maquinaria (zanja): retro", 0.0],
+        ["2024-01-04", "Obra", "T3", "Mano de obra (solera): Ana", 40.0],
+    ])
+    esperadas = _costes([
+        ["2024-01-02", "Obra", "T1", "Mano de obra (muro): José", 100.0],
+        ["2024-01-02", "Obra", "T1", "Maquinaria (muro): grúa", 60.0],
+        ["2024-01-04", "Obra", "T3", "Mano de obra (solera): Ana", 40.0],
+    ])
+    plan = plan_reimputacion(guardadas, esperadas)
+
+    # José cambia de precio; Luis ya no sale del diario y se deja a 0 (sin borrar la fila);
+    # la retro ya estaba a 0 y los materiales no se tocan
+    assert plan["actualizar"][COLUMNA_FILA].tolist() == [1, 2]
+    assert plan["actualizar"]["Coste_Total"].tolist() == [100.0, 0.0]
+    assert plan["anexar"]["Concepto"].tolist() == ["Maquinaria (muro): grúa"]
+    assert (plan["modificadas"], plan["anuladas"], plan["nuevas"], plan["sin_cambios"]) == (1, 1, 1, 1)
+
+
+def test_tarifas_repetidas_con_tipo_y_vigencia():
+    tarifas = TarifasVigentes(pd.DataFrame({
+        "Recurso": ["José", "jose", "José", "Retro", "Retro", "Ana"],
+        "Tipo": ["Personal", "Personal", "Personal", "Maquinaria", "Maquinaria", "Maquinaria"],
+        "Coste_Hora": [10.0, 7.0, 5.0, 30.0, 40.0, 99.0],
+        "Vigente_Desde": ["", "", "", "2024-01-01", "2024-06-01", ""],
+    }))
+    # Las dos filas de "José" sin fecha se suman; "jose" sin acento es otro recurso
+    # que no aparece en el texto; Ana es maquinaria y no cuenta como personal
+    personal = tarifas.valorar("Personal", ["José y Ana", "", "José"], [2.0, 8.0, 0.0])
+    assert personal.tolist() == [30.0, 0.0, 0.0]
+
+    # Cada parte con la tarifa vigente a su fecha (antes de la primera, sin coste)
+    fechas = ["2023-12-31", "2024-03-01", "2024-06-01", "2024-07-15", ""]
+    maquinaria = tarifas.valorar("Maquinaria", ["retro"] * 5, [1.0] * 5, fechas)
+    assert maquinaria.tolist() == [0.0, 30.0, 40.0, 40.0, 40.0]
+
+
+def test_guardar_plan_rehace_el_plan_si_la_hoja_se_movio(tmp_path):
+    datos = AccesoDatos(AlmacenLocal(str(tmp_path / "erp.sqlite")), CacheHojas())
+    datos.guardar("Costes_Imputados", _costes([
+        ["2024-01-02", "Obra", "T1", "Cemento", 100.0],
+        ["2024-01-02", "Obra", "T1", "Mano de obra (muro): José", 80.0],
+    ]), URL)
+    leida = huella_hoja(datos.leer("Costes_Imputados", URL))
+
+    # Otro usuario reescribe la pestaña con una fila más al principio: las posiciones se mueven
+    datos.guardar("Costes_Imputados", _costes([
+        ["2024-01-01", "Obra", "T0", "Arena", 20.0],
+        ["2024-01-02", "Obra", "T1", "Cemento", 100.0],
+        ["2024-01-02", "Obra", "T1", "Mano de obra (muro): José", 80.0],
+    ]), URL)
+
+    esperadas = _costes([["2024-01-02", "Obra", "T1", "Mano de obra (muro): José", 100.0]])
+    plan, rebase = _guardar_plan(datos, URL, leida, esperadas)
+
+    assert rebase
+    assert plan["actualizar"][COLUMNA_FILA].tolist() == [2]
+    guardada = datos.almacen.leer(URL, "Costes_Imputados")
+    assert guardada["Concepto"].tolist() == ["Arena", "Cemento", "Mano de obra (muro): José"]
+    assert np.allclose(pd.to_numeric(guardada["Coste_Total"]), [20.0, 100.0, 100.0])
+
+
+def test_guardar_plan_crea_la_hoja_si_no_existe(tmp_path):
+    datos = AccesoDatos(AlmacenLocal(str(tmp_path / "erp.sqlite")), CacheHojas())
+    esperadas = _costes([["2024-01-02", "Obra", "T1", "Mano de obra (muro): José", 100.0]])
+    plan, _ = _guardar_plan(datos, URL, None, esperadas)
+    assert plan["nuevas"] == 1
+    assert datos.almacen.leer(URL, "Costes_Imputados")["Concepto"].tolist() == ["Mano de obra (muro): José"]
+
+
+def test_valoracion_igual_que_la_original_sin_tipo_ni_vigencia():
+    rng = np.random.default_rng(7)
+    nombres = ["Juan", "juan pedro", "Ana", "Mariana", "José", "Pedro", "Luis", "Retro", "Dúmper", "Al"]
+    df_tarifas = pd.DataFrame({
+        # Con recursos repetidos y solapados ("Juan" dentro de "juan pedro", "Ana" dentro de "Mariana")
+        "Recurso": list(rng.choice(nombres, 40)) + [None, ""],
+        "Coste_Hora": list(rng.integers(5, 60, 40).astype(float)) + [10.0, 10.0],
+    })
+    textos = [", ".join(rng.choice(nombres, rng.integers(0, 4))) for _ in range(300)] + ["", None, "JUAN PEDRO y ana"]
+    horas = list(rng.choice([0.0, -1.0, 2.5, 4.0, 8.0], len(textos)))
+
+    esperado = [calcular_coste_personal(t, h, df_tarifas) for t, h in zip(textos, horas)]
+    assert np.allclose(TarifasVigentes(df_tarifas).valorar("Personal", textos, horas), esperado)
+
+
+def test_diferencias_con_la_valoracion_original():
+    # Tarifas con Tipo: la de maquinaria no valora el texto de personal (la original sí);
+    # horas ilegibles cuentan como 0 en lugar de dejar el coste en NaN
+    df_tarifas = pd.DataFrame({"Recurso": ["Juan", "Retro"], "Tipo": ["Personal", "Maquinaria"], "Coste_Hora": [20.0, 50.0]})
+    tarifas = TarifasVigentes(df_tarifas)
+    assert calcular_coste_personal("Juan y la retro", 2.0, df_tarifas) == 140.0
+    assert tarifas.valorar("Personal", ["Juan y la retro", "Juan"], [2.0, np.nan]).tolist() == [40.0, 0.0]
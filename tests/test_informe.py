@@ -0,0 +1,52 @@
+import pandas as pd
+import pandas.testing as pdt
+
+from gestion_obras.almacen import AlmacenLocal
+from gestion_obras.cache_hojas import CacheHojas
+from gestion_obras.datos import AccesoDatos
+from gestion_obras.informe import HOJA_RESUMEN, construir_resumen, resumen_con_certificacion, resumen_con_presupuesto
+
+URL = "https://docs.google.com/spreadsheets/d/PRUEBA/edit"
+
+
+def _presupuesto(filas):
+    return pd.DataFrame(filas, columns=["Cod_Control", "Coste", "Cantidad_Proyecto", "Importe_Total_Adjudicado"])
+
+
+def _certificacion(filas):
+    # Formato largo: (Cod_Control, Partida_Codigo, Mes, Importe)
+    df = pd.DataFrame(filas, columns=["Cod_Control", "Partida_Codigo", "Mes", "Importe"])
+    return df.assign(Partida_Nombre="", Cantidad=1.0)
+
+
+PTO_1 = _presupuesto([["1", 2.0, 10.0, 100.0], ["1", 1.0, 5.0, 50.0], ["2", 3.0, 4.0, 40.0], ["3", 1.0, 1.0, 10.0]])
+PTO_2 = _presupuesto([["1", 2.0, 12.0, 120.0], ["2", 3.0, 4.0, 40.0], ["4", 5.0, 1.0, 60.0]])
+CERT_1 = _certificacion([["1", "1.01", 1, 30.0], ["2", "2.01", 1, 8.0], ["2", "2.01", 2, 4.0]])
+CERT_2 = _certificacion([["1", "1.01", 1, 30.0], ["1", "1.01", 2, 25.0], ["2", "2.01", 1, 8.0], ["5", "5.01", 3, 7.0]])
+
+
+def test_resumen_con_presupuesto_igual_que_construir():
+    resumen = construir_resumen(PTO_1, CERT_1)
+    pdt.assert_frame_equal(resumen_con_presupuesto(resumen, PTO_2), construir_resumen(PTO_2, CERT_1))
+    # Partiendo de un resumen vacío (obra sin nada aún)
+    pdt.assert_frame_equal(resumen_con_presupuesto(construir_resumen(PTO_1.iloc[0:0], CERT_1.iloc[0:0]), PTO_1),
+                           construir_resumen(PTO_1, CERT_1.iloc[0:0]))
+
+
+def test_resumen_con_certificacion_igual_que_construir():
+    resumen = construir_resumen(PTO_1, CERT_1)
+    pdt.assert_frame_equal(resumen_con_certificacion(resumen, CERT_2), construir_resumen(PTO_1, CERT_2))
+    # Presupuesto y luego certificación, como al importar uno y certificar después
+    resumen = resumen_con_certificacion(resumen_con_presupuesto(resumen, PTO_2), CERT_2)
+    pdt.assert_frame_equal(resumen, construir_resumen(PTO_2, CERT_2))
+
+
+def test_recalcular_resumen_sin_presupuesto_no_escribe(tmp_path):
+    almacen = AlmacenLocal(str(tmp_path / "erp.sqlite"))
+    datos = AccesoDatos(almacen, CacheHojas())
+    assert datos.recalcular_resumen(URL).empty
+    assert not almacen.existe(URL, HOJA_RESUMEN)
+
+    datos.guardar("Presupuesto_Base", PTO_1, URL)
+    assert len(datos.recalcular_resumen(URL)) == 3
+    assert len(almacen.leer(URL, HOJA_RESUMEN)) == 3
@@ -0,0 +1,128 @@
+import difflib
+
+import numpy as np
+import pandas as pd
+
+from gestion_obras.certificacion import MacheadorPresupuesto, casar_certificacion, lineas_certificacion
+
+PALABRAS = ["excavacion", "zanja", "relleno", "hormigon", "armado", "muro", "solera", "forjado", "pintura",
+            "plastica", "ladrillo", "tabique", "yeso", "tubo", "pvc", "arqueta", "m3", "m2", "ha-25"]
+
+
+def _casar_original(pto_codigos, pto_nombres, lineas):
+    # Copia de las cuatro búsquedas originales con lineas_usadas
+    lineas_usadas = set()
+    resultado = []
+    for cod_val, nom_val_norm in lineas:
+        match_idx = -1
+        if cod_val:
+            for i, c in enumerate(pto_codigos):
+                if c == cod_val and i not in lineas_usadas:
+                    match_idx = i
+                    break
+        if match_idx == -1 and nom_val_norm:
+            for i, n in enumerate(pto_nombres):
+                if n == nom_val_norm and i not in lineas_usadas:
+                    match_idx = i
+                    break
+        if match_idx == -1 and nom_val_norm and len(nom_val_norm) > 4:
+            for i, n in enumerate(pto_nombres):
+                if n and len(n) > 4 and (nom_val_norm in n or n in nom_val_norm) and i not in lineas_usadas:
+                    match_idx = i
+                    break
+        if match_idx == -1 and nom_val_norm:
+            indices_disponibles = [i for i in range(len(pto_nombres)) if i not in lineas_usadas and pto_nombres[i]]
+            nombres_disponibles = [pto_nombres[i] for i in indices_disponibles]
+            if nombres_disponibles:
+                coincidencias = difflib.get_close_matches(nom_val_norm, nombres_disponibles, n=1, cutoff=0.85)
+                if coincidencias:
+                    for i in indices_disponibles:
+                        if pto_nombres[i] == coincidencias[0]:
+                            match_idx = i
+                            break
+        if match_idx != -1:
+            lineas_usadas.add(match_idx)
+        resultado.append(match_idx)
+    return resultado
+
+
+def _casar_nuevo(pto_codigos, pto_nombres, lineas):
+    macheador = MacheadorPresupuesto(pto_codigos, pto_nombres)
+    return [macheador.casar(cod, nom) for cod, nom in lineas]
+
+
+def _presupuesto(rng, n):
+    codigos = [f"{rng.integers(1, 6)}.{rng.integers(1, 30):02d}" for _ in range(n)]
+    nombres = [" ".join(rng.choice(PALABRAS, rng.integers(1, 5))) for _ in range(n)]
+    # Nombres vacíos, cortos y repetidos
+    nombres[:4] = ["", "yeso", nombres[10], nombres[10]]
+    return codigos, nombres
+
+
+def _mutar(rng, texto):
+    if len(texto) < 2:
+        return texto + "x"
+    i = rng.integers(0, len(texto))
+    return texto[:i] + rng.choice(list("aeiosx")) + texto[i + 1:]
+
+
+def _lineas(rng, codigos, nombres, n):
+    lineas = []
+    for _ in range(n):
+        i = rng.integers(0, len(codigos))
+        tipo = rng.integers(0, 6)
+        if tipo == 0:
+            lineas.append((codigos[i], ""))                                  # código exacto
+        elif tipo == 1:
+            lineas.append(("9.99", nombres[i]))                              # nombre exacto
+        elif tipo == 2:
+            palabras = nombres[i].split()
+            lineas.append(("", " ".join(palabras[:max(1, len(palabras) - 1)])))  # parcial (dentro)
+        elif tipo == 3:
+            lineas.append(("", nombres[i] + " " + str(rng.choice(PALABRAS))))   # parcial (contiene)
+        elif tipo == 4:
+            lineas.append(("", _mutar(rng, nombres[i])))                       # difuso
+        else:
+            lineas.append(("", " ".join(rng.choice(PALABRAS, 6))))            # casi nunca casa
+    return lineas
+
+
+def test_macheador_igual_que_las_busquedas_originales():
+    for semilla in range(6):
+        rng = np.random.default_rng(semilla)
+        codigos, nombres = _presupuesto(rng, 120)
+        # Más líneas que presupuesto: se agotan líneas y entran en juego las ya usadas
+        lineas = _lineas(rng, codigos, nombres, 260)
+        assert _casar_nuevo(codigos, nombres, lineas) == _casar_original(codigos, nombres, lineas), semilla
+
+
+def test_macheador_empates_y_lineas_usadas():
+    codigos = ["1.01", "1.01", "1.02", "1.03", "1.04", "1.05"]
+    nombres = ["muro de hormigon", "muro de hormigon", "solera armada", "solera armado", "tabique yeso", "tabique yes"]
+    lineas = [
+        ("1.01", ""), ("1.01", ""), ("1.01", ""),         # la tercera ya no tiene código libre
+        ("", "muro de hormigon"),                         # ni nombre exacto libre -> parcial/difuso
+        ("", "solera armadx"),                            # empate difuso entre "armada" y "armado"
+        ("", "solera armadx"),
+        ("", "tabique yeso y pintura"),                   # parcial: el nombre del presupuesto está dentro
+        ("", "tabique"),
+    ]
+    esperado = _casar_original(codigos, nombres, lineas)
+    assert _casar_nuevo(codigos, nombres, lineas) == esperado
+    assert esperado[:3] == [0, 1, -1]
+
+
+def test_casar_certificacion_desde_el_documento():
+    df_base = pd.DataFrame({"Partida_Codigo": [1.0, "2.01", "2.02"], "Partida_Nombre": ["Excavación  zanja", "Relleno", "Muro"]})
+    df_excel = pd.DataFrame([
+        ["Código", "Capítulo", "Nombre", "CanCert"],
+        [None, "Capítulo", "MOVIMIENTO DE TIERRAS", 5],
+        [1.0, "Partida", "Excavación zanja", "1.234,5"],
+        ["", "Partida", "RELLENO", 3],
+        ["", "Partida", "Sin presupuesto", 2],
+        ["2.02", "Partida", "Muro", 0],
+    ])
+    lineas = lineas_certificacion(df_excel, 0, 2, 3, 1)
+    casadas, huerfanas = casar_certificacion(lineas, df_base)
+    assert casadas == [(0, 1234.5), (1, 3)]
+    assert [h["Nombre Original"] for h in huerfanas] == ["Sin presupuesto"]
@@ -0,0 +1,135 @@
+import numpy as np
+import pandas as pd
+
+from gestion_obras.precios import BuscadorPrecios, IndicePrecios, buscador_precios
+from gestion_obras.texto import tokens
+
+PROVEEDORES = ["Saint-Gobain", "Cementos Pórtland", "Hierros Díaz", "Ferretería López"]
+PRODUCTOS = ["Ladrillo perforado", "Ladrillo hueco doble", "Cemento gris", "Cemento blanco",
+             "Malla electrosoldada", "Arena lavada", "Yeso", "Tubo PVC 110"]
+
+
+def _historico(n, semilla):
+    rng = np.random.default_rng(semilla)
+    return pd.DataFrame({
+        "Proveedor": rng.choice(PROVEEDORES, n),
+        "Descripcion": rng.choice(PRODUCTOS, n),
+        "Codigo_Producto": [f"REF-{i}" for i in rng.integers(0, 30, n)],
+        "Precio_Unitario": rng.integers(1, 40, n) / 4,
+        "Descuento": rng.choice([0.0, 5.0, 10.0], n),
+        "Num_Factura": [f"F{i}" for i in rng.integers(100, 130, n)],
+        "Obra": rng.choice(["Residencial Norte", "Nave Sur"], n),
+    })
+
+
+def _factura(df_hist, semilla):
+    rng = np.random.default_rng(semilla)
+    filas = df_hist.sample(20, random_state=semilla).reset_index(drop=True)
+    filas["Precio_Unitario"] = np.where(rng.random(20) < 0.5, filas["Precio_Unitario"], filas["Precio_Unitario"] + 1)
+    nuevas = pd.DataFrame({"Proveedor": ["Otro"] * 3, "Descripcion": ["Yeso"] * 3, "Precio_Unitario": [1.0] * 3, "Descuento": [0.0] * 3})
+    filas = pd.concat([filas, nuevas], ignore_index=True)
+    # Mayúsculas y espacios de más, como llegan de la IA
+    filas["Descripcion"] = "  " + filas["Descripcion"].str.upper()
+    return filas[["Proveedor", "Descripcion", "Precio_Unitario", "Descuento"]]
+
+
+def _estados_con_mascaras(df_hist, df_fac):
+    # Copia de la comprobación original: dos máscaras sobre el histórico por línea
+    estados = []
+    for _, row in df_fac.iterrows():
+        desc_fac = str(row['Descripcion']).strip().lower()
+        prov_fac = str(row['Proveedor']).strip().lower()
+        precio_fac = float(row['Precio_Unitario'])
+        dto_fac = float(row['Descuento'])
+        match = df_hist[
+            (df_hist['Descripcion'].astype(str).str.strip().str.lower() == desc_fac) &
+            (df_hist['Proveedor'].astype(str).str.strip().str.lower() == prov_fac)
+        ]
+        if match.empty:
+            estados.append("🟢 NUEVO")
+        else:
+            precio_bd = float(match.iloc[-1]['Precio_Unitario'])
+            dto_bd = float(match.iloc[-1]['Descuento'])
+            if abs(precio_fac - precio_bd) > 0.01 or abs(dto_fac - dto_bd) > 0.01:
+                estados.append(f"🟡 CAMBIO PRECIO (Antes: {precio_bd}€ / Dto: {dto_bd}%)")
+            else:
+                estados.append("⚪ SIN CAMBIOS")
+    return estados
+
+
+def _buscar_fila_a_fila(df_hist, consulta):
+    # Referencia: cada término casa por prefijo con alguna palabra de la fila
+    # o, si ninguna palabra del histórico empieza así, contenido en alguna
+    columnas = [c for c in BuscadorPrecios.columnas_huella if c in df_hist.columns]
+    palabras_fila = [set(p for c in columnas for p in tokens(fila[c])) for _, fila in df_hist.iterrows()]
+    vocabulario = set().union(*palabras_fila) if palabras_fila else set()
+    terminos = list(dict.fromkeys(tokens(consulta)))
+    coinciden = []
+    for i, palabras in enumerate(palabras_fila):
+        ok = bool(terminos)
+        for t in terminos:
+            if any(p.startswith(t) for p in vocabulario):
+                ok &= any(p.startswith(t) for p in palabras)
+            else:
+                ok &= len(t) >= 3 and any(t in p for p in palabras)
+        if ok:
+            coinciden.append(i)
+    return coinciden
+
+
+CONSULTAS = ["ladri", "LADRILLO hueco", "cemento pórtland", "portland gris", "ntos", "ref-1", "f12 nave",
+             "díaz malla", "lavad", "inexistente", "pvc 110 norte", "ie"]
+
+
+def test_clasificar_igual_que_las_mascaras():
+    df_hist = _historico(400, 1)
+    df_fac = _factura(df_hist, 2)
+    assert IndicePrecios().sincronizar(df_hist).clasificar(df_fac) == _estados_con_mascaras(df_hist, df_fac)
+
+
+def test_buscar_igual_que_fila_a_fila():
+    df_hist = _historico(300, 3)
+    buscador = BuscadorPrecios().sincronizar(df_hist)
+    for consulta in CONSULTAS:
+        posiciones, total = buscador.buscar(consulta, limite=0)
+        assert posiciones.tolist() == _buscar_fila_a_fila(df_hist, consulta), consulta
+        assert total == len(posiciones)
+
+
+def test_anexo_incremental_igual_que_reconstruir():
+    df_hist = _historico(300, 4)
+    ampliado = pd.concat([df_hist, _historico(50, 5)], ignore_index=True)
+    df_fac = _factura(ampliado, 6)
+    for clase in (IndicePrecios, BuscadorPrecios):
+        base = clase().sincronizar(df_hist)
+        incremental = base.sincronizar(ampliado)
+        completo = clase().sincronizar(ampliado)
+        # El índice de partida no se toca: sigue respondiendo por sus 300 filas
+        assert incremental is not base and base.filas == 300 and incremental.filas == 350
+        assert base.sincronizar(df_hist) is base
+        if clase is IndicePrecios:
+            assert incremental.clasificar(df_fac) == completo.clasificar(df_fac)
+            assert base.clasificar(df_fac) == IndicePrecios().sincronizar(df_hist).clasificar(df_fac)
+        else:
+            for consulta in CONSULTAS:
+                assert incremental.buscar(consulta, limite=0)[0].tolist() == completo.buscar(consulta, limite=0)[0].tolist()
+                assert base.buscar(consulta, limite=0)[0].max(initial=-1) < 300
+
+    # Una fila cambiada (no es un anexo): se construye de cero
+    cambiado = ampliado.copy()
+    cambiado.loc[0, "Descripcion"] = "Grava"
+    reconstruido = BuscadorPrecios().sincronizar(df_hist).sincronizar(cambiado)
+    assert reconstruido.buscar("grava")[0].tolist() == [0]
+
+
+def test_sesiones_con_versiones_distintas_no_se_pisan():
+    df_hist = _historico(200, 7)
+    ampliado = pd.concat([df_hist, _historico(20, 8)], ignore_index=True)
+    nombre = "Historico_Prueba_Sesiones"
+    nueva = buscador_precios(ampliado, nombre)
+    # Una sesión con la copia anterior (más corta) recibe su versión sin reconstruir la otra
+    vieja = buscador_precios(df_hist, nombre)
+    assert (vieja.filas, nueva.filas) == (200, 220)
+    assert buscador_precios(ampliado, nombre) is nueva
+    assert buscador_precios(df_hist, nombre) is vieja
+    assert nueva.buscar("ladrillo", limite=0)[1] >= vieja.buscar("ladrillo", limite=0)[1]
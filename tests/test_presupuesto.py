@@ -0,0 +1,133 @@
+import io
+
+import numpy as np
+import pandas as pd
+
+from gestion_obras.presupuesto import (
+    clasificar_hoja, ensamblar_presupuesto, indices_columnas, parsear_presupuesto, parsear_presupuesto_paralelo,
+)
+
+IDX = indices_columnas("A", "B", "C", "D", "E", "F", "G")
+
+
+def _parsear_original(hojas, idx, gg_bi, baja):
+    # Copia del bucle original (iterrows) sobre las pestañas ya leídas
+    idx_c, idx_u, idx_t, idx_can, idx_p = idx["codigo"], idx["unidad"], idx["texto"], idx["cantidad"], idx["precio"]
+    idx_cost, idx_cc = idx["coste"], idx["cod_control"]
+    filas_procesadas = []
+    for df_h in hojas:
+        capitulo_actual = "Sin Capítulo"
+        for index, row in df_h.iterrows():
+            if len(row) <= max(idx_c, idx_u, idx_t, idx_can, idx_p): continue
+
+            codigo_val = str(row[idx_c]).strip() if pd.notna(row[idx_c]) else ""
+            if codigo_val.endswith('.0'): codigo_val = codigo_val[:-2]
+
+            texto_val = str(row[idx_t]).strip() if pd.notna(row[idx_t]) else ""
+            precio_raw = str(row[idx_p]).replace(".", "").replace(",", ".") if isinstance(row[idx_p], str) else row[idx_p]
+            precio_val = pd.to_numeric(precio_raw, errors='coerce')
+
+            if codigo_val.lower() == "nan": codigo_val = ""
+            if texto_val.lower() == "nan": texto_val = ""
+            if "código" in codigo_val.lower() or "codigo" in codigo_val.lower(): continue
+
+            cod_control_asignado = ""
+            if idx_cc != -1 and len(row) > idx_cc:
+                cc_raw = str(row[idx_cc]).strip() if pd.notna(row[idx_cc]) else ""
+                if cc_raw.endswith('.0'): cc_raw = cc_raw[:-2]
+                if cc_raw.lower() != "nan": cod_control_asignado = cc_raw
+
+            if codigo_val and texto_val and pd.isna(precio_val):
+                capitulo_actual = texto_val
+            elif codigo_val and pd.notna(precio_val):
+                cantidad = pd.to_numeric(row[idx_can], errors='coerce')
+                if pd.isna(cantidad): cantidad = 0.0
+
+                coste = 0.0
+                if idx_cost != -1 and len(row) > idx_cost:
+                    coste_val = pd.to_numeric(row[idx_cost], errors='coerce')
+                    if pd.notna(coste_val): coste = coste_val
+
+                pr_pres = float(precio_val)
+                precio_licitacion = pr_pres * (1 + (gg_bi / 100.0))
+                precio_adjudicado = precio_licitacion * (1 - (baja / 100.0))
+                importe_total = cantidad * precio_adjudicado
+
+                filas_procesadas.append({
+                    "Cod_Control": cod_control_asignado, "Capítulo": capitulo_actual,
+                    "Partida_Codigo": codigo_val, "Partida_Nombre": texto_val,
+                    "Partida_Descripcion": texto_val, "Unidad": str(row[idx_u]) if pd.notna(row[idx_u]) and str(row[idx_u]) != "nan" else "",
+                    "Cantidad_Proyecto": cantidad, "PrPres": pr_pres,
+                    "Precio_Licitacion": precio_licitacion, "Precio_Adjudicado": precio_adjudicado,
+                    "Coste": coste, "Importe_Total_Adjudicado": importe_total
+                })
+            elif not codigo_val and pd.isna(precio_val) and texto_val:
+                if filas_procesadas: filas_procesadas[-1]["Partida_Descripcion"] += "\n" + texto_val
+    return pd.DataFrame(filas_procesadas)
+
+
+def _pestanas():
+    viviendas = pd.DataFrame([
+        ["Código", "Ud", "Resumen", "Cantidad", "Precio", "Coste", "CC"],
+        ["01", None, "MOVIMIENTO DE TIERRAS", None, None, None, None],
+        ["01.01", "m3", "Excavación en zanja", 120.5, 12.3, 9.0, 1.0],
+        [None, None, "en terreno compacto", None, None, None, None],
+        [None, None, "con medios mecánicos", None, None, None, None],
+        ["01.02", "m3", "Relleno", "15", "1.234,56", "nan", "2"],
+        [1.0, np.nan, "ESTRUCTURA", np.nan, np.nan, np.nan, np.nan],
+        [2.03, "kg", "Acero B500S", None, 1.1, None, 3.0],
+        [None, None, None, None, None, None, None],
+    ])
+    # La segunda pestaña empieza con una continuación de la última partida de la primera
+    comunes = pd.DataFrame([
+        [None, None, "y despuntes", None, None, None, None],
+        ["02", "", "ALBAÑILERÍA", None, None, None, None],
+        ["02.01", "m2", "Tabique", 30, "7,5", 4, None],
+        ["02.02", "ud", "nan", 2, 3, 0, "4.0"],
+    ])
+    # Más estrecha que las columnas pedidas: no aporta filas
+    estrecha = pd.DataFrame([["03.01", "ud", "Buzón"]])
+    # Sin capítulo al principio
+    trasteros = pd.DataFrame([
+        ["04.01", "ud", "Puerta trastero", 12, 150, 90, 5],
+        ["04.02", "ud", "Luminaria", 12.0, 20.25, None, None],
+        ["Codigo", "x", "cabecera repetida", 1, 1, 1, 1],
+    ])
+    return {"Viviendas": viviendas, "Elementos comunes": comunes, "Estrecha": estrecha, "Trasteros": trasteros}
+
+
+def test_presupuesto_igual_que_el_bucle_original():
+    hojas = list(_pestanas().values())
+    for idx in (IDX, indices_columnas("A", "B", "C", "D", "E", "No disponible", "No disponible")):
+        esperado = _parsear_original(hojas, idx, 13.0, 8.5)
+        obtenido = ensamblar_presupuesto([clasificar_hoja(df, idx) for df in hojas], 13.0, 8.5)
+        pd.testing.assert_frame_equal(obtenido, esperado)
+        assert obtenido["Partida_Descripcion"].iloc[2] == "Acero B500S\ny despuntes"
+
+    # Solo enteros en cantidades y costes: los tipos tienen que salir iguales
+    enteros = [pd.DataFrame([["05.01", "ud", "Grifo", 3, 40, 25, 6], ["05.02", "ud", "Lavabo", 2, 90, 60, 6]])]
+    pd.testing.assert_frame_equal(ensamblar_presupuesto([clasificar_hoja(df, IDX) for df in enteros], 0.0, 0.0),
+                                  _parsear_original(enteros, IDX, 0.0, 0.0))
+
+
+def _libro(pestanas):
+    buffer = io.BytesIO()
+    with pd.ExcelWriter(buffer, engine="openpyxl") as w:
+        for nombre, df in pestanas.items():
+            df.to_excel(w, sheet_name=nombre, header=False, index=False)
+    return buffer.getvalue()
+
+
+def test_paralelo_igual_que_secuencial_y_errores_por_pestana():
+    pestanas = _pestanas()
+    contenido = _libro(pestanas)
+    hojas = list(pestanas)
+    secuencial = parsear_presupuesto(io.BytesIO(contenido), hojas, IDX, 13.0, 8.5)
+    for paralelo in (True, False):
+        df, errores = parsear_presupuesto_paralelo(contenido, hojas, IDX, 13.0, 8.5, paralelo=paralelo)
+        assert errores == {}
+        pd.testing.assert_frame_equal(df, secuencial)
+
+    df, errores = parsear_presupuesto_paralelo(contenido, ["Viviendas", "No existe", "Trasteros"], IDX, 13.0, 8.5)
+    assert list(errores) == ["No existe"]
+    pd.testing.assert_frame_equal(df, parsear_presupuesto(io.BytesIO(contenido), ["Viviendas", "Trasteros"], IDX, 13.0, 8.5))